@@ -0,0 +1,237 @@
+"""
+Benchmark suite for the ingestion, statistics and insight pipeline.
+
+Generates synthetic Zameen-like datasets, times every pipeline stage, measures its peak
+traced memory and writes the results to JSON so runs can be compared.
+
+Usage:
+    python benchmarks/bench_pipeline.py --sizes 10k 100k
+    python benchmarks/bench_pipeline.py --sizes 10k --compare benchmarks/results/baseline.json
+"""
+import argparse
+import gc
+import json
+import logging
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'main'))
+
+from analysis import preprocess_rental_data  # noqa: E402
+from statistical_analysis import calculate_descriptive_stats, perform_regression_analysis  # noqa: E402
+from summary import get_market_insights  # noqa: E402
+
+DEFAULT_SIZES = ['10k', '100k', '1M', '10M']
+RESULTS_DIR = ROOT / 'benchmarks' / 'results'
+
+CITIES = ['Lahore', 'Karachi', 'Islamabad', 'Rawalpindi', 'Faisalabad', 'Multan', 'Peshawar', 'Gujranwala']
+SOCIETY_PREFIXES = ['DHA Phase', 'Bahria Town Phase', 'Askari', 'Gulberg', 'Model Town', 'Johar Town',
+                    'G-', 'F-', 'E-', 'I-', 'Wapda Town', 'Citi Housing']
+BLOCK_SUFFIXES = ['Block A', 'Block B', 'Block C', 'Sector E', 'Sector F', 'Precinct 12', 'Extension']
+DETAIL_WORDS = ['Fully Furnished', 'Semi Furnished', 'Upper Portion', 'Lower Portion', 'Sea Facing',
+                'Brand New', 'House', 'Apartment', 'Flat', 'For Rent', 'Available', 'Prime Location',
+                'Corner', 'Park Facing', '1 Kanal', '10 Marla', 'Bungalow', 'Separate Entrance']
+
+
+def parse_size(size: str) -> int:
+    """Convert '10k' / '1M' style sizes to row counts."""
+    size = size.strip().lower()
+    multiplier = {'k': 1_000, 'm': 1_000_000}.get(size[-1], 1)
+    return int(float(size.rstrip('km')) * multiplier)
+
+
+def make_locations(n_locations: int, rng: np.random.Generator) -> np.ndarray:
+    """Build 'child, parent' location strings with a Zameen-like hierarchy."""
+    locations = set()
+    while len(locations) < n_locations:
+        city = rng.choice(CITIES)
+        society = f"{rng.choice(SOCIETY_PREFIXES)}{rng.integers(1, 20)}"
+        if rng.random() < 0.4:
+            locations.add(f"{society}, {city}")
+        else:
+            locations.add(f"{society} - {rng.choice(BLOCK_SUFFIXES)}, {society}")
+    return np.array(sorted(locations), dtype=object)
+
+
+def generate_dataset(n_rows: int, seed: int = 0, n_locations: int = 2000) -> pd.DataFrame:
+    """
+    Generate a raw rentals dataset with the same columns and string formats as the scrape.
+
+    Args:
+        n_rows: Number of listings
+        seed: Random seed
+        n_locations: Number of distinct locations (Zipf-distributed popularity)
+
+    Returns:
+        pd.DataFrame: Raw dataset ready for preprocess_rental_data
+    """
+    rng = np.random.default_rng(seed)
+    locations = make_locations(n_locations, rng)
+    popularity = 1.0 / np.arange(1, n_locations + 1)
+    location_idx = rng.choice(n_locations, size=n_rows, p=popularity / popularity.sum())
+
+    bedrooms = rng.choice([1, 2, 3, 4, 5, 6, 7, 8], size=n_rows, p=[0.08, 0.2, 0.34, 0.12, 0.15, 0.06, 0.03, 0.02])
+    marla = np.clip(bedrooms * rng.uniform(1.5, 4.0, n_rows), 1, 80).round(1)
+    washrooms = np.clip(bedrooms + rng.integers(-1, 3, n_rows), 1, 10)
+
+    # Rent grows with size and varies by location
+    location_factor = rng.lognormal(0, 0.5, n_locations)[location_idx]
+    price = np.round(marla * 9000 * location_factor * rng.lognormal(0, 0.3, n_rows), -3)
+    price_strings = np.where(
+        price >= 10_000_000, np.char.add(np.char.mod('%.1f', price / 10_000_000), ' Crore'),
+        np.where(price >= 100_000, np.char.add(np.char.mod('%.1f', price / 100_000), ' Lakh'),
+                 np.char.add(np.char.mod('%.0f', price / 1_000), ' Thousand'))
+    )
+
+    marla_strings = marla.astype(str).astype(object)
+    kanal_rows = rng.random(n_rows) < 0.02
+    marla_strings[kanal_rows] = [f"{m / 20:.1f} Kanal" for m in marla[kanal_rows]]
+
+    washroom_strings = washrooms.astype(str).astype(object)
+    washroom_strings[rng.random(n_rows) < 0.02] = ''
+
+    words = np.array(DETAIL_WORDS, dtype=object)
+    details = [' '.join(words[rng.choice(len(words), size=4, replace=False)]) for _ in range(min(n_rows, 50_000))]
+    details = np.array(details, dtype=object)[rng.integers(0, len(details), n_rows)]
+
+    return pd.DataFrame({
+        'Price': price_strings.astype(object),
+        'Currency': 'PKR',
+        'Location': locations[location_idx],
+        'Bedrooms': bedrooms.astype(str).astype(object),
+        'Washrooms': washroom_strings,
+        'Marla': marla_strings,
+        'Details': details
+    })
+
+
+def measure(func: Callable, repeat: int, track_memory: bool) -> Dict:
+    """Time a callable (best of `repeat`) and optionally record its peak traced memory."""
+    runs = []
+    result = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        result = func()
+        runs.append({'wall': time.perf_counter() - start, 'cpu': time.process_time() - cpu_start})
+
+    peak_mb = None
+    if track_memory:
+        gc.collect()
+        tracemalloc.start()
+        func()
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+
+    return {
+        'seconds': min(run['wall'] for run in runs),
+        'cpu_seconds': min(run['cpu'] for run in runs),
+        'runs': runs,
+        'peak_mb': peak_mb,
+        'result': result
+    }
+
+
+def run_benchmarks(sizes: List[str], repeat: int, track_memory: bool, seed: int) -> List[Dict]:
+    """Run every pipeline stage for every dataset size."""
+    results = []
+    for size in sizes:
+        n_rows = parse_size(size)
+        raw = generate_dataset(n_rows, seed=seed)
+
+        stages = [
+            ('preprocess_rental_data', lambda: preprocess_rental_data(raw)),
+            ('preprocess_rental_data_compact', lambda: preprocess_rental_data(raw, compact=True, location_hierarchy=True)),
+        ]
+        cleaned = None
+        for name, func in stages:
+            outcome = measure(func, repeat, track_memory)
+            # Downstream stages run on the frame the dashboard uses
+            cleaned = outcome.pop('result')
+            results.append(dict(outcome, size=size, rows=n_rows, stage=name))
+            print(f"{size:>6} {name:<36} {outcome['seconds']:9.3f}s  peak {outcome['peak_mb'] or 0:9.1f} MB")
+
+        stages = [
+            ('calculate_descriptive_stats', lambda: calculate_descriptive_stats(cleaned)),
+            ('perform_regression_analysis', lambda: perform_regression_analysis(cleaned, 'Price', ['Marla', 'Bedrooms'])),
+            ('perform_regression_analysis_lean',
+             lambda: perform_regression_analysis(cleaned, 'Price', ['Marla', 'Bedrooms'], lean=True)),
+            ('get_market_insights', lambda: get_market_insights(cleaned)),
+        ]
+        for name, func in stages:
+            outcome = measure(func, repeat, track_memory)
+            outcome.pop('result')
+            results.append(dict(outcome, size=size, rows=n_rows, stage=name))
+            print(f"{size:>6} {name:<36} {outcome['seconds']:9.3f}s  peak {outcome['peak_mb'] or 0:9.1f} MB")
+
+        del raw, cleaned
+        gc.collect()
+    return results
+
+
+def environment_info() -> Dict:
+    """Describe the machine and code version a run was made on."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__
+    }
+
+
+def compare(current: List[Dict], baseline_path: Path) -> None:
+    """Print the speed ratio of each stage against a saved run."""
+    baseline = {(r['size'], r['stage']): r for r in json.loads(baseline_path.read_text())['results']}
+    print(f"\nComparison with {baseline_path}")
+    for result in current:
+        previous = baseline.get((result['size'], result['stage']))
+        if previous is None:
+            continue
+        ratio = result['seconds'] / previous['seconds'] if previous['seconds'] else float('nan')
+        print(f"{result['size']:>6} {result['stage']:<36} {previous['seconds']:9.3f}s -> "
+              f"{result['seconds']:9.3f}s  ({ratio:.2f}x)")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', default=DEFAULT_SIZES, help="Dataset sizes, e.g. 10k 100k 1M")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per stage (best is reported)")
+    parser.add_argument('--no-memory', action='store_true', help="Skip the tracemalloc peak-memory pass")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=Path, help="Results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument('--compare', type=Path, help="Earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    results = run_benchmarks(args.sizes, args.repeat, not args.no_memory, args.seed)
+
+    output = args.output or RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({'environment': environment_info(), 'results': results}, indent=2))
+    print(f"\nSaved results to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
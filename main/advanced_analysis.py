@@ -6,7 +6,9 @@ from sklearn.metrics import mean_squared_error, r2_score
 import plotly.express as px
 import plotly.graph_objects as go
 from typing import Dict, Tuple
+from instrumentation import instrument
 
+@instrument()
 def calculate_confidence_intervals(df: pd.DataFrame, column: str, confidence_level: float = 0.95) -> Dict:
     """
     Calculate confidence intervals for a given column.
@@ -38,6 +40,7 @@ def calculate_confidence_intervals(df: pd.DataFrame, column: str, confidence_lev
         'margin': margin
     }
 
+@instrument()
 def analyze_distribution(df: pd.DataFrame, column: str) -> Dict:
     """
     Analyze the probability distribution of a column.
@@ -70,6 +73,7 @@ def analyze_distribution(df: pd.DataFrame, column: str) -> Dict:
         'norm_params': params
     }
 
+@instrument()
 def create_distribution_plots(df: pd.DataFrame, column: str) -> Dict[str, go.Figure]:
     """
     Create probability distribution plots.
@@ -140,6 +144,7 @@ def create_distribution_plots(df: pd.DataFrame, column: str) -> Dict[str, go.Fig
         'cdf': fig_cdf
     }
 
+@instrument()
 def perform_regression_analysis(df: pd.DataFrame, target: str, features: list) -> Dict:
     """
     Perform multiple regression analysis.
@@ -193,6 +198,7 @@ def perform_regression_analysis(df: pd.DataFrame, target: str, features: list) -
         }
     }
 
+@instrument()
 def create_regression_plots(df: pd.DataFrame, target: str, features: list) -> Dict[str, go.Figure]:
     """
     Create regression analysis plots.
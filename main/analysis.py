@@ -1,16 +1,46 @@
 import pandas as pd
 import numpy as np
-from typing import Optional, Tuple, Dict, Union
+from typing import NamedTuple, Optional, Tuple, Dict, Union, Iterable
 from utils import parse_price, parse_marla
+from locations import add_location_hierarchy
+from duplicates import NearDuplicateIndex
+from keywords import KEYWORD_FEATURES, extract_keyword_features
+from instrumentation import instrument
 import matplotlib.pyplot as plt
 import seaborn as sns
 import plotly.express as px
 import streamlit as st
 
+# Numeric columns parsed from the scrape and median-imputed
+NUMERIC_COLUMNS = ['Price', 'Marla', 'Bedrooms', 'Washrooms']
+# Whole-number columns; their imputed medians are rounded
+COUNT_COLUMNS = ['Bedrooms', 'Washrooms']
+IMPUTATION_MODES = ('global', 'hierarchical')
+# Hierarchical imputation falls back from the location to the city to the overall median
+IMPUTATION_LEVELS = ['Location', 'City']
+# Groups with fewer observed values defer to the next level
+MIN_IMPUTATION_GROUP = 3
+# Boolean column set by flag_outliers
+OUTLIER_COLUMN = 'Outlier'
+OUTLIER_METHODS = ('iqr', 'mad')
+# Fence width in IQRs (iqr) or robust standard deviations (mad) on the log10 scale
+DEFAULT_OUTLIER_K = 3.0
+# Groups with fewer listings are judged against the fences over all listings
+MIN_OUTLIER_GROUP = 10
+# Scales the MAD of normal data to its standard deviation
+MAD_SCALE = 1.4826
+
+@instrument()
 def preprocess_rental_data(
     data: Union[str, pd.DataFrame],
     save_cleaned: bool = False,
-    output_path: Optional[str] = None
+    output_path: Optional[str] = None,
+    compact: bool = False,
+    location_hierarchy: bool = False,
+    outliers: Optional[str] = None,
+    imputation: str = 'global',
+    near_duplicates: bool = False,
+    keyword_features: bool = False
 ) -> pd.DataFrame:
     """
     Preprocess the rental dataset by cleaning and transforming the data.
@@ -19,6 +49,14 @@ def preprocess_rental_data(
         data: Either a path to the input CSV file or a DataFrame
         save_cleaned: Whether to save the cleaned dataset
         output_path: Path where to save the cleaned dataset (if save_cleaned is True)
+        compact: Whether to convert the result to the compact schema (see compact_schema)
+        location_hierarchy: Whether to add the City, Society and Block columns parsed from Location
+        outliers: Fence method ('iqr' or 'mad') for the Outlier flag column; not added when None
+        imputation: 'global' fills missing values with the column median, 'hierarchical' with
+            the median of the location, then the city (with location_hierarchy), then overall
+        near_duplicates: Whether to also remove re-posted listings with reworded Details
+            (see NearDuplicateIndex)
+        keyword_features: Whether to add the boolean KEYWORD_FEATURES columns parsed from Details
     
     Returns:
         pd.DataFrame: Cleaned and preprocessed dataset
@@ -32,6 +70,52 @@ def preprocess_rental_data(
     # 1. Remove exact duplicates
     df = df.drop_duplicates()
     
+    # 2-4. Parse Price and Marla, convert Bedrooms and Washrooms to numeric
+    df = parse_listing_columns(df)
+    
+    # 5. Remove near duplicates, keeping the first listing of each group
+    if near_duplicates:
+        df = df[~NearDuplicateIndex().add(df)]
+    
+    if imputation not in IMPUTATION_MODES:
+        raise ValueError(f"Unknown imputation mode: {imputation!r}")
+    
+    # 6. Parse the location hierarchy once at ingestion
+    if location_hierarchy:
+        df = add_location_hierarchy(df)
+    
+    # 7. Impute missing values using medians
+    df = impute_missing(df, tables=imputation_tables(df) if imputation == 'hierarchical' else None)
+    
+    # 8. Flag price outliers per location once, so views only apply a mask
+    if outliers is not None:
+        df[OUTLIER_COLUMN] = flag_outliers(df, outlier_fences(df, method=outliers))
+    
+    # 9. Derive keyword features (furnishing, portion, facing, ...) from Details
+    if keyword_features:
+        df[KEYWORD_FEATURES] = extract_keyword_features(df['Details'])
+    
+    # Save the cleaned dataset if requested
+    if save_cleaned and output_path:
+        df.to_csv(output_path, index=False)
+    
+    # 10. Optionally shrink the in-memory layout
+    if compact:
+        df = compact_schema(df)
+    
+    return df
+
+@instrument()
+def parse_listing_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Parse the scraped string columns into numbers (modifies df in place).
+    
+    Args:
+        df: Raw listings
+    
+    Returns:
+        pd.DataFrame: The same DataFrame with numeric Price, Marla, Bedrooms and Washrooms
+    """
     # 2. Parse 'Price' column
     df['Price'] = df['Price'].apply(parse_price)
     
@@ -41,19 +125,257 @@ def preprocess_rental_data(
     # 4. Convert 'Bedrooms' and 'Washrooms' to numeric
     df['Bedrooms'] = pd.to_numeric(df['Bedrooms'], errors='coerce')
     df['Washrooms'] = pd.to_numeric(df['Washrooms'], errors='coerce')
+    return df
+
+class ImputationTables(NamedTuple):
+    """Median of every numeric column per group of each imputation level, plus overall medians."""
+    levels: Dict[str, pd.DataFrame]
+    overall: Dict[str, float]
+
+@instrument()
+def imputation_tables(
+    df: pd.DataFrame,
+    levels: Iterable[str] = IMPUTATION_LEVELS,
+    min_group_size: int = MIN_IMPUTATION_GROUP
+) -> ImputationTables:
+    """
+    Compute the median tables for hierarchical imputation with one groupby per level.
+    
+    Missing values are skipped, so the tables hold medians of the observed values. Medians
+    of groups with fewer than min_group_size observed values are left missing, and so are
+    levels whose column is not in df.
+    
+    Args:
+        df: DataFrame with the parsed numeric columns (before imputation)
+        levels: Grouping columns, most specific first
+        min_group_size: Observed values a group needs for a median of its own
     
-    # 5. Impute missing values using median
-    numeric_columns = ['Price', 'Marla', 'Bedrooms', 'Washrooms']
-    for col in numeric_columns:
-        median_value = df[col].median()
+    Returns:
+        ImputationTables: Per-level tables indexed by label, and the overall medians
+    """
+    tables = {}
+    for level in levels:
+        if level not in df.columns:
+            continue
+        grouped = df.groupby(level, observed=True)[NUMERIC_COLUMNS]
+        medians = grouped.median().where(grouped.count() >= min_group_size)
+        medians[COUNT_COLUMNS] = medians[COUNT_COLUMNS].round()
+        medians.index = pd.Index(medians.index.astype(object), name=level)
+        tables[level] = medians
+    overall = {col: float(df[col].median()) for col in NUMERIC_COLUMNS}
+    overall.update({col: float(np.round(overall[col])) for col in COUNT_COLUMNS if not np.isnan(overall[col])})
+    return ImputationTables(tables, overall)
+
+def impute_missing(
+    df: pd.DataFrame,
+    medians: Optional[Dict[str, float]] = None,
+    tables: Optional[ImputationTables] = None
+) -> pd.DataFrame:
+    """
+    Fill missing numeric values with medians (modifies df in place).
+    
+    With imputation tables, a value is filled with the median of its location, then of its
+    city, and only then with the overall median. Tables are computed once per full load and
+    applied as they are to later increments.
+    
+    Args:
+        df: DataFrame with the parsed numeric columns
+        medians: Overall medians to use per column; taken from tables, or computed from df,
+            when None (incremental refreshes pass medians of the whole dataset)
+        tables: Imputation tables from imputation_tables; only overall medians when None
+    
+    Returns:
+        pd.DataFrame: The same DataFrame without missing numeric values
+    """
+    if tables is not None:
+        medians = tables.overall if medians is None else medians
+        for level, table in tables.levels.items():
+            if level not in df.columns:
+                continue
+            positions = table.index.get_indexer(np.asarray(df[level], dtype=object))
+            for col in NUMERIC_COLUMNS:
+                missing = df[col].isna().to_numpy() & (positions >= 0)
+                if missing.any():
+                    values = df[col].to_numpy(dtype=np.float64, copy=True)
+                    values[missing] = table[col].to_numpy()[positions[missing]]
+                    df[col] = values
+    
+    for col in NUMERIC_COLUMNS:
+        median_value = df[col].median() if medians is None else medians[col]
         df[col] = df[col].fillna(median_value)
+    return df
+
+class OutlierFences(NamedTuple):
+    """Lower and upper log10 fences of a column per group, with fences over all rows as fallback."""
+    column: str
+    group: str
+    by_group: pd.DataFrame
+    lower: float
+    upper: float
+
+def _log_values(df: pd.DataFrame, column: str) -> np.ndarray:
+    # Zero and negative prices map to -inf and always fall below the lower fence
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logs = np.log10(df[column].to_numpy(dtype=np.float64))
+    return np.where(np.isnan(logs), -np.inf, logs)
+
+@instrument()
+def outlier_fences(
+    df: pd.DataFrame,
+    column: str = 'Price',
+    group: str = 'Location',
+    method: str = 'iqr',
+    k: float = DEFAULT_OUTLIER_K,
+    min_group_size: int = MIN_OUTLIER_GROUP
+) -> OutlierFences:
+    """
+    Compute outlier fences of a column per group with one vectorized groupby.
     
-    # Save the cleaned dataset if requested
-    if save_cleaned and output_path:
-        df.to_csv(output_path, index=False)
+    Fences are computed on log10 values, since rents are right-skewed: 'iqr' uses
+    Q1 - k*IQR and Q3 + k*IQR, 'mad' uses median ± k*1.4826*MAD. Groups smaller than
+    min_group_size or without spread are left out of by_group and use the overall fences.
+    
+    Args:
+        df: Cleaned listings
+        column: Numeric column to fence
+        group: Column to group by
+        method: 'iqr' or 'mad'
+        k: Fence width
+        min_group_size: Listings a group needs for fences of its own
+    
+    Returns:
+        OutlierFences: Per-group and overall fences
+    
+    Raises:
+        ValueError: If the method is unknown
+    """
+    if method not in OUTLIER_METHODS:
+        raise ValueError(f"Unknown outlier method: {method!r}")
+    logs = pd.Series(_log_values(df, column), index=df.index)
+    logs = logs[np.isfinite(logs)]
+    keys = df.loc[logs.index, group]
+    
+    if method == 'iqr':
+        quartiles = logs.groupby(keys, observed=True).quantile([0.25, 0.75]).unstack()
+        spread = quartiles[0.75] - quartiles[0.25]
+        by_group = pd.DataFrame({'lower': quartiles[0.25] - k * spread, 'upper': quartiles[0.75] + k * spread})
+        q1, q3 = logs.quantile([0.25, 0.75])
+        lower, upper = q1 - k * (q3 - q1), q3 + k * (q3 - q1)
+    else:
+        medians = logs.groupby(keys, observed=True).median()
+        deviations = (logs - medians.reindex(keys.to_numpy()).to_numpy()).abs()
+        spread = MAD_SCALE * deviations.groupby(keys, observed=True).median()
+        by_group = pd.DataFrame({'lower': medians - k * spread, 'upper': medians + k * spread})
+        median = logs.median()
+        scale = MAD_SCALE * (logs - median).abs().median()
+        lower, upper = median - k * scale, median + k * scale
+    
+    sizes = keys.groupby(keys, observed=True).size()
+    by_group = by_group[(sizes.reindex(by_group.index) >= min_group_size) & (spread > 0)]
+    by_group.index = pd.Index(by_group.index.astype(object), name=group)
+    return OutlierFences(column, group, by_group, float(lower), float(upper))
+
+def flag_outliers(df: pd.DataFrame, fences: OutlierFences) -> np.ndarray:
+    """
+    Flag the rows outside the fences of their group.
+    
+    Args:
+        df: Listings with the fenced column and the group column
+        fences: Fences from outlier_fences (possibly computed on other rows)
+    
+    Returns:
+        np.ndarray: Boolean flag per row (NaN values are not flagged)
+    """
+    values = df[fences.column].to_numpy(dtype=np.float64)
+    logs = _log_values(df, fences.column)
+    positions = fences.by_group.index.get_indexer(np.asarray(df[fences.group], dtype=object))
+    found = positions >= 0
+    lower = np.where(found, fences.by_group['lower'].to_numpy()[positions], fences.lower)
+    upper = np.where(found, fences.by_group['upper'].to_numpy()[positions], fences.upper)
+    return ~np.isnan(values) & ((logs < lower) | (logs > upper))
+
+@instrument()
+def compact_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert a cleaned dataset to a compact columnar layout.
+    
+    Location and Currency become categoricals (integer codes plus one copy of each label),
+    Bedrooms and Washrooms are downcast to the smallest integer type and Marla and Price to
+    float32 whenever the conversion is lossless. Details is stored as an Arrow string column
+    when pyarrow is installed.
+    
+    Args:
+        df: Preprocessed DataFrame containing rental data
+    
+    Returns:
+        pd.DataFrame: DataFrame with the same values in compact dtypes
+    """
+    df = df.copy()
+    
+    for col in ['Location', 'Currency']:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    
+    for col in ['Bedrooms', 'Washrooms']:
+        values = df[col].to_numpy()
+        if np.isfinite(values).all() and np.array_equal(values, np.round(values)):
+            df[col] = pd.to_numeric(df[col].astype(np.int64), downcast='integer')
+    
+    for col in ['Marla', 'Price']:
+        as_float32 = df[col].astype(np.float32)
+        if np.array_equal(as_float32.to_numpy(dtype=np.float64), df[col].to_numpy(dtype=np.float64), equal_nan=True):
+            df[col] = as_float32
+    
+    if 'Details' in df.columns:
+        try:
+            df['Details'] = df['Details'].astype('string[pyarrow]')
+        except ImportError:
+            # pyarrow is optional; keep the object column without it
+            pass
     
     return df
 
+@instrument()
+def apply_filters(
+    df: pd.DataFrame,
+    marla_range: Optional[Tuple[float, float]] = None,
+    bedrooms: Optional[Iterable] = None,
+    locations: Optional[Iterable[str]] = None,
+    cities: Optional[Iterable[str]] = None,
+    exclude_outliers: bool = False,
+    features: Optional[Iterable[str]] = None
+) -> pd.DataFrame:
+    """
+    Select the listings matching the dashboard filters.
+    
+    Args:
+        df: Preprocessed DataFrame containing rental data
+        marla_range: Inclusive (min, max) Marla range
+        bedrooms: Allowed bedroom counts
+        locations: Allowed location names
+        cities: Allowed cities (requires the location hierarchy columns)
+        exclude_outliers: Whether to drop rows flagged in the Outlier column (see flag_outliers)
+        features: Keyword feature columns (see KEYWORD_FEATURES) that must all be set
+    
+    Returns:
+        pd.DataFrame: Filtered DataFrame (filters left as None are not applied)
+    """
+    mask = pd.Series(True, index=df.index)
+    if marla_range is not None:
+        mask &= df['Marla'].between(marla_range[0], marla_range[1])
+    if bedrooms is not None:
+        mask &= df['Bedrooms'].isin(list(bedrooms))
+    if locations is not None:
+        mask &= df['Location'].isin(list(locations))
+    if cities is not None:
+        mask &= df['City'].isin(list(cities))
+    if exclude_outliers and OUTLIER_COLUMN in df.columns:
+        mask &= ~df[OUTLIER_COLUMN]
+    for feature in features or []:
+        mask &= df[feature]
+    return df[mask]
+
+@instrument()
 def create_categorical_plots(df: pd.DataFrame) -> Dict[str, plt.Figure]:
     """
     Create bar charts for categorical variables (Bedrooms, Washrooms, Marla).
@@ -81,6 +403,7 @@ def create_categorical_plots(df: pd.DataFrame) -> Dict[str, plt.Figure]:
     
     return {"categorical_plots": fig_categorical}
 
+@instrument()
 def create_price_distribution_plot(df: pd.DataFrame) -> plt.Figure:
     """
     Create a histogram for price distribution.
@@ -99,6 +422,7 @@ def create_price_distribution_plot(df: pd.DataFrame) -> plt.Figure:
     
     return fig_price
 
+@instrument()
 def create_boxplots(df: pd.DataFrame) -> plt.Figure:
     """
     Create boxplots for Price and Marla.
@@ -120,6 +444,7 @@ def create_boxplots(df: pd.DataFrame) -> plt.Figure:
     
     return fig_box
 
+@instrument()
 def generate_all_visualizations(df: pd.DataFrame) -> Dict[str, plt.Figure]:
     """
     Generate all visualization plots for the dataset.
@@ -2,30 +2,38 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import Theme_css as TH
-from utils import format_price_pakistani as format_price
+from utils import format_price_pakistani as format_price, format_prices_pakistani, plotly_price_ticks
 import plotly.express as px
 import plotly.express as px
 import plotly.graph_objects as go
 import altair as alt
-from analysis import preprocess_rental_data, generate_all_visualizations
+from analysis import generate_all_visualizations, apply_filters
+from keywords import KEYWORD_FEATURES
+from cube import AggregateCube
+from correlation import CorrelationEngine
+from estimators import get_rent_estimator
 from summary import get_market_insights
+from datasets import get_dataset_manager, file_signature
+from catalog import get_dataset_catalog
+from snapshots import SnapshotStore
+from cache import enable_copy_on_write, get_cache, make_key
+from instrumentation import instrument, stage, start_rerun, get_rerun_records, log_rerun_summary
+from profiling import profile_threshold_ms, run_profiled, tag_rerun
+from rendering import FigureJob, get_render_executor
 from statistical_analysis import (
     calculate_descriptive_stats,
     calculate_confidence_intervals as calculate_stats_confidence_intervals,
     analyze_distributions,
-    create_qq_plot,
-    perform_regression_analysis,
-    create_distribution_plots,
-    create_prediction_plot
+    perform_regression_analysis
 )
 import traceback
+import io
+import os
 from pathlib import Path
 import logging
 import sys
 import time
 import random
-import matplotlib.pyplot as plt
-import seaborn as sns
 from advanced_analysis import (
     calculate_confidence_intervals as calculate_advanced_confidence_intervals,
     analyze_distribution,
@@ -39,7 +47,6 @@ from advanced_analysis import (
 #from streamlit_extras.stylable_container import stylable_container
 #import streamlit.components.v1 as components
 
-import statsmodels.api as sm
 
 # Set page config must be the first Streamlit command
 st.set_page_config(
@@ -60,140 +67,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def create_heatmap(df, theme):
-    """Create a correlation heatmap."""
-    fig = plt.figure(figsize=(4.5, 2.7), facecolor='none')  # Set transparent background
-    ax = fig.add_subplot(111)
-    numeric_df = df.select_dtypes(include=[np.number])
-    correlation_matrix = numeric_df.corr()
-    
-    if theme == "Dark":
-        plt.style.use('dark_background')
-        ax.set_facecolor('none')  # Transparent axis background
-        sns.heatmap(correlation_matrix, annot=True, cmap='coolwarm', fmt='.2f', 
-                   linewidths=0.5, cbar_kws={'label': 'Correlation'}, ax=ax,
-                   annot_kws={'color': 'white', 'size': 8})  # Reduced annotation size
-        # Set text colors for dark theme
-        ax.xaxis.label.set_color('white')
-        ax.yaxis.label.set_color('white')
-        ax.title.set_color('white')
-        ax.tick_params(colors='white', labelsize=8)  # Reduced tick label size
-        for spine in ax.spines.values():
-            spine.set_color('white')
-    else:
-        ax.set_facecolor('none')  # Transparent axis background
-        sns.heatmap(correlation_matrix, annot=True, cmap='coolwarm', fmt='.2f', 
-                   linewidths=0.5, cbar_kws={'label': 'Correlation'}, ax=ax,
-                   annot_kws={'color': 'black', 'size': 8})  # Reduced annotation size
-        # Set text colors for light theme
-        ax.xaxis.label.set_color('black')
-        ax.yaxis.label.set_color('black')
-        ax.title.set_color('black')
-        ax.tick_params(colors='black', labelsize=8)  # Reduced tick label size
-        for spine in ax.spines.values():
-            spine.set_color('black')
-    
-    plt.title('Correlation Heatmap of Numeric Features', pad=15, fontsize=12, fontweight='bold')  # Reduced title size
-    plt.tight_layout(pad=1.5)
-    
-    # Set figure background to transparent
-    fig.patch.set_alpha(0.0)
-    ax.patch.set_alpha(0.0)
-    
-    return fig
-
-
-def create_price_distribution(df, theme):
-    """Create price distribution plot."""
-    # Reduce figure size by additional 10%
-    fig = plt.figure(figsize=(7, 3.5), facecolor='none')  # Set transparent background
-    ax = fig.add_subplot(111)
-    
-    if theme == "Dark":
-        plt.style.use('dark_background')
-        ax.set_facecolor('none')  # Transparent axis background
-        plt.hist(df['Price'], bins=30, color='#4CAF50', edgecolor='white', alpha=0.8)
-        # Set text colors for dark theme
-        ax.xaxis.label.set_color('white')
-        ax.yaxis.label.set_color('white')
-        ax.title.set_color('white')
-        ax.tick_params(colors='white')
-        for spine in ax.spines.values():
-            spine.set_color('white')
-    else:
-        ax.set_facecolor('none')  # Transparent axis background
-        plt.hist(df['Price'], bins=30, color='#1f77b4', edgecolor='black', alpha=0.8)
-        # Set text colors for light theme
-        ax.xaxis.label.set_color('black')
-        ax.yaxis.label.set_color('black')
-        ax.title.set_color('black')
-        ax.tick_params(colors='black')
-        for spine in ax.spines.values():
-            spine.set_color('black')
-    
-    plt.title('Price Distribution', pad=15, fontsize=14, fontweight='bold')
-    plt.xlabel('Price', fontsize=11)
-    plt.ylabel('Frequency', fontsize=11)
-    plt.grid(True, alpha=0.2, color='white' if theme == "Dark" else 'black')
-    
-    # Format x-axis ticks in Pakistani numbering system
-    current_values = ax.get_xticks()
-    ax.set_xticklabels([format_price(x) for x in current_values])
-    plt.xticks(rotation=45)  # Rotate labels for better readability
-    
-    # Adjust layout to prevent cutoff
-    plt.tight_layout(pad=1.5)
-    
-    # Set figure background to transparent
-    fig.patch.set_alpha(0.0)
-    ax.patch.set_alpha(0.0)
-    
-    return fig
-
-def create_regression_analysis(df, theme):
-    """Create regression analysis plots."""
-    # Reduce figure size by 15%
-    fig = plt.figure(figsize=(3.5, 2.3), facecolor='none')  # Set transparent background
-    ax = fig.add_subplot(111)
-    
-    if theme == "Dark":
-        plt.style.use('dark_background')
-        ax.set_facecolor('none')  # Transparent axis background
-        sns.regplot(x='Marla', y='Price', data=df, color='#4CAF50', 
-                   scatter_kws={'alpha':0.5, 's': 20}, ax=ax)  # Reduced scatter point size
-        # Set text colors for dark theme
-        ax.xaxis.label.set_color('white')
-        ax.yaxis.label.set_color('white')
-        ax.title.set_color('white')
-        ax.tick_params(colors='white', labelsize=8)  # Reduced tick label size
-        for spine in ax.spines.values():
-            spine.set_color('white')
-    else:
-        ax.set_facecolor('none')  # Transparent axis background
-        sns.regplot(x='Marla', y='Price', data=df, color='#1f77b4', 
-                   scatter_kws={'alpha':0.5, 's': 20}, ax=ax)  # Reduced scatter point size
-        # Set text colors for light theme
-        ax.xaxis.label.set_color('black')
-        ax.yaxis.label.set_color('black')
-        ax.title.set_color('black')
-        ax.tick_params(colors='black', labelsize=8)  # Reduced tick label size
-        for spine in ax.spines.values():
-            spine.set_color('black')
-    
-    plt.title('Price vs Property Size (Marla)', pad=15, fontsize=12, fontweight='bold')  # Reduced title size
-    plt.xlabel('Property Size (Marla)', fontsize=9)  # Reduced label size
-    plt.ylabel('Price (Rs.)', fontsize=9)  # Reduced label size
-    plt.grid(True, alpha=0.2, color='white' if theme == "Dark" else 'black')
-    
-    # Adjust layout to prevent cutoff
-    plt.tight_layout(pad=1.5)
-    
-    # Set figure background to transparent
-    fig.patch.set_alpha(0.0)
-    ax.patch.set_alpha(0.0)
-    
-    return fig
-
 # Error Handling Classes
 class DataLoadError(Exception):
     """Exception raised for errors in loading data."""
@@ -207,53 +80,132 @@ class VisualizationError(Exception):
     """Exception raised for errors in creating visualizations."""
     pass
 
-# Performance optimization: Cache data loading and processing
-@st.cache_data(ttl=3600, show_spinner=True)
-def load_data():
-    """Load and cache the rental data."""
-    try:
-        data_path = Path("data/zameen_rentals_data.csv")
-        if not data_path.exists():
-            raise DataLoadError("Data file not found")
-        
-        df = pd.read_csv(data_path)
-        logger.info(f"Successfully loaded data with {len(df)} rows")
-        return df
-    except Exception as e:
-        logger.error(f"Error loading data: {str(e)}")
-        raise DataLoadError(f"Failed to load data: {str(e)}")
+# Performance optimization: one process-wide cache shared by all sessions; its frames are
+# handed out by reference, so sessions must get copy-on-write semantics
+enable_copy_on_write()
+
+# A CSV file, or a directory of exports (one CSV per city and/or month) served through a catalog
+DATA_PATH_ENV = 'THINKLYTICS_DATA'
+DATA_PATH = Path(os.environ.get(DATA_PATH_ENV, "data/zameen_rentals_data.csv"))
+
+@instrument()
+def get_dataset(cities=None):
+    """
+    Return the current dataset snapshot.
 
-@st.cache_data(ttl=3600, show_spinner=True)
-def process_data(df):
-    """Process and cache the rental data."""
+    For a single file, the dataset manager loads it on the first call and afterwards reloads
+    it in the background when it changes, so a rerun never waits for a reload. For a
+    directory of exports, only the files that can hold the selected cities are combined.
+    """
     try:
-        processed_df = preprocess_rental_data(df)
-        logger.info("Successfully processed data")
-        return processed_df
+        if DATA_PATH.is_dir():
+            return get_dataset_catalog(DATA_PATH).snapshot(cities=cities)
+        return get_dataset_manager(DATA_PATH).current()
+    except FileNotFoundError:
+        raise DataLoadError("Data file not found")
     except Exception as e:
         logger.error(f"Error processing data: {str(e)}")
         raise DataProcessingError(f"Failed to process data: {str(e)}")
 
-def search_locations(df, search_term):
-    """Search locations based on user input."""
+def get_market_trends():
+    """Return the monthly price and volume series of the snapshot store, or None without snapshots."""
+    store = SnapshotStore()
+    signature = file_signature(store.series_path)
+    if signature is None:
+        return None
+    return get_cache().get_or_compute('indexes', ('market_trends', *signature), store.trends)
+
+def cached_result(namespace, key, compute):
+    """Cache a derived result (statistics, insights) for one dataset version and filter state."""
+    return get_cache().get_or_compute(namespace, key, compute)
+
+REGRESSION_FEATURES = ['Marla', 'Bedrooms']
+# Listings shown next to the rent estimate
+COMPARABLE_LISTINGS = 10
+
+def figure_jobs(df, filter_key, theme, correlation_matrix, correlation_method):
+    """Describe every figure of the dashboard for one filter state, keyed by its cache key."""
+    jobs = {
+        ('price_distribution', filter_key, theme): FigureJob('price_distribution', df[['Price']], (theme,)),
+        ('heatmap', correlation_method, filter_key, theme): FigureJob('heatmap', correlation_matrix,
+                                                                      (theme, correlation_method)),
+        ('regression_analysis', filter_key, theme): FigureJob('regression_analysis', df[['Marla', 'Price']], (theme,))
+    }
+    for column in ['Price', 'Marla']:
+        jobs[('qq', column, filter_key, theme)] = FigureJob('qq', df[[column]], (column, theme))
+        jobs[('distribution', column, filter_key, theme)] = FigureJob('distribution', df[[column]], (column, theme))
+    for feature in REGRESSION_FEATURES:
+        jobs[('prediction', feature, filter_key, theme)] = prediction_job(df, feature, theme)
+    return jobs
+
+def prediction_job(df, feature, theme):
+    """Prediction plot of Price on one regression feature; boolean keyword features are fitted as 0/1."""
+    return FigureJob('prediction', df[['Price', feature]].astype({feature: np.float64}), ('Price', feature, theme))
+
+def render_prediction_figures(figures, df, features, filter_key, theme):
+    """Start the prediction plots of selected features that render_figures did not start (keyword features)."""
+    jobs = {('prediction', feature, filter_key, theme): prediction_job(df, feature, theme) for feature in features
+            if ('prediction', feature, filter_key, theme) not in figures}
+    if jobs:
+        figures.update(get_render_executor().render_all(jobs, cache=get_cache()))
+
+def render_figures(df, filter_key, theme, correlation_matrix, correlation_method):
+    """Start rendering all figures of the rerun concurrently; cached figures are returned as is."""
+    with stage('render_figures'):
+        jobs = figure_jobs(df, filter_key, theme, correlation_matrix, correlation_method)
+        return get_render_executor().render_all(jobs, cache=get_cache())
+
+def figure_png(figures, key):
+    """Wait for one figure started by render_figures and return its PNG bytes."""
+    with stage('figure_wait', figure=key[0]):
+        return figures[key].result()
+
+def search_locations(df, search_term, location_cities=None):
+    """Search locations based on user input, optionally only those of some cities (a location -> city Series)."""
+    if isinstance(df['Location'].dtype, pd.CategoricalDtype):
+        # Compact schema: the categories already hold each location once
+        all_locations = df['Location'].cat.categories
+    else:
+        all_locations = df['Location'].unique()
+    if location_cities is not None:
+        all_locations = location_cities.index[location_cities.notna()].intersection(all_locations)
     if not search_term:
-        return sorted(df['Location'].unique())
-    return sorted([loc for loc in df['Location'].unique() if search_term.lower() in loc.lower()])
+        return sorted(all_locations)
+    return sorted([loc for loc in all_locations if search_term.lower() in loc.lower()])
 
+@instrument()
 def main():
     try:
         # Theme selection
         theme = "Dark"  # Set theme to Dark by default
         TH.apply_theme(theme)
         
-        # Add loading spinner
-        with st.spinner("Loading data..."):
-            df = load_data()
-            processed_df = process_data(df)
+        # Start the render processes while the data loads
+        get_render_executor()
         
         # Sidebar with filters
         st.sidebar.markdown("### Filters")
         
+        # With a directory of exports, only the files of the selected cities are loaded
+        cities = None
+        if DATA_PATH.is_dir():
+            cities = st.sidebar.multiselect(
+                "Cities",
+                options=get_dataset_catalog(DATA_PATH).cities(),
+                default=[],
+                help="Only load the exports of these cities (all when empty)",
+                # Cities of unlabelled exports are added once they are loaded; the key keeps the selection
+                key='catalog_cities'
+            ) or None
+        
+        # Add loading spinner
+        with st.spinner("Loading data..."):
+            # One snapshot per rerun, so a reload in the background never mixes versions
+            snapshot = get_dataset(cities)
+            data_key = snapshot.key
+            dataset = snapshot.dataset
+            processed_df = dataset.data
+        
         # Marla range filter
         min_marla = int(processed_df['Marla'].min())
         max_marla = int(processed_df['Marla'].max())
@@ -274,29 +226,85 @@ def main():
         # Location search and filter
         st.sidebar.markdown("### 🔍 Search Locations")
         search_term = st.sidebar.text_input("Type to search locations", "")
-        available_locations = search_locations(processed_df, search_term)
+        # Exports that mix cities can hold other cities' locations; offer only the selected ones
+        location_cities = None
+        if cities is not None and dataset.neighbors.location_cities is not None:
+            location_cities = dataset.neighbors.location_cities
+            location_cities = location_cities[location_cities.isin(cities)]
+        available_locations = search_locations(processed_df, search_term, location_cities)
         
         locations = st.sidebar.multiselect(
             "Select Locations",
             options=available_locations,
             default=available_locations[:10] if len(available_locations) > 10 else available_locations
         )
+        
+        # Outliers are flagged once at ingestion, so excluding them is only a mask
+        exclude_outliers = st.sidebar.checkbox(
+            "Exclude price outliers",
+            value=False,
+            help="Leave out listings whose rent is far outside the usual range of their location"
+        )
+        
+        # Keyword features parsed from the listing titles at ingestion
+        listing_features = st.sidebar.multiselect(
+            "Listing Features",
+            options=[feature for feature in KEYWORD_FEATURES if feature in processed_df.columns],
+            default=[],
+            help="Only show listings whose title mentions all selected features"
+        )
 
+        # Tag profiles of slow reruns with the filter state
+        tag_rerun(marla_range=marla_range, bedrooms=bedrooms, search_term=search_term, locations=locations,
+                  exclude_outliers=exclude_outliers, listing_features=listing_features)
+        
         # Apply filters with error handling
-        try:
-            filtered_df = processed_df[
-                (processed_df['Marla'].between(marla_range[0], marla_range[1])) &
-                (processed_df['Bedrooms'].isin(bedrooms)) &
-                (processed_df['Location'].isin(locations))
-            ]
-            
-            # If filtered_df is empty, show a message and use the full dataset
-            if len(filtered_df) == 0:
-                st.warning("No properties match the selected criteria. Showing all properties.")
-                filtered_df = processed_df.copy()
-        except Exception as e:
-            st.error(f"Error applying filters: {str(e)}")
-            filtered_df = processed_df.copy()
+        with stage('filtering'):
+            try:
+                filtered_df = apply_filters(processed_df, marla_range, bedrooms, locations,
+                                            exclude_outliers=exclude_outliers, features=listing_features)
+                
+                # Headline metrics come from the precomputed cube, not from a scan of filtered_df
+                aggregate_cube = dataset.cube
+                market_stats = aggregate_cube.summarize(
+                    aggregate_cube.select(marla_range, bedrooms, locations, exclude_outliers)
+                )
+                correlation_engine = dataset.correlation
+                correlation_mask = correlation_engine.select(marla_range, bedrooms, locations, exclude_outliers)
+                # Derived results are cached per dataset version and filter state
+                filter_key = make_key(data_key, marla_range, sorted(bedrooms), sorted(locations), exclude_outliers,
+                                      sorted(listing_features))
+                if listing_features and len(filtered_df):
+                    # Keyword features are not cube dimensions; summarize the matching rows instead
+                    market_stats = cached_result('statistics', ('market_stats', filter_key),
+                                                 lambda: AggregateCube(filtered_df).summarize())
+                    correlation_engine = cached_result('statistics', ('correlation_engine', filter_key),
+                                                       lambda: CorrelationEngine(filtered_df))
+                    correlation_mask = None
+                
+                # If filtered_df is empty, show a message and use the full dataset
+                if len(filtered_df) == 0:
+                    st.warning("No properties match the selected criteria. Showing all properties.")
+                    filtered_df = processed_df
+                    market_stats = aggregate_cube.summarize()
+                    correlation_mask = None
+                    filter_key = make_key(data_key, 'all')
+            except Exception as e:
+                st.error(f"Error applying filters: {str(e)}")
+                filtered_df = processed_df
+                market_stats = dataset.cube.summarize()
+                correlation_engine = dataset.correlation
+                correlation_mask = None
+                filter_key = make_key(data_key, 'all')
+        
+        # The correlation matrix is assembled from the engine's per-cell sums, not from the rows;
+        # the method radio in the Analysis tab is rendered later, so read its state here
+        correlation_method = st.session_state.get('correlation_method', 'Pearson').lower()
+        correlation_matrix = cached_result('statistics', ('correlation', correlation_method, filter_key),
+                                           lambda: correlation_engine.correlation(correlation_mask, correlation_method))
+        
+        # Every figure is independent of the others, so render them all in parallel up front
+        figures = render_figures(filtered_df, filter_key, theme, correlation_matrix, correlation_method)
         
         # Main content
         st.markdown('<div class="header-container">', unsafe_allow_html=True)
@@ -314,13 +322,14 @@ def main():
             selected_marla = marla_range[1]  # Use the selected Marla value directly
             avg_bedrooms = np.mean(bedrooms) if bedrooms else processed_df['Bedrooms'].mean()
             
-            # Create a simple linear regression model for prediction
-            X = filtered_df[['Marla', 'Bedrooms']]
-            y = filtered_df['Price']
-            model = sm.OLS(y, sm.add_constant(X)).fit()
-            
-            # Predict price
-            predicted_price = model.predict([1, selected_marla, avg_bedrooms])[0]
+            # The estimator is trained once per dataset version and loaded from disk afterwards;
+            # the spec is priced in every selected location at once, weighted by listings there
+            estimator = get_rent_estimator(dataset)
+            spec_locations = list(locations) or [None]
+            specs = pd.DataFrame({'Marla': selected_marla, 'Bedrooms': avg_bedrooms, 'Location': spec_locations})
+            predictions = estimator.predict(specs)
+            weights = dataset.location_counts.reindex(spec_locations).fillna(1).to_numpy(dtype=np.float64)
+            predicted_price = float(np.average(predictions, weights=weights))
             
             # Display prediction in a styled container
             st.markdown(f"""
@@ -370,25 +379,43 @@ def main():
                     </div>
                 </div>
             """, unsafe_allow_html=True)
+            
+            # Nearest listings to the same spec under the same filters, from the prebuilt index.
+            # Keyed by the query inputs: filter_key collapses every empty filter state into one
+            comparables_key = make_key(data_key, float(selected_marla), float(avg_bedrooms), sorted(locations),
+                                       sorted(bedrooms), exclude_outliers, sorted(listing_features))
+            comparables = cached_result(
+                'statistics', ('comparables', comparables_key),
+                lambda: dataset.neighbors.query(
+                    marla=selected_marla, bedrooms=avg_bedrooms, k=COMPARABLE_LISTINGS,
+                    locations=locations or None, bedroom_counts=bedrooms or None,
+                    exclude_outliers=exclude_outliers, features=listing_features
+                )
+            )
+            if len(comparables):
+                st.markdown('<div class="section-subheader">Comparable Listings</div>', unsafe_allow_html=True)
+                table = comparables[['Location', 'Marla', 'Bedrooms', 'Washrooms', 'Price', 'Details']].copy()
+                table['Price'] = "Rs. " + format_prices_pakistani(table['Price'])
+                st.dataframe(table, hide_index=True, use_container_width=True)
         
         # Key metrics with icons
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            mean_price = filtered_df['Price'].mean()
+            mean_price = market_stats['price_mean']
             formatted_price = format_price(mean_price)
             st.metric("Average Price", f"Rs. {formatted_price}", "Market Overview")
 
 
         with col2:
             st.metric(" Total Properties", 
-                     f"{len(filtered_df):,}",
+                     f"{market_stats['count']:,}",
                      "Based on Filters")
         with col3:
             st.metric(" Top Location", 
-                     filtered_df['Location'].mode()[0],
+                     market_stats['mode_location'],
                      "Location Analysis")
         with col4:
-            avg_bedrooms = int(round(filtered_df['Bedrooms'].mean()))
+            avg_bedrooms = int(round(market_stats['bedrooms_mean']))
             st.metric("Avg. Bedrooms", f"{avg_bedrooms}", "Property Features")
 
         
@@ -400,17 +427,17 @@ def main():
             "Statistics"
         ])
         
-        with tab1:
+        with tab1, stage('tab.trends'):
             st.markdown('<div class="section-header">Market Trends</div>', unsafe_allow_html=True)
             
             # Price Distribution
             st.markdown('<div class="section-subheader">Price Distribution</div>', unsafe_allow_html=True)
-            fig_price = create_price_distribution(filtered_df, theme)
-            st.pyplot(fig_price, use_container_width=True)
+            fig_price = figure_png(figures, ('price_distribution', filter_key, theme))
+            st.image(fig_price, use_container_width=True)
             
             # Location Distribution
             st.markdown('<div class="section-subheader">Location Distribution</div>', unsafe_allow_html=True)
-            location_counts = filtered_df['Location'].value_counts().head(10)
+            location_counts = market_stats['top_locations'].head(10)
             fig_location = px.bar(
                 x=location_counts.index,
                 y=location_counts.values,
@@ -455,6 +482,32 @@ def main():
             )
             st.plotly_chart(fig_location, use_container_width=True)
             
+            # Area Drill-down (precomputed over all listings)
+            st.markdown('<div class="section-subheader">Area Drill-down</div>', unsafe_allow_html=True)
+            location_aggregates = dataset.location_aggregates
+            drill_col1, drill_col2 = st.columns(2)
+            with drill_col1:
+                selected_city = st.selectbox("City", ["All Cities"] + location_aggregates.areas('City'))
+            with drill_col2:
+                societies = (location_aggregates.areas('Society') if selected_city == "All Cities"
+                             else list(location_aggregates.children('Society', selected_city).index))
+                selected_society = st.selectbox("Society", ["All Societies"] + societies)
+            
+            if selected_society != "All Societies":
+                area_table = location_aggregates.top('Block', 10, parent=selected_society)
+            elif selected_city != "All Cities":
+                area_table = location_aggregates.top('Society', 10, parent=selected_city)
+            else:
+                area_table = location_aggregates.top('City', 10)
+            area_table = area_table.drop(columns='Parent', errors='ignore')
+            area_table.columns = ['Listings', 'Mean Price', 'Median Price', 'Q1 Price', 'Q3 Price']
+            st.dataframe(area_table.style.format({'Listings': '{:,.0f}', 'Mean Price': '{:,.0f}',
+                                                  'Median Price': '{:,.0f}', 'Q1 Price': '{:,.0f}',
+                                                  'Q3 Price': '{:,.0f}'}))
+            
+            # Price axes in Pakistani numbering, for the price range of the selection
+            price_ticks = plotly_price_ticks(market_stats['price_min'], market_stats['price_max'])
+            
             # Price vs Bedrooms
             st.markdown('<div class="section-subheader">Price vs Bedrooms</div>', unsafe_allow_html=True)
             fig_price_bed = px.box(
@@ -500,6 +553,7 @@ def main():
                 ),
                 showlegend=False
             )
+            fig_price_bed.update_yaxes(**price_ticks)
             st.plotly_chart(fig_price_bed, use_container_width=True)
             
             # Price vs Location
@@ -548,28 +602,32 @@ def main():
                 xaxis={'tickangle': -45},
                 showlegend=False
             )
+            fig_price_loc.update_yaxes(**price_ticks)
             st.plotly_chart(fig_price_loc, use_container_width=True)
             
-        with tab2:
+        with tab2, stage('tab.analysis'):
             st.markdown('<div class="section-header">Analysis</div>', unsafe_allow_html=True)
             
             # Heatmap
             st.markdown('<div class="section-subheader">Feature Correlation Heatmap</div>', unsafe_allow_html=True)
+            st.radio("Correlation method", ['Pearson', 'Spearman'], horizontal=True, key='correlation_method')
             with st.container():
-                heatmap = create_heatmap(filtered_df, theme)
-                st.pyplot(heatmap, use_container_width=True)
+                heatmap = figure_png(figures, ('heatmap', correlation_method, filter_key, theme))
+                st.image(heatmap, use_container_width=True)
             
             # Regression Analysis
             st.markdown('<div class="section-subheader">Regression Analysis</div>', unsafe_allow_html=True)
             with st.container():
-                reg_plot = create_regression_analysis(filtered_df, theme)
-                st.pyplot(reg_plot, use_container_width=True)
+                reg_plot = figure_png(figures, ('regression_analysis', filter_key, theme))
+                st.image(reg_plot, use_container_width=True)
             
-        with tab3:
+        with tab3, stage('tab.insights'):
             st.markdown('<div class="section-header">Market Insights</div>', unsafe_allow_html=True)
             
             # Generate market insights
-            insights = get_market_insights(filtered_df)
+            trends = get_market_trends()
+            insights = cached_result('insights', make_key(filter_key, trends.version if trends else None),
+                                     lambda: get_market_insights(filtered_df, market_stats, trends=trends))
             
             # Summary Section
             st.markdown('<div class="section-subheader">Market Summary</div>', unsafe_allow_html=True)
@@ -588,39 +646,41 @@ def main():
             with col1:
                 st.metric(
                     "Average Price",
-                    f"Rs. {filtered_df['Price'].mean():,.0f}",
-                    f"Range: Rs. {filtered_df['Price'].min():,.0f} - Rs. {filtered_df['Price'].max():,.0f}"
+                    f"Rs. {market_stats['price_mean']:,.0f}",
+                    f"Range: Rs. {market_stats['price_min']:,.0f} - Rs. {market_stats['price_max']:,.0f}"
                 )
             
             with col2:
                 st.metric(
                     "Property Size",
-                    f"{filtered_df['Marla'].mean():.1f} Marla",
-                    f"Range: {filtered_df['Marla'].min():.1f} - {filtered_df['Marla'].max():.1f} Marla"
+                    f"{market_stats['marla_mean']:.1f} Marla",
+                    f"Range: {market_stats['marla_min']:.1f} - {market_stats['marla_max']:.1f} Marla"
                 )
             
             with col3:
                 st.metric(
                     "Market Size",
-                    f"{len(filtered_df):,} Properties",
-                    f"Across {len(filtered_df['Location'].unique())} Locations"
+                    f"{market_stats['count']:,} Properties",
+                    f"Across {market_stats['n_locations']} Locations"
                 )
               # Overall Summary Section (Add this first)
             st.markdown('<div class="section-subheader">Overall Summary</div>', unsafe_allow_html=True)
             with st.container():
                 st.markdown(insights["overall_summary"], unsafe_allow_html=True)
             
-        with tab4:
+        with tab4, stage('tab.statistics'):
             st.markdown('<div class="section-header">Statistical Analysis</div>', unsafe_allow_html=True)
             
             # Descriptive Statistics
             st.markdown('<div class="section-subheader">Descriptive Statistics</div>', unsafe_allow_html=True)
-            desc_stats = calculate_descriptive_stats(filtered_df)
+            desc_stats = cached_result('statistics', ('descriptive', filter_key),
+                                       lambda: calculate_descriptive_stats(filtered_df))
             st.dataframe(desc_stats.style.format("{:.2f}"))
             
             # Confidence Intervals
             st.markdown('<div class="section-subheader">Confidence Intervals (95%)</div>', unsafe_allow_html=True)
-            conf_intervals = calculate_stats_confidence_intervals(filtered_df)
+            conf_intervals = cached_result('statistics', ('confidence_intervals', filter_key),
+                                           lambda: calculate_stats_confidence_intervals(filtered_df))
             conf_df = pd.DataFrame(conf_intervals).T
             conf_df.columns = ['Lower Bound', 'Upper Bound']
             st.dataframe(conf_df.style.format("{:.2f}"))
@@ -631,7 +691,8 @@ def main():
             
             with col1:
                 st.write("Price Distribution Analysis")
-                price_dist = analyze_distributions(filtered_df, 'Price')
+                price_dist = cached_result('statistics', ('distribution', 'Price', filter_key),
+                                           lambda: analyze_distributions(filtered_df, 'Price'))
                 st.write(f"Mean: {price_dist['mean']:.2f}")
                 st.write(f"Standard Deviation: {price_dist['std']:.2f}")
                 st.write("Shapiro-Wilk Test:")
@@ -639,11 +700,13 @@ def main():
                 st.write(f"P-value: {price_dist['shapiro_test']['p_value']:.4f}")
                 
                 # QQ Plot
-                st.pyplot(create_qq_plot(filtered_df, 'Price', theme))
+                st.image(figure_png(figures, ('qq', 'Price', filter_key, theme)),
+                         use_container_width=True)
             
             with col2:
                 st.write("Marla Distribution Analysis")
-                marla_dist = analyze_distributions(filtered_df, 'Marla')
+                marla_dist = cached_result('statistics', ('distribution', 'Marla', filter_key),
+                                           lambda: analyze_distributions(filtered_df, 'Marla'))
                 st.write(f"Mean: {marla_dist['mean']:.2f}")
                 st.write(f"Standard Deviation: {marla_dist['std']:.2f}")
                 st.write("Shapiro-Wilk Test:")
@@ -651,17 +714,20 @@ def main():
                 st.write(f"P-value: {marla_dist['shapiro_test']['p_value']:.4f}")
                 
                 # QQ Plot
-                st.pyplot(create_qq_plot(filtered_df, 'Marla', theme))
+                st.image(figure_png(figures, ('qq', 'Marla', filter_key, theme)),
+                         use_container_width=True)
             
             # Distribution Plots
             st.markdown('<div class="section-subheader">Distribution Plots with Normal Fit</div>', unsafe_allow_html=True)
             col1, col2 = st.columns(2)
             
             with col1:
-                st.pyplot(create_distribution_plots(filtered_df, 'Price', theme))
+                st.image(figure_png(figures, ('distribution', 'Price', filter_key, theme)),
+                         use_container_width=True)
             
             with col2:
-                st.pyplot(create_distribution_plots(filtered_df, 'Marla', theme))
+                st.image(figure_png(figures, ('distribution', 'Marla', filter_key, theme)),
+                         use_container_width=True)
             
             # Regression Analysis
             st.markdown('<div class="section-subheader">Multiple Regression Analysis</div>', unsafe_allow_html=True)
@@ -669,15 +735,23 @@ def main():
             # Feature selection for regression
             features = st.multiselect(
                 "Select Features for Regression",
-                options=['Marla', 'Bedrooms'],
-                default=['Marla', 'Bedrooms']
+                options=REGRESSION_FEATURES + [f for f in KEYWORD_FEATURES if f in filtered_df.columns],
+                default=REGRESSION_FEATURES
             )
             
+            show_diagnostics = st.checkbox("Show residual diagnostics", value=False)
+            
             if features:
-                regression_results = perform_regression_analysis(
-                    filtered_df, 
-                    target='Price', 
-                    features=features
+                regression_results = cached_result(
+                    'regression',
+                    (filter_key, tuple(features), show_diagnostics),
+                    lambda: perform_regression_analysis(
+                        filtered_df, 
+                        target='Price', 
+                        features=features,
+                        lean=True,
+                        diagnostics=show_diagnostics
+                    )
                 )
                 
                 # Display regression summary
@@ -725,8 +799,10 @@ def main():
                 
                 # Prediction Plots
                 st.markdown('<div class="section-subheader">Prediction Plots</div>', unsafe_allow_html=True)
+                render_prediction_figures(figures, filtered_df, features, filter_key, theme)
                 for feature in features:
-                    st.pyplot(create_prediction_plot(filtered_df, 'Price', feature, theme))
+                    st.image(figure_png(figures, ('prediction', feature, filter_key, theme)),
+                             use_container_width=True)
             
         # Add footer at the end of your main() function
         st.markdown("""
@@ -742,5 +818,24 @@ def main():
         st.error(f"An error occurred: {str(e)}")
         logger.error(f"Application error: {str(e)}\n{traceback.format_exc()}")
 
+def is_dev_mode():
+    """Developer panels are enabled with THINKLYTICS_DEV=1 or the ?dev=1 query parameter."""
+    return os.environ.get('THINKLYTICS_DEV') == '1' or st.query_params.get('dev') == '1'
+
+def render_latency_panel():
+    """Show the per-stage timings of this rerun and the cache statistics in the sidebar."""
+    records = get_rerun_records()
+    with st.sidebar.expander("Latency (developer)", expanded=False):
+        if records:
+            timings = pd.DataFrame(records)[['stage', 'wall_ms', 'cpu_ms', 'alloc_kb']]
+            st.dataframe(timings.style.format({'wall_ms': '{:.1f}', 'cpu_ms': '{:.1f}', 'alloc_kb': '{:.0f}'},
+                                              na_rep='-'))
+        st.markdown("**Cache**")
+        st.dataframe(pd.DataFrame(get_cache().stats()).T)
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    start_rerun()
+    run_profiled(main, profile_threshold_ms(st.query_params))
+    log_rerun_summary()
+    if is_dev_mode():
+        render_latency_panel()
@@ -0,0 +1,303 @@
+"""
+Offline batch report generator.
+
+Renders the dashboard's statistics, regression summary, market insights and figures for
+many filter presets without the UI. The dataset is loaded and cleaned once; each worker
+process receives it once and keeps its own BERT model for all the specs it handles.
+
+Usage:
+    python main/batch.py --specs presets.json --output reports --workers 8
+    python main/batch.py --specs presets.json --data exports/  # one CSV per city and month
+
+The specs file is a JSON list of filter presets, for example:
+    [{"name": "dha-lahore", "cities": ["Lahore"], "marla_range": [5, 20], "bedrooms": [3, 4]},
+     {"name": "f-11", "locations": ["F-11, Islamabad"], "exclude_outliers": true},
+     {"name": "furnished-flats", "cities": ["Karachi"], "features": ["Furnished", "Apartment"]}]
+"""
+import matplotlib
+matplotlib.use('Agg')  # Workers render off-screen
+
+import argparse
+import html
+import json
+import logging
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+
+from analysis import preprocess_rental_data, apply_filters
+from catalog import DatasetCatalog
+from cube import AggregateCube
+from plotting import create_heatmap, create_price_distribution, create_regression_analysis
+from rendering import figure_to_png
+from statistical_analysis import (
+    calculate_descriptive_stats,
+    calculate_confidence_intervals,
+    analyze_distributions,
+    create_qq_plot,
+    perform_regression_analysis,
+    create_distribution_plots,
+    create_prediction_plot
+)
+from snapshots import SnapshotStore
+from summary import get_market_insights, get_property_analyzer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATA_PATH = Path(__file__).resolve().parent.parent / 'data' / 'zameen_rentals_data.csv'
+REPORT_FORMATS = ('json', 'png', 'html')
+REGRESSION_FEATURES = ['Marla', 'Bedrooms']
+
+# Set once per worker process by _init_worker
+_worker_df = None
+_worker_cube = None
+_worker_trends = None
+_worker_options = None
+
+
+def load_specs(path: Path) -> List[Dict]:
+    """Load filter presets from a JSON list and give every preset a unique file-safe name."""
+    specs = json.loads(Path(path).read_text())
+    if not isinstance(specs, list):
+        raise ValueError("The specs file must contain a JSON list of filter presets")
+
+    seen = set()
+    for i, spec in enumerate(specs):
+        name = re.sub(r'[^A-Za-z0-9_.-]+', '-', str(spec.get('name', f'spec-{i}'))).strip('-') or f'spec-{i}'
+        while name in seen:
+            name = f"{name}-{i}"
+        seen.add(name)
+        spec['name'] = name
+    return specs
+
+
+def load_dataset(data: Path, specs: List[Dict], workers: int) -> pd.DataFrame:
+    """
+    Load the cleaned dataset from one CSV or from a directory of per-city/per-month exports.
+
+    For a directory, only the exports of the cities named by the specs are read when every
+    spec is restricted to cities.
+    """
+    if not Path(data).is_dir():
+        return preprocess_rental_data(str(data), compact=True, location_hierarchy=True, outliers='iqr',
+                                      imputation='hierarchical', near_duplicates=True,
+                                      keyword_features=True)
+
+    catalog = DatasetCatalog(max_workers=workers)
+    catalog.discover(data)
+    cities = None
+    if specs and all(spec.get('cities') for spec in specs):
+        cities = sorted({city for spec in specs for city in spec['cities']})
+    return catalog.dataset(cities=cities).data
+
+
+def _init_worker(df: pd.DataFrame, options: Dict) -> None:
+    """Keep the shared dataset, its cube and (optionally) the BERT model and trends for this worker."""
+    global _worker_df, _worker_cube, _worker_trends, _worker_options
+    _worker_df = df
+    _worker_cube = AggregateCube(df)
+    _worker_options = options
+    if options['insights']:
+        get_property_analyzer()
+        _worker_trends = SnapshotStore().trends()
+
+
+def _save_figure(fig: Figure, path: Path) -> str:
+    path.write_bytes(figure_to_png(fig, dpi=150))
+    return path.name
+
+
+def _to_builtin(value):
+    """Convert NumPy/pandas values to JSON-serialisable Python objects."""
+    if isinstance(value, dict):
+        return {str(k): _to_builtin(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_builtin(v) for v in value]
+    if isinstance(value, pd.Series):
+        return _to_builtin(value.to_dict())
+    if isinstance(value, pd.DataFrame):
+        return _to_builtin(value.to_dict(orient='index'))
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+
+def build_report(spec: Dict) -> Dict:
+    """
+    Build the report for one filter preset inside a worker process.
+
+    Args:
+        spec: Filter preset (name, marla_range, bedrooms, locations, cities, exclude_outliers, features)
+
+    Returns:
+        Dict describing the written files and row count
+    """
+    options = _worker_options
+    output_dir = Path(options['output']) / spec['name']
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    filters = {key: spec.get(key) for key in ('marla_range', 'bedrooms', 'locations', 'cities')}
+    filters['exclude_outliers'] = bool(spec.get('exclude_outliers', False))
+    filters['features'] = spec.get('features')
+    df = apply_filters(_worker_df, **filters)
+    report = {'name': spec['name'], 'filters': filters, 'rows': len(df)}
+    # The regression needs more rows than coefficients for residual degrees of freedom
+    if len(df) <= len(REGRESSION_FEATURES) + 1:
+        report['error'] = "Too few matching listings for a report"
+        (output_dir / 'report.json').write_text(json.dumps(_to_builtin(report), indent=2))
+        return {'name': spec['name'], 'rows': len(df), 'files': ['report.json']}
+
+    cube_filters = {key: filters[key] for key in ('marla_range', 'bedrooms', 'locations', 'exclude_outliers')}
+    cube_mask = _worker_cube.select(**cube_filters)
+    # The cube has no city or keyword feature dimension; those reports summarize the rows
+    row_filters = filters['cities'] is not None or filters['features']
+    market_stats = None if row_filters else _worker_cube.summarize(cube_mask)
+
+    regression = perform_regression_analysis(df, 'Price', REGRESSION_FEATURES, lean=True, diagnostics=True)
+    report.update({
+        'market_stats': market_stats,
+        'descriptive_stats': calculate_descriptive_stats(df),
+        'confidence_intervals': calculate_confidence_intervals(df),
+        'distributions': {col: analyze_distributions(df, col) for col in ('Price', 'Marla')},
+        'regression': {k: v for k, v in regression.items() if k != 'predictions'}
+    })
+    if options['insights']:
+        report['insights'] = get_market_insights(df, market_stats, trends=_worker_trends)
+
+    files = []
+    figures = {}
+    if 'png' in options['formats'] or 'html' in options['formats']:
+        theme = options['theme']
+        figures['price_distribution'] = _save_figure(create_price_distribution(df, theme),
+                                                     output_dir / 'price_distribution.png')
+        figures['heatmap'] = _save_figure(create_heatmap(df.select_dtypes(include=[np.number]).corr(), theme),
+                                          output_dir / 'heatmap.png')
+        figures['regression_analysis'] = _save_figure(create_regression_analysis(df, theme),
+                                                      output_dir / 'regression_analysis.png')
+        for col in ('Price', 'Marla'):
+            figures[f'qq_{col.lower()}'] = _save_figure(create_qq_plot(df, col, theme), output_dir / f'qq_{col.lower()}.png')
+            figures[f'distribution_{col.lower()}'] = _save_figure(
+                create_distribution_plots(df, col, theme), output_dir / f'distribution_{col.lower()}.png')
+        for feature in REGRESSION_FEATURES:
+            figures[f'prediction_{feature.lower()}'] = _save_figure(
+                create_prediction_plot(df, 'Price', feature, theme), output_dir / f'prediction_{feature.lower()}.png')
+        files += list(figures.values())
+
+    if 'json' in options['formats']:
+        (output_dir / 'report.json').write_text(json.dumps(_to_builtin(report), indent=2))
+        files.append('report.json')
+    if 'html' in options['formats']:
+        (output_dir / 'report.html').write_text(render_html(report, figures))
+        files.append('report.html')
+
+    return {'name': spec['name'], 'rows': len(df), 'files': files}
+
+
+def render_html(report: Dict, figures: Dict[str, str]) -> str:
+    """Render a self-contained HTML page (figures are linked next to it)."""
+    sections = [f"<h1>{html.escape(report['name'])}</h1>",
+                f"<p>{report['rows']:,} listings. Filters: {html.escape(json.dumps(_to_builtin(report['filters'])))}</p>"]
+
+    sections.append("<h2>Descriptive Statistics</h2>")
+    sections.append(report['descriptive_stats'].to_html(float_format=lambda x: f"{x:,.2f}"))
+
+    intervals = pd.DataFrame(report['confidence_intervals'], index=['Lower Bound', 'Upper Bound']).T
+    sections.append("<h2>Confidence Intervals (95%)</h2>")
+    sections.append(intervals.to_html(float_format=lambda x: f"{x:,.2f}"))
+
+    sections.append("<h2>OLS Regression Results</h2>")
+    sections.append(f"<pre>{html.escape(report['regression']['model_summary'])}</pre>")
+
+    if 'insights' in report:
+        sections.append("<h2>Market Insights</h2>")
+        for key in ('summary', 'predictions', 'overall_summary'):
+            sections.append(f"<pre>{html.escape(report['insights'][key])}</pre>")
+
+    if figures:
+        sections.append("<h2>Figures</h2>")
+        sections += [f'<img src="{html.escape(name)}" alt="{html.escape(key)}" style="max-width: 700px;">'
+                     for key, name in figures.items()]
+
+    return ("<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\">"
+            f"<title>{html.escape(report['name'])}</title></head><body>\n"
+            + "\n".join(sections) + "\n</body></html>\n")
+
+
+def run_batch(specs: List[Dict], df: pd.DataFrame, output: Path, workers: int,
+              formats: List[str], insights: bool = True, theme: str = 'Light') -> List[Dict]:
+    """
+    Render reports for all specs in parallel across a process pool.
+
+    Args:
+        specs: Filter presets from load_specs
+        df: Preprocessed dataset shared by all reports
+        output: Output directory (one subdirectory per spec)
+        workers: Number of worker processes
+        formats: Any of 'json', 'png' and 'html'
+        insights: Whether to generate the BERT market insights
+        theme: Figure theme ('Dark' or 'Light')
+
+    Returns:
+        List of per-spec results in completion order
+    """
+    options = {'output': str(output), 'formats': formats, 'insights': insights, 'theme': theme}
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(df, options)) as executor:
+        futures = {executor.submit(build_report, spec): spec['name'] for spec in specs}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+                logger.info(f"Report {result['name']}: {result['rows']} rows, {len(result['files'])} files")
+            except Exception as e:
+                logger.error(f"Report {futures[future]} failed: {str(e)}")
+                result = {'name': futures[future], 'error': str(e)}
+            results.append(result)
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--specs', type=Path, required=True, help="JSON list of filter presets")
+    parser.add_argument('--data', type=Path, default=DEFAULT_DATA_PATH,
+                        help="Raw rentals CSV, or a directory of per-city/per-month CSV exports")
+    parser.add_argument('--output', type=Path, default=Path('reports'), help="Output directory")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument('--formats', nargs='+', choices=REPORT_FORMATS, default=list(REPORT_FORMATS))
+    parser.add_argument('--theme', choices=['Dark', 'Light'], default='Light')
+    parser.add_argument('--skip-insights', action='store_true', help="Do not load BERT or generate insights")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    specs = load_specs(args.specs)
+    start = time.perf_counter()
+    df = load_dataset(args.data, specs, args.workers)
+    logger.info(f"Loaded {len(df)} listings in {time.perf_counter() - start:.1f}s")
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    start = time.perf_counter()
+    results = run_batch(specs, df, args.output, args.workers, args.formats,
+                        insights=not args.skip_insights, theme=args.theme)
+    elapsed = time.perf_counter() - start
+
+    failed = [r for r in results if 'error' in r and 'files' not in r]
+    logger.info(f"Rendered {len(results) - len(failed)} of {len(specs)} reports in {elapsed:.1f}s "
+                f"({len(results) / elapsed:.2f} reports/s with {args.workers} workers)")
+    (args.output / 'index.json').write_text(json.dumps(results, indent=2))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
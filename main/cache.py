@@ -0,0 +1,251 @@
+import pandas as pd
+import numpy as np
+import hashlib
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUDGET_MB = 512
+DEFAULT_TTL = 3600
+
+_MISSING = object()
+
+
+def enable_copy_on_write() -> None:
+    """
+    Turn on pandas copy-on-write for the process.
+
+    Cached frames are handed out by reference, which is only safe with copy-on-write, so
+    the dashboard calls this once at startup. It changes pandas semantics process-wide and
+    is therefore left to the caller instead of happening on import (pandas 3 always does it).
+    """
+    if int(pd.__version__.split('.')[0]) < 3:
+        pd.set_option('mode.copy_on_write', True)
+
+
+def estimate_size(value: Any, _seen: Optional[set] = None) -> int:
+    """Estimate the memory held by a cached value in bytes."""
+    _seen = set() if _seen is None else _seen
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum()) if isinstance(usage, pd.Series) else int(usage)
+    if isinstance(value, pd.Index):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(estimate_size(k, _seen) + estimate_size(v, _seen) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sum(estimate_size(item, _seen) for item in value)
+    if hasattr(value, '__dict__'):
+        return estimate_size(vars(value), _seen)
+    return sys.getsizeof(value)
+
+
+def freeze(value: Any, _seen: Optional[set] = None) -> Any:
+    """
+    Mark a value as read-only so it can be shared between sessions without copies.
+
+    NumPy arrays (also inside dicts, lists and plain objects) are flagged non-writeable.
+    DataFrames are shared as-is and rely on pandas copy-on-write (see
+    enable_copy_on_write), so a session that modifies a cached frame gets its own copy
+    instead of changing everyone's.
+    """
+    _seen = set() if _seen is None else _seen
+    if id(value) in _seen:
+        return value
+    _seen.add(id(value))
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, dict):
+        for item in value.values():
+            freeze(item, _seen)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            freeze(item, _seen)
+    elif hasattr(value, '__dict__') and not isinstance(value, (pd.DataFrame, pd.Series, type)):
+        for item in vars(value).values():
+            freeze(item, _seen)
+    return value
+
+
+def make_key(*parts: Any) -> str:
+    """
+    Build a stable cache key from simple values.
+
+    Strings, numbers, None and (nested) lists, tuples and dicts of them are supported;
+    DataFrames and Series are fingerprinted by a vectorized hash of their contents.
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, (pd.DataFrame, pd.Series)):
+            fingerprint = int(pd.util.hash_pandas_object(part, index=True).to_numpy().sum(dtype=np.uint64))
+            digest.update(f"frame:{part.shape}:{fingerprint}".encode())
+        else:
+            digest.update(repr(_normalize(part)).encode())
+        digest.update(b'\x1f')
+    return digest.hexdigest()
+
+
+def _normalize(part: Any) -> Any:
+    """Convert NumPy scalars and containers to plain Python values for repr-based keys."""
+    if isinstance(part, np.generic):
+        return part.item()
+    if isinstance(part, (list, tuple)):
+        return tuple(_normalize(item) for item in part)
+    if isinstance(part, dict):
+        return tuple(sorted((str(k), _normalize(v)) for k, v in part.items()))
+    return part
+
+
+class ResultCache:
+    """
+    Thread-safe in-process cache shared by all dashboard sessions.
+
+    Entries live in namespaces (e.g. 'dataset', 'insights', 'figures') but share one
+    global byte budget. The least recently used entries are evicted when the budget is
+    exceeded and entries expire after their TTL. Values are stored and returned by
+    reference, so every session reads the same frozen object instead of a copy.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_BUDGET_MB * 1024 * 1024, default_ttl: Optional[float] = DEFAULT_TTL):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()  # (namespace, key) -> (value, size, expires_at)
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+        self._stats = defaultdict(lambda: {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0})
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def get(self, namespace: str, key: Hashable, default: Any = None) -> Any:
+        """Return a cached value, or default when it is missing or expired."""
+        value = self._lookup(namespace, key)
+        return default if value is _MISSING else value
+
+    def put(self, namespace: str, key: Hashable, value: Any, ttl: Optional[float] = None,
+            size: Optional[int] = None) -> Any:
+        """
+        Store a value and return it.
+
+        Args:
+            namespace: Cache namespace
+            key: Key within the namespace
+            value: Value to cache (frozen before it is stored)
+            ttl: Time to live in seconds (the cache default when None)
+            size: Size in bytes (estimated when None)
+        """
+        size = estimate_size(value) if size is None else size
+        if size > self.max_bytes:
+            logger.warning(f"Not caching {namespace} entry of {size} bytes: larger than the cache budget")
+            return value
+
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        freeze(value)
+        with self._lock:
+            self._remove((namespace, key))
+            self._entries[(namespace, key)] = (value, size, expires_at)
+            self._total_bytes += size
+            self._evict_to_budget()
+        return value
+
+    def get_or_compute(self, namespace: str, key: Hashable, compute: Callable[[], Any],
+                       ttl: Optional[float] = None) -> Any:
+        """
+        Return a cached value, computing and storing it on a miss.
+
+        Concurrent sessions asking for the same missing key wait for a single computation.
+        """
+        value = self._lookup(namespace, key)
+        if value is not _MISSING:
+            return value
+
+        with self._lock_for((namespace, key)):
+            value = self._lookup(namespace, key, record=False)
+            if value is _MISSING:
+                value = self.put(namespace, key, compute(), ttl=ttl)
+        with self._lock:
+            self._key_locks.pop((namespace, key), None)
+        return value
+
+    def invalidate(self, namespace: Optional[str] = None) -> None:
+        """Drop all entries of a namespace, or everything when namespace is None."""
+        with self._lock:
+            for entry_key in [k for k in self._entries if namespace is None or k[0] == namespace]:
+                self._remove(entry_key)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Return hits, misses, evictions, entries and bytes per namespace."""
+        with self._lock:
+            result = {namespace: dict(counters, entries=0, bytes=0) for namespace, counters in self._stats.items()}
+            for (namespace, _), (_, size, _) in self._entries.items():
+                result.setdefault(namespace, {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0,
+                                              'entries': 0, 'bytes': 0})
+                result[namespace]['entries'] += 1
+                result[namespace]['bytes'] += size
+            return result
+
+    def _lookup(self, namespace: str, key: Hashable, record: bool = True) -> Any:
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is not None and entry[2] is not None and entry[2] < time.monotonic():
+                self._remove((namespace, key))
+                self._stats[namespace]['expirations'] += 1
+                entry = None
+            if entry is None:
+                if record:
+                    self._stats[namespace]['misses'] += 1
+                return _MISSING
+            self._entries.move_to_end((namespace, key))
+            if record:
+                self._stats[namespace]['hits'] += 1
+            return entry[0]
+
+    def _lock_for(self, entry_key: Hashable) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(entry_key, threading.Lock())
+
+    def _remove(self, entry_key: Hashable) -> None:
+        entry = self._entries.pop(entry_key, None)
+        if entry is not None:
+            self._total_bytes -= entry[1]
+
+    def _evict_to_budget(self) -> None:
+        while self._total_bytes > self.max_bytes and self._entries:
+            (namespace, key), (_, size, _) = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self._stats[namespace]['evictions'] += 1
+            logger.info(f"Evicted {namespace} cache entry ({size} bytes)")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ResultCache:
+    """
+    Return the process-wide cache shared by all sessions.
+
+    The byte budget is read from the THINKLYTICS_CACHE_MB environment variable.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            budget_mb = float(os.environ.get('THINKLYTICS_CACHE_MB', DEFAULT_BUDGET_MB))
+            _cache = ResultCache(max_bytes=int(budget_mb * 1024 * 1024))
+        return _cache
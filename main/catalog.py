@@ -0,0 +1,317 @@
+import logging
+import multiprocessing
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Hashable, Iterable, List, NamedTuple, Optional, Tuple
+
+import pandas as pd
+
+from cache import make_key
+from datasets import DatasetSnapshot, file_signature
+from estimators import warm_rent_estimator
+from instrumentation import instrument, stage
+from locations import KNOWN_CITIES
+from refresh import DatasetState, build_dataset_state, merge_dataset_states
+
+logger = logging.getLogger(__name__)
+
+# Export months look like 2024-05
+MONTH_PATTERN = re.compile(r'^\d{4}-\d{2}$')
+_CITY_NAMES = {city.lower(): city for city in KNOWN_CITIES}
+# Combined states of recent city/month selections kept by the catalog
+COMBINED_CACHE_SIZE = 8
+
+
+class Partition(NamedTuple):
+    """One source file of the catalog with the city and month it covers (None when mixed/unknown)."""
+    path: Path
+    city: Optional[str] = None
+    month: Optional[str] = None
+
+
+def parse_partition(path: Path, root: Optional[Path] = None) -> Partition:
+    """
+    Infer a partition's city and month from its path.
+
+    Every directory and file name part below root (split on '_') is checked: a known city
+    name (with '-' for spaces, any case) sets the city and a YYYY-MM part sets the month,
+    so 'lahore/2024-05.csv' and 'zameen_lahore_2024-05.csv' are both understood.
+
+    Args:
+        path: Source file
+        root: Directory the catalog was discovered from (parts above it are ignored)
+
+    Returns:
+        Partition: The file with its city and month
+    """
+    path = Path(path)
+    relative = path.relative_to(root) if root is not None else Path(path.name)
+    parts = [token for part in relative.with_suffix('').parts for token in part.split('_')]
+    city = month = None
+    for token in parts:
+        if MONTH_PATTERN.match(token):
+            month = token
+        elif token.replace('-', ' ').lower() in _CITY_NAMES:
+            city = _CITY_NAMES[token.replace('-', ' ').lower()]
+    return Partition(path, city, month)
+
+
+def load_partition(path: Path) -> DatasetState:
+    """Read and clean one source file; runs on a catalog worker."""
+    return build_dataset_state(pd.read_csv(path))
+
+
+class DatasetCatalog:
+    """
+    A set of source files (for example one export per city and month) queried as one dataset.
+
+    Every file is cleaned on its own, in parallel across worker processes, and kept by the
+    catalog under its path until its file signature changes, so a new or changed export only
+    costs its own processing. The states live outside the shared result cache, so figures
+    and other results never evict them and they do not expire; the combined states of the
+    COMBINED_CACHE_SIZE most recent selections are kept the same way.
+    Queries first prune the files by city and month and then combine only the matching
+    ones, so a city-scoped view does not get slower as other cities are added. Files whose
+    city is not in their name are pruned by the cities found in them once they are loaded.
+    Processing a file or combining a selection only locks that file or selection, so views
+    that are already cached are served while another one is prepared.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = os.cpu_count() if max_workers is None else max_workers
+        self._partitions: Dict[Path, Partition] = {}
+        # Cities seen in loaded files that are not named by city
+        self._cities: Dict[Path, frozenset] = {}
+        # Cleaned state of every loaded file with the version key it was built from
+        self._states: Dict[Path, Tuple[str, DatasetState]] = {}
+        self._combined: 'OrderedDict[str, DatasetState]' = OrderedDict()
+        # Guards the dicts only; loading and combining hold a lock of their file or selection
+        self._lock = threading.RLock()
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+
+    def register(self, path: Path, city: Optional[str] = None, month: Optional[str] = None) -> Partition:
+        """Add a source file; a city or month left as None is inferred from the file name."""
+        inferred = parse_partition(path)
+        partition = Partition(Path(path), city or inferred.city, month or inferred.month)
+        self._partitions[partition.path] = partition
+        return partition
+
+    def discover(self, directory: Path, pattern: str = '**/*.csv') -> List[Partition]:
+        """Register every matching file below a directory, inferring city and month from the paths."""
+        directory = Path(directory)
+        found = [parse_partition(path, directory) for path in sorted(directory.glob(pattern))]
+        for partition in found:
+            self._partitions[partition.path] = partition
+        logger.info(f"Catalog found {len(found)} source files in {directory}")
+        return found
+
+    def cities(self) -> List[str]:
+        """Cities of the registered files: named in their paths, or found in them once loaded."""
+        names = {partition.city for partition in self._partitions.values() if partition.city is not None}
+        with self._lock:
+            found = list(self._cities.values())
+        for seen in found:
+            names |= seen
+        return sorted(names)
+
+    def partitions(self, cities: Optional[Iterable[str]] = None,
+                   months: Optional[Iterable[str]] = None) -> List[Partition]:
+        """
+        Return the registered files that can contain listings of the given cities and months.
+
+        Args:
+            cities: Allowed cities (all when None)
+            months: Allowed months as YYYY-MM (all when None)
+
+        Returns:
+            List of matching partitions in registration order
+        """
+        cities = None if cities is None else set(cities)
+        months = None if months is None else set(months)
+        selected = []
+        for partition in self._partitions.values():
+            if months is not None and partition.month is not None and partition.month not in months:
+                continue
+            if cities is not None:
+                if partition.city is not None and partition.city not in cities:
+                    continue
+                seen = self._cities.get(partition.path)
+                if partition.city is None and seen is not None and not seen & cities:
+                    continue
+            selected.append(partition)
+        return selected
+
+    @staticmethod
+    def _version_key(partition: Partition) -> str:
+        signature = file_signature(partition.path)
+        if signature is None:
+            raise FileNotFoundError(f"Source file not found: {partition.path}")
+        return make_key(str(partition.path), *signature)
+
+    @instrument('DatasetCatalog.load')
+    def load(self, partitions: List[Partition]) -> Dict[Path, DatasetState]:
+        """
+        Return the cleaned state of every partition, processing uncached files in parallel.
+
+        Args:
+            partitions: Partitions to load
+
+        Returns:
+            Dict mapping each partition path to its state
+        """
+        return self._load(partitions, {p.path: self._version_key(p) for p in partitions})
+
+    def _load(self, partitions: List[Partition], keys: Dict[Path, str]) -> Dict[Path, DatasetState]:
+        states = self._cached_states(keys)
+        missing = sorted(path for path, state in states.items() if state is None)
+
+        if missing:
+            # Files are locked one by one in path order, so sessions loading overlapping
+            # selections wait for each other's files instead of processing them twice
+            with ExitStack() as stack:
+                for path in missing:
+                    stack.enter_context(self._lock_for(('state', path)))
+                states.update(self._cached_states({path: keys[path] for path in missing}))
+                pending = [path for path in missing if states[path] is None]
+                if pending:
+                    with stage('catalog.preprocess', files=len(pending)):
+                        workers = min(self.max_workers, len(pending))
+                        if workers <= 1:
+                            loaded = list(map(load_partition, pending))
+                        else:
+                            executor = ProcessPoolExecutor(max_workers=workers,
+                                                           mp_context=multiprocessing.get_context('spawn'))
+                            with executor:
+                                loaded = list(executor.map(load_partition, pending))
+                    with self._lock:
+                        for path, state in zip(pending, loaded):
+                            self._states[path] = (keys[path], state)
+                            states[path] = state
+                    logger.info(f"Preprocessed {len(pending)} of {len(partitions)} source files")
+            for path in missing:
+                self._release_lock(('state', path))
+
+        with self._lock:
+            for partition in partitions:
+                if partition.city is None:
+                    self._cities[partition.path] = frozenset(states[partition.path].data['City'].dropna().unique())
+        return states
+
+    def _cached_states(self, keys: Dict[Path, str]) -> Dict[Path, Optional[DatasetState]]:
+        """States loaded under the given version keys (None where a file is not loaded or changed)."""
+        with self._lock:
+            entries = {path: self._states.get(path) for path in keys}
+        return {path: entry[1] if entry is not None and entry[0] == keys[path] else None
+                for path, entry in entries.items()}
+
+    def _lock_for(self, key: Hashable) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _release_lock(self, key: Hashable) -> None:
+        with self._lock:
+            self._key_locks.pop(key, None)
+
+    @instrument('DatasetCatalog.dataset')
+    def dataset(self, cities: Optional[Iterable[str]] = None,
+                months: Optional[Iterable[str]] = None) -> DatasetState:
+        """
+        Return the combined state of the files matching the filters.
+
+        The combinations of the most recent selections are kept per set of file versions. Files are pruned as a whole,
+        so the result can still hold other cities from files that mix several; apply
+        the city filter to the rows as usual.
+
+        Args:
+            cities: Allowed cities (all when None)
+            months: Allowed months as YYYY-MM (all when None)
+
+        Returns:
+            DatasetState: Cleaned data, cube, correlation engine and aggregates of the matching files
+
+        Raises:
+            ValueError: If no registered file matches
+        """
+        return self.snapshot(cities, months).dataset
+
+    def snapshot(self, cities: Optional[Iterable[str]] = None,
+                 months: Optional[Iterable[str]] = None) -> DatasetSnapshot:
+        """
+        Return the combined state of the matching files as a dashboard snapshot.
+
+        The key changes whenever one of the matching files does, so results cached under it
+        are never served for another selection or version.
+
+        Args:
+            cities: Allowed cities (all when None)
+            months: Allowed months as YYYY-MM (all when None)
+
+        Returns:
+            DatasetSnapshot: Key and state of the combined files
+        """
+        partitions, states, keys = self._load_matching(cities, months)
+        # The keys the states were loaded with; a file rewritten since is picked up next time
+        key = make_key([keys[p.path] for p in partitions])
+        dataset = self._cached_combined(key)
+        if dataset is not None:
+            return DatasetSnapshot(key, dataset)
+
+        # Merging and training run under a lock of this combination only
+        with self._lock_for(('combined', key)):
+            dataset = self._cached_combined(key)
+            if dataset is None:
+                dataset = self._combine([states[p.path] for p in partitions])
+                with self._lock:
+                    self._combined[key] = dataset
+                    while len(self._combined) > COMBINED_CACHE_SIZE:
+                        self._combined.popitem(last=False)
+        self._release_lock(('combined', key))
+        return DatasetSnapshot(key, dataset)
+
+    def _cached_combined(self, key: str) -> Optional[DatasetState]:
+        with self._lock:
+            dataset = self._combined.get(key)
+            if dataset is not None:
+                self._combined.move_to_end(key)
+            return dataset
+
+    @staticmethod
+    def _combine(states: List[DatasetState]) -> DatasetState:
+        """Merge partition states and prepare the rent estimator of the combination."""
+        dataset = merge_dataset_states(states)
+        warm_rent_estimator(dataset)
+        return dataset
+
+    def _load_matching(self, cities, months):
+        partitions = self.partitions(cities, months)
+        keys = {p.path: self._version_key(p) for p in partitions}
+        states = self._load(partitions, keys)
+        # Loading can reveal that an unlabelled file has none of the requested cities
+        partitions = [p for p in self.partitions(cities, months) if p.path in states]
+        if not partitions:
+            raise ValueError(f"No source files match cities={cities} and months={months}")
+        return partitions, states, keys
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_dataset_catalog(directory: Path) -> DatasetCatalog:
+    """
+    Return the process-wide catalog of the source files below a directory.
+
+    The files are discovered on the first call. Changed files are picked up by their file
+    signature on the next query; files added later need a restart.
+    """
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = DatasetCatalog()
+            _catalog.discover(directory)
+        return _catalog
@@ -0,0 +1,210 @@
+import pandas as pd
+import numpy as np
+from typing import List, Optional, Sequence
+from cube import CellIndex
+from instrumentation import instrument
+
+CORRELATION_METHODS = ('pearson', 'spearman')
+# Variances below this fraction of the raw sum of squares are rounding error
+VARIANCE_RTOL = 1e-12
+
+
+class CorrelationEngine(CellIndex):
+    """
+    Correlation matrices of the numeric columns for any dashboard filter selection.
+
+    For every (Location, Bedrooms, Marla) cell and every column pair (i, j) the engine keeps
+    the co-moment accumulators n, Σx, Σy, Σxy, Σx² and Σy² over the rows where both columns
+    are present, so the Pearson matrix of a selection is assembled from sums of the selected
+    cells without scanning rows (pairwise-complete, like DataFrame.corr).
+
+    Values are accumulated relative to the column means of the first batch, which keeps the
+    sums of squares of large prices far from float64 cancellation; correlations do not depend
+    on the shift.
+
+    Spearman matrices re-rank only the selected rows, but reuse a per-column sort order and
+    tie grouping kept up to date by update() and remove(), so no sorting happens per selection
+    and only the added rows are sorted per update.
+
+    update() and remove() add and subtract rows without writing into existing arrays, so a
+    shallow copy of an engine that other sessions are reading can be updated safely.
+    """
+
+    @instrument('CorrelationEngine.build')
+    def __init__(self, df: pd.DataFrame, columns: Optional[Sequence[str]] = None):
+        if columns is None:
+            columns = df.select_dtypes(include=[np.number]).columns
+        self.columns: List[str] = list(columns)
+        k = len(self.columns)
+
+        self.shift = np.nan_to_num(df[self.columns].mean().to_numpy(dtype=np.float64))
+        self._init_cells()
+        self.n = np.zeros((0, k, k))
+        self.sum_x = np.zeros((0, k, k))
+        self.sum_xx = np.zeros((0, k, k))
+        self.sum_xy = np.zeros((0, k, k))
+
+        # Row-level data for Spearman
+        self.values = np.empty((0, k))
+        self.row_cell = np.empty(0, dtype=np.int64)
+        self.rank_order = np.empty((0, k), dtype=np.int64)
+        self.rank_values = np.empty((0, k))
+        self.update(df)
+
+    @instrument('CorrelationEngine.update')
+    def update(self, df: pd.DataFrame) -> None:
+        """
+        Add rows to the accumulators.
+
+        Args:
+            df: Rows with the engine's columns plus Location, Bedrooms and Marla
+        """
+        values = df[self.columns].to_numpy(dtype=np.float64) - self.shift
+        row_cells = self._assign_cells(df)
+        self._accumulate(values, row_cells, 1.0)
+
+        self._insert_ranks(values, len(self.values))
+        self.values = np.concatenate([self.values, values])
+        self.row_cell = np.concatenate([self.row_cell, row_cells])
+
+    @instrument('CorrelationEngine.remove')
+    def remove(self, rows: np.ndarray) -> None:
+        """
+        Subtract rows from the accumulators.
+
+        Args:
+            rows: Boolean mask over the rows added so far, in the order they were added
+        """
+        self._accumulate(self.values[rows], self.row_cell[rows], -1.0)
+        self._drop_ranks(rows)
+        self.values = self.values[~rows]
+        self.row_cell = self.row_cell[~rows]
+
+    def _accumulate(self, values: np.ndarray, row_cells: np.ndarray, sign: float) -> None:
+        """Add (sign 1) or subtract (sign -1) shifted rows into new accumulator arrays."""
+        n_cells = self.n_cells
+        k = len(self.columns)
+        grown = [np.concatenate([acc, np.zeros((n_cells - len(acc), k, k))])
+                 for acc in (self.n, self.sum_x, self.sum_xx, self.sum_xy)]
+        n, sum_x, sum_xx, sum_xy = grown
+        valid = ~np.isnan(values)
+        for i in range(k):
+            for j in range(i, k):
+                both = valid[:, i] & valid[:, j]
+                cells = row_cells[both]
+                x, y = values[both, i], values[both, j]
+                count = sign * np.bincount(cells, minlength=n_cells)
+                cross = sign * np.bincount(cells, weights=x * y, minlength=n_cells)
+                n[:, i, j] += count
+                sum_x[:, i, j] += sign * np.bincount(cells, weights=x, minlength=n_cells)
+                sum_xx[:, i, j] += sign * np.bincount(cells, weights=x * x, minlength=n_cells)
+                sum_xy[:, i, j] += cross
+                if i != j:
+                    n[:, j, i] += count
+                    sum_x[:, j, i] += sign * np.bincount(cells, weights=y, minlength=n_cells)
+                    sum_xx[:, j, i] += sign * np.bincount(cells, weights=y * y, minlength=n_cells)
+                    sum_xy[:, j, i] += cross
+        self.n, self.sum_x, self.sum_xx, self.sum_xy = n, sum_x, sum_xx, sum_xy
+
+    def _insert_ranks(self, values: np.ndarray, start: int) -> None:
+        """
+        Merge new rows into the per-column sort order (NaNs sort last).
+
+        Only the new values are sorted; they go after the stored rows with equal values, so
+        the order is the stable sort of all rows in the order they were added.
+        """
+        order = np.argsort(values, axis=0, kind='stable')
+        sorted_new = np.take_along_axis(values, order, axis=0)
+        shape = (len(self.rank_values) + len(values), len(self.columns))
+        rank_order, rank_values = np.empty(shape, dtype=np.int64), np.empty(shape)
+        for column in range(len(self.columns)):
+            slots = np.searchsorted(self.rank_values[:, column], sorted_new[:, column], side='right')
+            rank_order[:, column] = np.insert(self.rank_order[:, column], slots, start + order[:, column])
+            rank_values[:, column] = np.insert(self.rank_values[:, column], slots, sorted_new[:, column])
+        self.rank_order, self.rank_values = rank_order, rank_values
+        self._group_ranks()
+
+    def _drop_ranks(self, rows: np.ndarray) -> None:
+        """Remove rows from the per-column sort order and renumber the remaining positions."""
+        k = len(self.columns)
+        positions = np.cumsum(~rows) - 1
+        # Every column loses the same rows, so the kept entries of each column stay a column
+        kept = ~rows[self.rank_order].T
+        self.rank_order = positions[self.rank_order.T[kept]].reshape(k, -1).T
+        self.rank_values = self.rank_values.T[kept].reshape(k, -1).T
+        self._group_ranks()
+
+    def _group_ranks(self) -> None:
+        """Ties share a group id in sorted order."""
+        starts = np.ones_like(self.rank_values, dtype=bool)
+        starts[1:] = self.rank_values[1:] != self.rank_values[:-1]
+        self.rank_groups = np.cumsum(starts, axis=0) - 1
+
+    def _ranks(self, column: int, rows: np.ndarray) -> np.ndarray:
+        """Average ranks of the selected rows of one column (other entries are meaningless)."""
+        order = self.rank_order[:, column]
+        groups = self.rank_groups[:, column]
+        counts = np.bincount(groups[rows[order]], minlength=groups[-1] + 1 if len(groups) else 0)
+        starts = np.cumsum(counts) - counts
+        ranks = np.empty(len(rows))
+        ranks[order] = (starts + (counts + 1) / 2)[groups]
+        return ranks
+
+    def pearson(self, mask: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """
+        Pearson correlation matrix of the selected cells, assembled from the accumulators.
+
+        Args:
+            mask: Cell mask from select (all cells when None)
+
+        Returns:
+            pd.DataFrame: Correlation matrix indexed by column names
+        """
+        if mask is None:
+            mask = np.ones(self.n_cells, dtype=bool)
+        n = self.n[mask].sum(axis=0)
+        sum_x = self.sum_x[mask].sum(axis=0)
+        sum_xx = self.sum_xx[mask].sum(axis=0)
+        sum_xy = self.sum_xy[mask].sum(axis=0)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            covariance = sum_xy - sum_x * sum_x.T / n
+            variance = sum_xx - sum_x ** 2 / n
+            # A constant column leaves only rounding error; pandas reports NaN there
+            variance[variance <= VARIANCE_RTOL * sum_xx] = np.nan
+            corr = covariance / np.sqrt(variance * variance.T)
+        corr[n < 2] = np.nan
+        return pd.DataFrame(np.clip(corr, -1, 1), index=self.columns, columns=self.columns)
+
+    @instrument('CorrelationEngine.spearman')
+    def spearman(self, mask: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """
+        Spearman rank correlation matrix of the selected cells.
+
+        Args:
+            mask: Cell mask from select (all cells when None)
+
+        Returns:
+            pd.DataFrame: Correlation matrix indexed by column names
+        """
+        rows = np.ones(len(self.row_cell), dtype=bool) if mask is None else mask[self.row_cell]
+        valid = ~np.isnan(self.values)
+        k = len(self.columns)
+        corr = np.full((k, k), np.nan)
+        for i in range(k):
+            for j in range(i, k):
+                pair_rows = rows & valid[:, i] & valid[:, j]
+                if pair_rows.sum() < 2:
+                    continue
+                x = self._ranks(i, pair_rows)[pair_rows]
+                y = x if i == j else self._ranks(j, pair_rows)[pair_rows]
+                x, y = x - x.mean(), y - y.mean()
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    corr[i, j] = corr[j, i] = (x @ y) / np.sqrt((x @ x) * (y @ y))
+        return pd.DataFrame(np.clip(corr, -1, 1), index=self.columns, columns=self.columns)
+
+    def correlation(self, mask: Optional[np.ndarray] = None, method: str = 'pearson') -> pd.DataFrame:
+        """Correlation matrix of the selected cells with 'pearson' or 'spearman'."""
+        if method not in CORRELATION_METHODS:
+            raise ValueError(f"Unknown correlation method: {method!r}")
+        return self.pearson(mask) if method == 'pearson' else self.spearman(mask)
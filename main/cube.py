@@ -0,0 +1,253 @@
+import pandas as pd
+import numpy as np
+from typing import Dict, Iterable, Optional, Tuple
+from instrumentation import instrument
+
+# Cell dimensions of the cube; Marla bins are the distinct Marla values, so range filters are exact.
+# Rows flagged in the Outlier column (see analysis.flag_outliers) get cells of their own.
+CUBE_DIMENSIONS = ['Location', 'Bedrooms', 'Marla']
+
+
+def location_categorical(df: pd.DataFrame) -> pd.Series:
+    """Return the Location column as a categorical (a no-op for the compact schema)."""
+    locations = df['Location']
+    if isinstance(locations.dtype, pd.CategoricalDtype):
+        return locations
+    return locations.astype('category')
+
+
+class CellIndex:
+    """
+    Cells of the (Location, Bedrooms, Marla) grid used by the precomputed aggregates.
+
+    Holds locations (the location labels) and the per-cell arrays cell_location (codes
+    into locations), cell_bedrooms, cell_marla and cell_outlier. Subclasses call _init_cells
+    and map rows to cells with _assign_cells, which appends cells for unseen combinations.
+    """
+
+    def _init_cells(self) -> None:
+        self.locations = pd.Index([], dtype=object)
+        self.cell_location = np.empty(0, dtype=np.int64)
+        self.cell_bedrooms = np.empty(0, dtype=np.float64)
+        self.cell_marla = np.empty(0, dtype=np.float64)
+        self.cell_outlier = np.empty(0, dtype=bool)
+
+    def _assign_cells(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Map each row to its cell, appending new locations and cells.
+
+        Existing arrays are replaced rather than extended in place.
+
+        Args:
+            df: Rows with Location, Bedrooms and Marla (and optionally Outlier)
+
+        Returns:
+            np.ndarray: Cell index of every row
+        """
+        locations = location_categorical(df)
+        categories = locations.cat.categories
+        self.locations = self.locations.append(categories.difference(self.locations, sort=False))
+        category_codes = self.locations.get_indexer(categories)
+        codes = locations.cat.codes.to_numpy()
+        codes = np.where(codes >= 0, category_codes[codes], -1)
+
+        outliers = (df['Outlier'].to_numpy(dtype=bool) if 'Outlier' in df.columns
+                    else np.zeros(len(df), dtype=bool))
+        keys = pd.MultiIndex.from_arrays([codes, df['Bedrooms'].to_numpy(dtype=np.float64),
+                                          df['Marla'].to_numpy(dtype=np.float64), outliers])
+        existing = pd.MultiIndex.from_arrays([self.cell_location, self.cell_bedrooms, self.cell_marla,
+                                              self.cell_outlier])
+        row_cells = existing.get_indexer(keys) if len(existing) else np.full(len(keys), -1)
+
+        new_rows = row_cells < 0
+        if new_rows.any():
+            new_codes, new_cells = pd.factorize(keys[new_rows])
+            row_cells[new_rows] = self.n_cells + new_codes
+            self.cell_location = np.concatenate([self.cell_location, new_cells.get_level_values(0).to_numpy()])
+            self.cell_bedrooms = np.concatenate([self.cell_bedrooms, new_cells.get_level_values(1).to_numpy()])
+            self.cell_marla = np.concatenate([self.cell_marla, new_cells.get_level_values(2).to_numpy()])
+            self.cell_outlier = np.concatenate([self.cell_outlier,
+                                                new_cells.get_level_values(3).to_numpy(dtype=bool)])
+        return row_cells
+
+    @property
+    def n_cells(self) -> int:
+        return len(self.cell_location)
+
+    def select(
+        self,
+        marla_range: Optional[Tuple[float, float]] = None,
+        bedrooms: Optional[Iterable] = None,
+        locations: Optional[Iterable[str]] = None,
+        exclude_outliers: bool = False
+    ) -> np.ndarray:
+        """
+        Build a boolean mask over the cells matching the dashboard filters.
+
+        Args:
+            marla_range: Inclusive (min, max) Marla range
+            bedrooms: Allowed bedroom counts
+            locations: Allowed location names
+            exclude_outliers: Whether to leave out the cells of rows flagged as outliers
+
+        Returns:
+            np.ndarray: Boolean mask with one entry per cell
+        """
+        mask = np.ones(self.n_cells, dtype=bool)
+        if marla_range is not None:
+            mask &= (self.cell_marla >= marla_range[0]) & (self.cell_marla <= marla_range[1])
+        if bedrooms is not None:
+            mask &= np.isin(self.cell_bedrooms, list(bedrooms))
+        if locations is not None:
+            codes = self.locations.get_indexer(list(locations))
+            mask &= np.isin(self.cell_location, codes[codes >= 0])
+        if exclude_outliers:
+            mask &= ~self.cell_outlier
+        return mask
+
+
+class AggregateCube(CellIndex):
+    """
+    Precomputed count, sum, sum of squares, min and max of Price per
+    (Location, Bedrooms, Marla) cell.
+
+    Headline metrics for a filter selection are answered by summing the selected cells,
+    so their cost depends on the number of cells, not on the number of listings.
+    """
+
+    @instrument('AggregateCube.build')
+    def __init__(self, df: pd.DataFrame, value_column: str = 'Price'):
+        self.value_column = value_column
+        self._init_cells()
+        self.count = np.empty(0, dtype=np.float64)
+        self.sum = np.empty(0, dtype=np.float64)
+        self.sum_sq = np.empty(0, dtype=np.float64)
+        self.min = np.empty(0, dtype=np.float64)
+        self.max = np.empty(0, dtype=np.float64)
+        self.update(df)
+
+    @instrument('AggregateCube.update')
+    def update(self, df: pd.DataFrame) -> None:
+        """
+        Add rows to the cube.
+
+        Existing arrays are never written to, so a shallow copy of a cube that other
+        sessions are reading can be updated safely.
+
+        Args:
+            df: Rows with the value column plus Location, Bedrooms and Marla
+        """
+        row_cells = self._assign_cells(df)
+        values = df[self.value_column].to_numpy(dtype=np.float64)
+        frame = pd.DataFrame({'cell': row_cells, 'value': values, 'value_sq': values ** 2})
+        cells = frame.groupby('cell', sort=False).agg(
+            count=('value', 'count'),
+            sum=('value', 'sum'),
+            sum_sq=('value_sq', 'sum'),
+            min=('value', 'min'),
+            max=('value', 'max')
+        )
+        index = cells.index.to_numpy()
+
+        def grown(values: np.ndarray, fill: float) -> np.ndarray:
+            return np.concatenate([values, np.full(self.n_cells - len(values), fill)])
+
+        self.count = grown(self.count, 0.0)
+        self.count[index] += cells['count'].to_numpy(dtype=np.float64)
+        self.sum = grown(self.sum, 0.0)
+        self.sum[index] += cells['sum'].to_numpy()
+        self.sum_sq = grown(self.sum_sq, 0.0)
+        self.sum_sq[index] += cells['sum_sq'].to_numpy()
+        self.min = grown(self.min, np.nan)
+        self.min[index] = np.fmin(self.min[index], cells['min'].to_numpy())
+        self.max = grown(self.max, np.nan)
+        self.max[index] = np.fmax(self.max[index], cells['max'].to_numpy())
+
+    @instrument('AggregateCube.remove')
+    def remove(self, df: pd.DataFrame, data: pd.DataFrame) -> None:
+        """
+        Subtract rows from the cube.
+
+        Counts and sums are subtracted; the minimum and maximum of the cells the rows came
+        from are recomputed from the remaining rows of their locations. Existing arrays are
+        never written to, like in update.
+
+        Args:
+            df: The removed rows (already added to the cube)
+            data: The remaining rows
+        """
+        row_cells = self._assign_cells(df)
+        values = df[self.value_column].to_numpy(dtype=np.float64)
+        n_cells = self.n_cells
+        self.count = self.count - np.bincount(row_cells, minlength=n_cells)
+        self.sum = self.sum - np.bincount(row_cells, weights=values, minlength=n_cells)
+        self.sum_sq = self.sum_sq - np.bincount(row_cells, weights=values ** 2, minlength=n_cells)
+        # Empty cells hold exact zeros rather than rounding residue
+        empty = self.count <= 0
+        self.count[empty] = self.sum[empty] = self.sum_sq[empty] = 0.0
+
+        touched = np.unique(row_cells)
+        remaining = data[data['Location'].isin(df['Location'].unique())]
+        remaining_cells = self._assign_cells(remaining)
+        in_touched = np.isin(remaining_cells, touched)
+        frame = pd.DataFrame({'cell': remaining_cells[in_touched],
+                              'value': remaining[self.value_column].to_numpy(dtype=np.float64)[in_touched]})
+        extremes = frame.groupby('cell', sort=False)['value'].agg(['min', 'max'])
+        self.min, self.max = self.min.copy(), self.max.copy()
+        self.min[touched] = self.max[touched] = np.nan
+        self.min[extremes.index.to_numpy()] = extremes['min'].to_numpy()
+        self.max[extremes.index.to_numpy()] = extremes['max'].to_numpy()
+
+    @instrument()
+    def summarize(self, mask: Optional[np.ndarray] = None, top_n: int = 10) -> Dict:
+        """
+        Compute the headline market metrics for the selected cells.
+
+        Args:
+            mask: Cell mask from select (all cells when None)
+            top_n: Number of top locations to return
+
+        Returns:
+            Dict containing count, price/marla/bedroom statistics and location rankings
+        """
+        if mask is None:
+            mask = np.ones(self.n_cells, dtype=bool)
+        count = self.count[mask]
+        n = count.sum()
+        if n == 0:
+            return {'count': 0}
+
+        total = self.sum[mask].sum()
+        mean = total / n
+        variance = max(self.sum_sq[mask].sum() - total * total / n, 0.0) / (n - 1) if n > 1 else np.nan
+
+        # Per-location totals over the selected cells
+        location_codes = self.cell_location[mask]
+        valid = location_codes >= 0
+        location_counts = np.bincount(location_codes[valid], weights=count[valid], minlength=len(self.locations))
+        location_sums = np.bincount(location_codes[valid], weights=self.sum[mask][valid], minlength=len(self.locations))
+        present = location_counts > 0
+        location_means = location_sums[present] / location_counts[present]
+        location_price_cv = np.std(location_means, ddof=1) / mean if present.sum() > 1 else np.nan
+
+        order = np.argsort(-location_counts, kind='stable')[:min(top_n, present.sum())]
+        top_locations = pd.Series(location_counts[order].astype(np.int64), index=self.locations[order], name='count')
+
+        marla = self.cell_marla[mask]
+        # Cells emptied by remove() keep their place but no longer count
+        occupied = count > 0
+        return {
+            'count': int(n),
+            'price_mean': mean,
+            'price_std': np.sqrt(variance),
+            'price_min': np.nanmin(self.min[mask][occupied]),
+            'price_max': np.nanmax(self.max[mask][occupied]),
+            'marla_mean': (marla * count).sum() / n,
+            'marla_min': marla[occupied].min(),
+            'marla_max': marla[occupied].max(),
+            'bedrooms_mean': (self.cell_bedrooms[mask] * count).sum() / n,
+            'top_locations': top_locations,
+            'mode_location': top_locations.index[0] if len(top_locations) else None,
+            'n_locations': int(present.sum()),
+            'location_price_cv': location_price_cv
+        }
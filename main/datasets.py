@@ -0,0 +1,176 @@
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Hashable, NamedTuple, Optional
+
+import pandas as pd
+
+from cache import make_key
+from estimators import warm_rent_estimator
+from instrumentation import stage
+from refresh import DatasetState, build_dataset_state, refresh_dataset_state
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of the data file for changes
+DATA_POLL_ENV = 'THINKLYTICS_DATA_POLL_SECONDS'
+DEFAULT_POLL_SECONDS = 2.0
+
+
+class FileSignature(NamedTuple):
+    """Identity of one version of a file; a replaced or rewritten file changes it."""
+    inode: int
+    size: int
+    mtime_ns: int
+
+
+def file_signature(path: Path) -> Optional[FileSignature]:
+    """Return the signature of a file, or None when it does not exist."""
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return FileSignature(stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+class DatasetSnapshot(NamedTuple):
+    """One immutable version of the dataset; key identifies it in cache keys."""
+    key: Hashable
+    dataset: DatasetState
+
+
+class DatasetManager:
+    """
+    Serves the current dataset and reloads it in the background when the file changes.
+
+    A watcher thread polls the file's inode, size and modification time. A change is
+    picked up once the signature is the same on two consecutive polls, so a file that is
+    still being written is not read half-way. The new rows are merged into the previous
+    state (see refresh_dataset_state) off the script threads, the rent estimator of the new
+    version is loaded or trained, and the new snapshot replaces the old one with a single
+    reference swap.
+
+    A rerun takes one snapshot at its start and uses it throughout, so it never mixes two
+    versions; reruns that start after the swap see the new version without waiting for it.
+    """
+
+    def __init__(self, path: Path, poll_interval: float = DEFAULT_POLL_SECONDS,
+                 reader: Callable[[Path], pd.DataFrame] = pd.read_csv):
+        self.path = Path(path)
+        self.poll_interval = poll_interval
+        self.reader = reader
+        self._snapshot: Optional[DatasetSnapshot] = None
+        self._signature: Optional[FileSignature] = None
+        self._pending: Optional[FileSignature] = None
+        self._failed: Optional[FileSignature] = None
+        self._load_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def current(self) -> DatasetSnapshot:
+        """
+        Return the latest loaded snapshot; the first call loads the file synchronously.
+
+        Raises:
+            FileNotFoundError: If the data file does not exist on the first load
+        """
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+        with self._load_lock:
+            while self._snapshot is None:
+                signature = file_signature(self.path)
+                if signature is None:
+                    raise FileNotFoundError(f"Data file not found: {self.path}")
+                self._load(signature)
+            return self._snapshot
+
+    def _load(self, signature: FileSignature) -> bool:
+        """Read the file and swap in the new version; returns False if it changed while reading."""
+        with stage('dataset.reload', path=str(self.path)):
+            raw = self.reader(self.path)
+            if file_signature(self.path) != signature:
+                logger.info("Data file changed while it was read; retrying on the next poll")
+                return False
+            logger.info(f"Successfully loaded data with {len(raw)} rows")
+
+            previous = self._snapshot
+            if previous is None:
+                dataset = build_dataset_state(raw)
+            else:
+                dataset, stats = refresh_dataset_state(previous.dataset, raw)
+                logger.info(f"Refreshed data ({stats['mode']}): {stats['delta_rows']} of {stats['rows']} rows "
+                            f"processed, {stats['removed_rows']} removed in {stats['seconds']:.2f}s")
+            # Ready before the swap, so no rerun trains or loads the model
+            warm_rent_estimator(dataset)
+
+        key = make_key(str(self.path), *signature)
+        self._signature = signature
+        self._snapshot = DatasetSnapshot(key, dataset)
+        return True
+
+    def check(self) -> bool:
+        """
+        Poll the file once and reload it if it changed and has settled.
+
+        Returns:
+            bool: Whether a new version was swapped in
+        """
+        signature = file_signature(self.path)
+        if signature is None or signature == self._signature or signature == self._failed:
+            self._pending = None
+            return False
+        if signature != self._pending:
+            # Wait for one more poll in case the file is still being written
+            self._pending = signature
+            return False
+
+        self._pending = None
+        with self._load_lock:
+            if signature == self._signature:
+                return False
+            try:
+                return self._load(signature)
+            except Exception as e:
+                # Keep serving the previous version; a later write will be tried again
+                logger.error(f"Failed to reload {self.path}: {str(e)}")
+                self._failed = signature
+                return False
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            self.check()
+
+    def start(self) -> None:
+        """Start the watcher thread (idempotent)."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name='dataset-watcher', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_dataset_manager(path: Path) -> DatasetManager:
+    """
+    Return the process-wide dataset manager, starting its watcher on the first call.
+
+    The file is polled every THINKLYTICS_DATA_POLL_SECONDS seconds (default: 2).
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            interval = os.environ.get(DATA_POLL_ENV)
+            _manager = DatasetManager(path, float(interval) if interval else DEFAULT_POLL_SECONDS)
+            _manager.start()
+            logger.info(f"Watching {path} for changes every {_manager.poll_interval:g}s")
+        return _manager
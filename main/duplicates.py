@@ -0,0 +1,364 @@
+"""
+Near-duplicate listing detection with MinHash signatures over the Details text.
+
+Re-posted listings usually keep the location, bedrooms, size and price and only reword the
+title, so listings are compared only within blocks of equal (Location, Bedrooms, Marla,
+Price). Within a block, two listings are near duplicates when the estimated Jaccard
+similarity of their character shingles reaches the threshold. Candidate pairs come from
+LSH banding of the signatures (rows sharing a block and all values of one band), so the
+cost grows with the number of listings rather than the number of pairs.
+"""
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from instrumentation import instrument, stage
+
+logger = logging.getLogger(__name__)
+
+# Listings only match within equal values of these columns
+BLOCK_COLUMNS = ['Location', 'Bedrooms', 'Marla', 'Price']
+DEFAULT_NUM_PERM = 64
+DEFAULT_BANDS = 16
+DEFAULT_SHINGLE_SIZE = 5
+# Estimated Jaccard similarity of the shingle sets from which listings are duplicates
+DEFAULT_SIMILARITY = 0.8
+# Rows per signature chunk; chunks are hashed in parallel
+DEFAULT_CHUNK_ROWS = 50_000
+
+_EMPTY = np.iinfo(np.uint64).max
+_PRIME = np.uint64(0x100000001B3)
+
+
+def _mix(values: np.ndarray) -> np.ndarray:
+    """SplitMix64 finalizer: a fast, well-distributed 64-bit hash of uint64 values."""
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def normalize_details(details: pd.Series) -> pd.Series:
+    """Lower-case the text and collapse whitespace, so spacing and case edits do not count."""
+    return details.fillna('').astype(str).str.lower().str.split().str.join(' ')
+
+
+def shingle_hashes(texts: List[str], shingle_size: int = DEFAULT_SHINGLE_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Hash every character shingle of every text, without building the shingle strings.
+
+    Args:
+        texts: Normalized texts
+        shingle_size: Characters per shingle
+
+    Returns:
+        Tuple of the shingle hashes and the text index of each (ascending); texts shorter
+        than shingle_size have no shingles
+    """
+    lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+    chars = np.frombuffer(''.join(texts).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    n_windows = len(chars) - shingle_size + 1
+    if n_windows <= 0:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+
+    hashes = np.zeros(n_windows, dtype=np.uint64)
+    for offset in range(shingle_size):
+        hashes = hashes * _PRIME + chars[offset:offset + n_windows]
+    rows = np.repeat(np.arange(len(texts)), lengths)[:n_windows]
+    ends = np.cumsum(lengths)
+    # Windows that run into the next text are not shingles
+    valid = np.arange(n_windows) + shingle_size <= ends[rows]
+    return _mix(hashes[valid]), rows[valid]
+
+
+def minhash_signatures(texts: List[str], num_perm: int = DEFAULT_NUM_PERM,
+                       shingle_size: int = DEFAULT_SHINGLE_SIZE, seed: int = 0) -> np.ndarray:
+    """
+    MinHash signatures of the shingle sets of some texts.
+
+    Args:
+        texts: Normalized texts
+        num_perm: Hash functions per signature
+        shingle_size: Characters per shingle
+        seed: Seed of the hash functions (signatures are only comparable for equal seeds)
+
+    Returns:
+        np.ndarray: (len(texts), num_perm) uint64 signatures; texts without shingles get the
+        maximum value everywhere
+    """
+    hashes, rows = shingle_hashes(texts, shingle_size)
+    signatures = np.full((len(texts), num_perm), _EMPTY, dtype=np.uint64)
+    if len(hashes) == 0:
+        return signatures
+    starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+    salts = _mix(np.arange(num_perm, dtype=np.uint64) + np.uint64(seed) * np.uint64(num_perm))
+    for i, salt in enumerate(salts):
+        signatures[rows[starts], i] = np.minimum.reduceat(_mix(hashes ^ salt), starts)
+    return signatures
+
+
+def _signature_chunk(args) -> np.ndarray:
+    texts, num_perm, shingle_size = args
+    return minhash_signatures(texts, num_perm, shingle_size)
+
+
+def block_keys(df: pd.DataFrame) -> np.ndarray:
+    """Hash of each row's BLOCK_COLUMNS values (missing values hash alike)."""
+    blocks = df[BLOCK_COLUMNS].copy()
+    for col in BLOCK_COLUMNS:
+        if isinstance(blocks[col].dtype, pd.CategoricalDtype):
+            blocks[col] = blocks[col].astype(object)
+    blocks[['Bedrooms', 'Marla', 'Price']] = blocks[['Bedrooms', 'Marla', 'Price']].astype(np.float64)
+    return pd.util.hash_pandas_object(blocks, index=False).to_numpy()
+
+
+def band_buckets(keys: np.ndarray, signatures: np.ndarray, band: int, bands: int) -> np.ndarray:
+    """Bucket of every row in one band: a hash of its block key and the band's signature values."""
+    width = signatures.shape[1] // bands
+    bucket = keys
+    for col in range(band * width, (band + 1) * width):
+        bucket = _mix(bucket ^ signatures[:, col])
+    return bucket
+
+
+def _first_of_bucket(buckets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Pair every row with the first row of its bucket (positions into buckets)."""
+    if not len(buckets):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    order = np.argsort(buckets, kind='stable')
+    sorted_buckets = buckets[order]
+    starts = np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]]
+    first = order[np.flatnonzero(starts)][np.cumsum(starts) - 1]
+    members = ~starts
+    return first[members], order[members]
+
+
+def candidate_pairs(keys: np.ndarray, signatures: np.ndarray, bands: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pairs of rows that share a block key and all signature values of at least one band.
+
+    Every row is paired with the first row of each bucket it falls in, which is enough to
+    connect all rows of a bucket.
+
+    Returns:
+        Tuple of left and right row positions (left < right)
+    """
+    num_perm = signatures.shape[1]
+    if num_perm % bands:
+        raise ValueError(f"{bands} bands do not divide {num_perm} hash functions")
+    eligible = np.flatnonzero(signatures[:, 0] != _EMPTY)
+    left, right = [], []
+    for band in range(bands):
+        first, members = _first_of_bucket(band_buckets(keys[eligible], signatures[eligible], band, bands))
+        left.append(eligible[first])
+        right.append(eligible[members])
+    return np.concatenate(left), np.concatenate(right)
+
+
+class NearDuplicateIndex:
+    """
+    Block keys and MinHash signatures of the kept listings, to check new listings against.
+
+    add() flags the rows that nearly duplicate a kept listing or an earlier row of the same
+    batch and indexes the others, so a full load and later increments use the same rule:
+    the first listing of a group of near duplicates is kept. Which listing that is depends
+    on the order the listings arrived in, so after remove() the kept set can differ slightly
+    from a full load of the same rows (for example, a re-post indexed while its original was
+    kept elsewhere). add() and remove() do not write into existing arrays, so a shallow copy
+    of an index that other sessions are reading can be changed safely.
+
+    The bucket of every indexed listing in every LSH band is kept sorted, so add() only hashes
+    the new rows and looks their buckets up instead of pairing all indexed listings again.
+
+    When add() is given ids for the rows, every flagged row is recorded with the indexed
+    listing it was dropped for, and remove() hands back the ids of the re-posts whose listing
+    is removed, so only those have to be checked again.
+
+    Attributes:
+        keys: Block key of every indexed listing
+        signatures: MinHash signature of every indexed listing
+        buckets: Per band, the sorted buckets of the indexed listings with signatures
+        bucket_rows: Per band, the indexed listing of each entry of buckets (ascending per bucket)
+        repost_ids: Id of every recorded re-post
+        repost_rows: Indexed listing each recorded re-post was dropped for
+    """
+
+    def __init__(self, num_perm: int = DEFAULT_NUM_PERM, bands: int = DEFAULT_BANDS,
+                 similarity: float = DEFAULT_SIMILARITY, shingle_size: int = DEFAULT_SHINGLE_SIZE,
+                 max_workers: Optional[int] = None, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+        if num_perm % bands:
+            raise ValueError(f"{bands} bands do not divide {num_perm} hash functions")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.similarity = similarity
+        self.shingle_size = shingle_size
+        self.max_workers = os.cpu_count() if max_workers is None else max_workers
+        self.chunk_rows = chunk_rows
+        self.keys = np.empty(0, dtype=np.uint64)
+        self.signatures = np.empty((0, num_perm), dtype=np.uint64)
+        self.buckets = [np.empty(0, dtype=np.uint64) for _ in range(bands)]
+        self.bucket_rows = [np.empty(0, dtype=np.int64) for _ in range(bands)]
+        self.repost_ids = np.empty(0, dtype=np.uint64)
+        self.repost_rows = np.empty(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @instrument('NearDuplicateIndex.signatures')
+    def compute_signatures(self, details: pd.Series) -> np.ndarray:
+        """Signatures of a Details column, hashed in parallel chunks of chunk_rows rows."""
+        texts = normalize_details(details).tolist()
+        chunks = [(texts[start:start + self.chunk_rows], self.num_perm, self.shingle_size)
+                  for start in range(0, len(texts), self.chunk_rows)]
+        workers = min(self.max_workers, len(chunks))
+        if workers <= 1:
+            results = [_signature_chunk(chunk) for chunk in chunks]
+        else:
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            with executor:
+                results = list(executor.map(_signature_chunk, chunks))
+        return np.concatenate(results) if results else np.empty((0, self.num_perm), dtype=np.uint64)
+
+    @instrument('NearDuplicateIndex.add')
+    def add(self, df: pd.DataFrame, ids: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Flag near duplicates among new listings and index the rest.
+
+        Args:
+            df: Parsed listings with Details and the BLOCK_COLUMNS
+            ids: Id per row of df (e.g. raw row hashes); flagged rows are recorded under their
+                id with the listing they duplicate, for remove()
+
+        Returns:
+            np.ndarray: Boolean flag per row of df; flagged rows are not indexed
+        """
+        if not len(df):
+            return np.zeros(0, dtype=bool)
+        keys = block_keys(df)
+        signatures = self.compute_signatures(df['Details'])
+        offset = len(self.keys)
+
+        with stage('duplicates.match', rows=len(df)):
+            left, right = self._candidates(keys, signatures)
+            # Indexed rows are numbered first, new rows from offset on
+            left_signatures = np.empty((len(left), self.num_perm), dtype=np.uint64)
+            indexed = left < offset
+            left_signatures[indexed] = self.signatures[left[indexed]]
+            left_signatures[~indexed] = signatures[left[~indexed] - offset]
+            agreement = (left_signatures == signatures[right - offset]).mean(axis=1)
+            similar = agreement >= self.similarity
+            # Components over the new rows and the indexed rows they match
+            nodes, edges = np.unique(np.concatenate([np.arange(offset, offset + len(df)),
+                                                     left[similar], right[similar]]), return_inverse=True)
+            edges = edges[len(df):].reshape(2, -1)
+            graph = coo_matrix((np.ones(edges.shape[1]), (edges[0], edges[1])), shape=(len(nodes), len(nodes)))
+            _, labels = connected_components(graph, directed=False)
+            # The earliest row of every group is the one that is kept
+            first = np.full(labels.max() + 1 if len(nodes) else 0, offset + len(df), dtype=np.int64)
+            np.minimum.at(first, labels, nodes)
+            new_nodes = np.searchsorted(nodes, np.arange(offset, offset + len(df)))
+            matched = first[labels[new_nodes]]
+            duplicate = matched < np.arange(offset, offset + len(df))
+
+        if ids is not None and duplicate.any():
+            # The first row of a group is kept; new ones are indexed after the indexed rows
+            positions = offset + np.cumsum(~duplicate) - 1
+            matched = matched[duplicate]
+            from_batch = matched >= offset
+            matched[from_batch] = positions[matched[from_batch] - offset]
+            self.repost_ids = np.concatenate([self.repost_ids, np.asarray(ids, dtype=np.uint64)[duplicate]])
+            self.repost_rows = np.concatenate([self.repost_rows, matched])
+        self._index(keys[~duplicate], signatures[~duplicate])
+        if duplicate.any():
+            logger.info(f"Found {int(duplicate.sum())} near-duplicate listings among {len(df)} rows")
+        return duplicate
+
+    def _candidates(self, keys: np.ndarray, signatures: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Candidate pairs of new rows, as candidate_pairs over the indexed and the new rows would give.
+
+        A new row in a bucket of indexed listings is paired with the first of them; the other
+        new rows are paired with the first new row of their bucket.
+
+        Returns:
+            Tuple of left and right positions, counting the new rows from len(self) on
+        """
+        offset = len(self.keys)
+        eligible = np.flatnonzero(signatures[:, 0] != _EMPTY)
+        left, right = [], []
+        for band in range(self.bands):
+            buckets = band_buckets(keys[eligible], signatures[eligible], band, self.bands)
+            table, rows = self.buckets[band], self.bucket_rows[band]
+            slots = np.searchsorted(table, buckets)
+            found = slots < len(table)
+            found[found] = table[slots[found]] == buckets[found]
+            left.append(rows[slots[found]])
+            right.append(offset + eligible[found])
+            first, members = _first_of_bucket(buckets[~found])
+            rest = eligible[~found]
+            left.append(offset + rest[first])
+            right.append(offset + rest[members])
+        return np.concatenate(left), np.concatenate(right)
+
+    def _index(self, keys: np.ndarray, signatures: np.ndarray) -> None:
+        """Append listings and insert them into the bucket tables (after the indexed rows of each bucket)."""
+        offset = len(self.keys)
+        self.keys = np.concatenate([self.keys, keys])
+        self.signatures = np.concatenate([self.signatures, signatures])
+        eligible = np.flatnonzero(signatures[:, 0] != _EMPTY)
+        buckets, bucket_rows = [], []
+        for band in range(self.bands):
+            new = band_buckets(keys[eligible], signatures[eligible], band, self.bands)
+            order = np.argsort(new, kind='stable')
+            slots = np.searchsorted(self.buckets[band], new[order], side='right')
+            buckets.append(np.insert(self.buckets[band], slots, new[order]))
+            bucket_rows.append(np.insert(self.bucket_rows[band], slots, offset + eligible[order]))
+        self.buckets, self.bucket_rows = buckets, bucket_rows
+
+    def remove(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Stop indexing some listings, so later re-posts of them are kept again.
+
+        Args:
+            rows: Boolean mask over the indexed listings, in the order they were indexed
+
+        Returns:
+            np.ndarray: Ids of the recorded re-posts of the removed listings; they are no longer
+            recorded, so the caller adds them again if they are still listed
+        """
+        orphaned = rows[self.repost_rows]
+        released = self.repost_ids[orphaned]
+        self.keys = self.keys[~rows]
+        self.signatures = self.signatures[~rows]
+        # Positions of the remaining listings; the tables stay sorted
+        positions = np.cumsum(~rows) - 1
+        kept = [~rows[band_rows] for band_rows in self.bucket_rows]
+        self.buckets = [buckets[keep] for buckets, keep in zip(self.buckets, kept)]
+        self.bucket_rows = [positions[band_rows[keep]] for band_rows, keep in zip(self.bucket_rows, kept)]
+        self.repost_ids = self.repost_ids[~orphaned]
+        self.repost_rows = positions[self.repost_rows[~orphaned]]
+        return released
+
+    def forget(self, ids: np.ndarray) -> None:
+        """Drop the records of re-posts that are no longer listed."""
+        listed = ~np.isin(self.repost_ids, ids)
+        self.repost_ids = self.repost_ids[listed]
+        self.repost_rows = self.repost_rows[listed]
+
+    def merge(self, other: 'NearDuplicateIndex') -> 'NearDuplicateIndex':
+        """Index of the listings of both indexes (no matching between them)."""
+        merged = NearDuplicateIndex(self.num_perm, self.bands, self.similarity, self.shingle_size,
+                                    self.max_workers, self.chunk_rows)
+        merged._index(self.keys, self.signatures)
+        merged._index(other.keys, other.signatures)
+        merged.repost_ids = np.concatenate([self.repost_ids, other.repost_ids])
+        merged.repost_rows = np.concatenate([self.repost_rows, other.repost_rows + len(self.keys)])
+        return merged
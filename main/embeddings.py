@@ -0,0 +1,251 @@
+"""
+Offline BERT embeddings of the listing Details with a resumable on-disk vector store.
+
+Texts are embedded in mini-batches sorted by length, so a batch pads to similar lengths
+instead of the longest title of the whole file, and every finished batch is appended to a
+memory-mapped float16 store keyed by a hash of the text. An interrupted run continues
+where it stopped: texts whose key is already stored are skipped.
+
+Usage:
+    python main/embeddings.py data/zameen_rentals_data.csv --batch-size 64 --threads 4
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrument, stage
+
+logger = logging.getLogger(__name__)
+
+# Root directory of the vector store
+EMBEDDINGS_DIR_ENV = 'THINKLYTICS_EMBEDDINGS_DIR'
+DEFAULT_EMBEDDINGS_DIR = Path(__file__).resolve().parent.parent / 'data' / 'embeddings'
+DEFAULT_MODEL = 'bert-base-uncased'
+DEFAULT_BATCH_SIZE = 64
+# Listing titles are short; longer texts are truncated
+DEFAULT_MAX_LENGTH = 128
+# Batches between progress log lines
+PROGRESS_EVERY = 20
+
+
+def get_embeddings_dir() -> Path:
+    """Return the vector store directory (THINKLYTICS_EMBEDDINGS_DIR or data/embeddings)."""
+    return Path(os.environ.get(EMBEDDINGS_DIR_ENV, DEFAULT_EMBEDDINGS_DIR))
+
+
+def details_texts(details: pd.Series) -> pd.Series:
+    """Details as embedded: missing values become empty strings and outer whitespace is removed."""
+    return details.fillna('').astype(str).str.strip()
+
+
+def text_keys(texts: pd.Series) -> np.ndarray:
+    """Store keys of texts from details_texts (equal texts share a key and a vector)."""
+    return pd.util.hash_array(texts.to_numpy(dtype=object))
+
+
+class EmbeddingStore:
+    """
+    Append-only float16 vectors keyed by uint64 text hashes, memory-mapped from .npy files.
+
+    vectors.npy and keys.npy are preallocated and grown in chunks; manifest.json records how
+    many rows are valid and is replaced atomically after the rows are flushed, so a run that
+    is killed mid-batch loses at most that batch.
+    """
+
+    VECTORS_FILE = 'vectors.npy'
+    KEYS_FILE = 'keys.npy'
+    MANIFEST_FILE = 'manifest.json'
+
+    def __init__(self, root: Optional[Path] = None, model_name: str = DEFAULT_MODEL):
+        self.root = Path(root) if root is not None else get_embeddings_dir()
+        self.model_name = model_name
+        self.count = 0
+        self.dim: Optional[int] = None
+        self._vectors: Optional[np.ndarray] = None
+        self._keys: Optional[np.ndarray] = None
+        self._order: Optional[np.ndarray] = None
+
+        manifest_path = self.root / self.MANIFEST_FILE
+        if manifest_path.exists():
+            manifest = json.loads(manifest_path.read_text())
+            if manifest['model'] != model_name:
+                raise ValueError(f"{self.root} holds {manifest['model']} embeddings, not {model_name}")
+            self.count, self.dim = manifest['count'], manifest['dim']
+            self._vectors = np.load(self.root / self.VECTORS_FILE, mmap_mode='r+')
+            self._keys = np.load(self.root / self.KEYS_FILE, mmap_mode='r+')
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def capacity(self) -> int:
+        return 0 if self._keys is None else len(self._keys)
+
+    def keys(self) -> np.ndarray:
+        """Keys of the stored vectors in insertion order."""
+        return np.empty(0, dtype=np.uint64) if self._keys is None else self._keys[:self.count]
+
+    def _positions(self, keys: np.ndarray) -> np.ndarray:
+        """Row of every key in the store, or -1 when it is not stored."""
+        stored = self.keys()
+        if self._order is None:
+            self._order = np.argsort(stored, kind='stable')
+        if not len(stored):
+            return np.full(len(keys), -1, dtype=np.int64)
+        sorted_keys = stored[self._order]
+        found = np.minimum(np.searchsorted(sorted_keys, keys), len(stored) - 1)
+        return np.where(sorted_keys[found] == keys, self._order[found], -1)
+
+    def contains(self, keys: np.ndarray) -> np.ndarray:
+        """Boolean mask of the keys that have a vector."""
+        return self._positions(np.asarray(keys, dtype=np.uint64)) >= 0
+
+    def lookup(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Vectors of some keys.
+
+        Returns:
+            Tuple of a (len(keys), dim) float16 array (zeros for missing keys) and the mask
+            of keys that were found
+        """
+        positions = self._positions(np.asarray(keys, dtype=np.uint64))
+        found = positions >= 0
+        vectors = np.zeros((len(positions), self.dim or 0), dtype=np.float16)
+        if found.any():
+            vectors[found] = self._vectors[positions[found]]
+        return vectors, found
+
+    def reserve(self, rows: int, dim: int) -> None:
+        """Make room for rows more vectors, growing the files by at least half their size."""
+        if self.dim is not None and dim != self.dim:
+            raise ValueError(f"Store vectors have {self.dim} dimensions, got {dim}")
+        if self.count + rows <= self.capacity:
+            return
+        capacity = max(self.count + rows, self.capacity + self.capacity // 2)
+        self.root.mkdir(parents=True, exist_ok=True)
+        vectors_tmp = self.root / (self.VECTORS_FILE + '.tmp')
+        keys_tmp = self.root / (self.KEYS_FILE + '.tmp')
+        vectors = np.lib.format.open_memmap(vectors_tmp, mode='w+', dtype=np.float16, shape=(capacity, dim))
+        keys = np.lib.format.open_memmap(keys_tmp, mode='w+', dtype=np.uint64, shape=(capacity,))
+        if self.count:
+            vectors[:self.count] = self._vectors[:self.count]
+            keys[:self.count] = self._keys[:self.count]
+        vectors.flush()
+        keys.flush()
+        del vectors, keys
+        os.replace(vectors_tmp, self.root / self.VECTORS_FILE)
+        os.replace(keys_tmp, self.root / self.KEYS_FILE)
+        self._vectors = np.load(self.root / self.VECTORS_FILE, mmap_mode='r+')
+        self._keys = np.load(self.root / self.KEYS_FILE, mmap_mode='r+')
+        self.dim = dim
+
+    def append(self, keys: np.ndarray, vectors: np.ndarray) -> None:
+        """Store vectors under their keys and commit them to the manifest."""
+        self.reserve(len(keys), vectors.shape[1])
+        end = self.count + len(keys)
+        self._vectors[self.count:end] = vectors.astype(np.float16)
+        self._keys[self.count:end] = keys
+        self._vectors.flush()
+        self._keys.flush()
+
+        manifest = {'model': self.model_name, 'dim': self.dim, 'count': end, 'dtype': 'float16'}
+        manifest_tmp = self.root / (self.MANIFEST_FILE + '.tmp')
+        manifest_tmp.write_text(json.dumps(manifest))
+        os.replace(manifest_tmp, self.root / self.MANIFEST_FILE)
+        self.count = end
+        self._order = None
+
+
+def length_sorted_batches(texts: List[str], batch_size: int) -> List[np.ndarray]:
+    """Positions of texts in batches of similar length (longest first, so memory peaks early)."""
+    lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+    order = np.argsort(-lengths, kind='stable')
+    return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+
+@instrument()
+def embed_texts(texts: pd.Series, store: EmbeddingStore, tokenizer, model,
+                batch_size: int = DEFAULT_BATCH_SIZE, max_length: int = DEFAULT_MAX_LENGTH,
+                threads: Optional[int] = None) -> int:
+    """
+    Embed the texts that are not in the store yet and append them batch by batch.
+
+    Uses the [CLS] embedding of the last layer, like PropertyAnalyzer.get_bert_embeddings.
+
+    Args:
+        texts: Texts from details_texts (duplicates are embedded once)
+        store: Vector store to extend
+        tokenizer: Hugging Face tokenizer
+        model: Hugging Face model in eval mode
+        batch_size: Texts per forward pass
+        max_length: Tokens per text before truncation
+        threads: Torch intra-op threads (torch default when None)
+
+    Returns:
+        int: Number of texts embedded by this call
+    """
+    import torch
+
+    if threads is not None:
+        torch.set_num_threads(threads)
+    keys = text_keys(texts)
+    keys, first = np.unique(keys, return_index=True)
+    pending = ~store.contains(keys)
+    keys, pending_texts = keys[pending], texts.iloc[first[pending]].tolist()
+    logger.info(f"{len(keys)} of {len(first)} distinct texts need embeddings ({len(store)} stored)")
+
+    start = time.perf_counter()
+    done = 0
+    batches = length_sorted_batches(pending_texts, batch_size)
+    for i, batch in enumerate(batches, 1):
+        with stage('embeddings.batch', rows=len(batch)):
+            inputs = tokenizer([pending_texts[j] for j in batch], padding=True, truncation=True,
+                               max_length=max_length, return_tensors='pt')
+            with torch.no_grad():
+                vectors = model(**inputs).last_hidden_state[:, 0, :].numpy()
+            store.append(keys[batch], vectors)
+        done += len(batch)
+        if i % PROGRESS_EVERY == 0 or i == len(batches):
+            rate = done / (time.perf_counter() - start)
+            logger.info(f"Embedded {done}/{len(keys)} texts ({rate:.0f}/s, "
+                        f"{(len(keys) - done) / rate:.0f}s left)")
+    return done
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('data', type=Path, help="Raw rentals CSV")
+    parser.add_argument('--root', type=Path, default=None, help="Vector store directory")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Texts per batch")
+    parser.add_argument('--max-length', type=int, default=DEFAULT_MAX_LENGTH, help="Tokens per text")
+    parser.add_argument('--threads', type=int, default=None, help="Torch threads (default: torch's choice)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    from transformers import BertModel, BertTokenizer
+
+    texts = details_texts(pd.read_csv(args.data, usecols=['Details'])['Details'])
+    store = EmbeddingStore(args.root)
+    tokenizer = BertTokenizer.from_pretrained(DEFAULT_MODEL)
+    model = BertModel.from_pretrained(DEFAULT_MODEL)
+    model.eval()
+    try:
+        embed_texts(texts, store, tokenizer, model, args.batch_size, args.max_length, args.threads)
+    except KeyboardInterrupt:
+        logger.info(f"Interrupted; {len(store)} vectors are stored and the next run resumes from there")
+        return 130
+    logger.info(f"{len(store)} vectors stored in {store.root}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,318 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import HistGradientBoostingRegressor
+from sklearn.neighbors import KNeighborsRegressor
+
+from instrumentation import instrument, stage
+
+logger = logging.getLogger(__name__)
+
+# Estimator used by get_rent_estimator (a key of ESTIMATORS)
+ESTIMATOR_ENV = 'THINKLYTICS_ESTIMATOR'
+DEFAULT_ESTIMATOR = 'hgb'
+# Directory of the trained models
+MODEL_DIR_ENV = 'THINKLYTICS_MODEL_DIR'
+DEFAULT_MODEL_DIR = Path(__file__).resolve().parent.parent / 'data' / 'models'
+# Bump when features or training change, so models saved by older code are retrained
+ESTIMATOR_VERSION = 1
+# Fitted estimators kept in memory (one per dataset version, e.g. per catalog city selection)
+ESTIMATOR_CACHE_SIZE = 4
+# Saved models kept per estimator; the least recently used files are deleted beyond this
+MAX_SAVED_MODELS = 8
+# Pseudo-listings pulling a location's mean log price towards its city's (and a city's towards all)
+LOCATION_SMOOTHING = 10.0
+FEATURE_NAMES = ['LogMarla', 'Bedrooms', 'Washrooms', 'LocationPrice', 'City']
+
+
+class RentEstimator(ABC):
+    """
+    Location-aware monthly rent model on Marla, Bedrooms, Washrooms and location.
+
+    Locations enter as their smoothed mean log price (too many for categorical splits) and
+    cities as category codes; unknown locations fall back to their city or the overall mean.
+    Models are fitted on log prices without the rows flagged as outliers, and missing
+    washroom counts are filled with the typical count for the bedrooms. Subclasses
+    implement _fit_model and _predict on the feature matrix.
+    """
+
+    name: str = ''
+
+    def __init__(self, smoothing: float = LOCATION_SMOOTHING):
+        self.smoothing = smoothing
+
+    def _fit_encodings(self, df: pd.DataFrame, log_price: pd.Series) -> None:
+        locations = df['Location'].astype(str)
+        cities = df['City'].astype(object).fillna('') if 'City' in df.columns else pd.Series('', index=df.index)
+        self.global_price = float(log_price.mean())
+
+        by_city = log_price.groupby(cities.to_numpy()).agg(['sum', 'count'])
+        self.city_price = (by_city['sum'] + self.smoothing * self.global_price) / (by_city['count'] + self.smoothing)
+        self.cities = pd.Index(self.city_price.index)
+
+        by_location = log_price.groupby(locations.to_numpy()).agg(['sum', 'count'])
+        self.location_city = cities.groupby(locations.to_numpy()).first()
+        prior = self.city_price.reindex(self.location_city.reindex(by_location.index)).to_numpy()
+        self.location_price = pd.Series(
+            (by_location['sum'].to_numpy() + self.smoothing * prior) / (by_location['count'].to_numpy() + self.smoothing),
+            index=by_location.index)
+
+        washrooms = df.groupby('Bedrooms', observed=True)['Washrooms'].median()
+        self.washrooms_by_bedrooms = washrooms.round()
+        self.default_washrooms = float(np.round(df['Washrooms'].median()))
+
+    def features(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Feature matrix (FEATURE_NAMES) of listings or specs.
+
+        Args:
+            df: Rows with Marla and Bedrooms, and optionally Washrooms, Location and City
+
+        Returns:
+            np.ndarray: float64 matrix; unknown cities are NaN
+        """
+        n = len(df)
+        marla = df['Marla'].to_numpy(dtype=np.float64)
+        bedrooms = df['Bedrooms'].to_numpy(dtype=np.float64)
+        washrooms = (df['Washrooms'].to_numpy(dtype=np.float64) if 'Washrooms' in df.columns
+                     else np.full(n, np.nan))
+        typical = self.washrooms_by_bedrooms.reindex(np.round(bedrooms)).to_numpy(dtype=np.float64)
+        washrooms = np.where(np.isnan(washrooms), np.where(np.isnan(typical), self.default_washrooms, typical),
+                             washrooms)
+
+        locations = (df['Location'].astype(object).to_numpy() if 'Location' in df.columns
+                     else np.full(n, None, dtype=object))
+        if 'City' in df.columns:
+            cities = df['City'].astype(object).to_numpy()
+        else:
+            cities = self.location_city.reindex(locations).to_numpy()
+        cities = np.where(pd.isna(cities), self.location_city.reindex(locations).to_numpy(), cities)
+        location_price = self.location_price.reindex(locations).to_numpy(dtype=np.float64)
+        city_price = self.city_price.reindex(cities).to_numpy(dtype=np.float64)
+        location_price = np.where(np.isnan(location_price),
+                                  np.where(np.isnan(city_price), self.global_price, city_price), location_price)
+        city_codes = self.cities.get_indexer(cities).astype(np.float64)
+        city_codes[city_codes < 0] = np.nan
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_marla = np.log2(marla)
+        return np.column_stack([log_marla, bedrooms, washrooms, location_price, city_codes])
+
+    @instrument('RentEstimator.fit')
+    def fit(self, df: pd.DataFrame) -> 'RentEstimator':
+        """Fit the encodings and the model on cleaned listings (without flagged outliers)."""
+        train = df[~df['Outlier']] if 'Outlier' in df.columns else df
+        train = train[train['Price'] > 0]
+        log_price = np.log(train['Price'].astype(np.float64))
+        self._fit_encodings(train, log_price)
+        self._fit_model(self.features(train), log_price.to_numpy())
+        self.n_train = len(train)
+        return self
+
+    def predict(self, df: pd.DataFrame) -> np.ndarray:
+        """Predicted monthly rent of every row of df, in one vectorized call."""
+        if not len(df):
+            return np.empty(0)
+        return np.exp(self._predict(self.features(df)))
+
+    @abstractmethod
+    def _fit_model(self, X: np.ndarray, y: np.ndarray) -> None:
+        """Fit the model on the feature matrix and log prices."""
+
+    @abstractmethod
+    def _predict(self, X: np.ndarray) -> np.ndarray:
+        """Predicted log prices of a feature matrix."""
+
+
+class GradientBoostingRentEstimator(RentEstimator):
+    """Histogram gradient boosting on the features, with the city as a categorical feature."""
+
+    name = 'hgb'
+
+    def __init__(self, smoothing: float = LOCATION_SMOOTHING, max_iter: int = 300, learning_rate: float = 0.1):
+        super().__init__(smoothing)
+        self.max_iter = max_iter
+        self.learning_rate = learning_rate
+
+    def _fit_model(self, X: np.ndarray, y: np.ndarray) -> None:
+        categorical = [name == 'City' for name in FEATURE_NAMES]
+        self.model = HistGradientBoostingRegressor(max_iter=self.max_iter, learning_rate=self.learning_rate,
+                                                   categorical_features=categorical, random_state=0)
+        self.model.fit(X, y)
+
+    def _predict(self, X: np.ndarray) -> np.ndarray:
+        return self.model.predict(X)
+
+
+class KNNRentEstimator(RentEstimator):
+    """
+    Distance-weighted k nearest listings by size, rooms and location price level.
+
+    The numeric features are divided by their standard deviations and the location price
+    is weighted by location_weight, so neighbours come from similarly priced locations.
+    """
+
+    name = 'knn'
+
+    def __init__(self, smoothing: float = LOCATION_SMOOTHING, n_neighbors: int = 15, location_weight: float = 2.0):
+        super().__init__(smoothing)
+        self.n_neighbors = n_neighbors
+        self.location_weight = location_weight
+
+    def _scaled(self, X: np.ndarray) -> np.ndarray:
+        return np.nan_to_num(X[:, :4] / self.scale)
+
+    def _fit_model(self, X: np.ndarray, y: np.ndarray) -> None:
+        self.scale = np.nanstd(X[:, :4], axis=0)
+        self.scale[~(self.scale > 0)] = 1.0
+        self.scale[3] /= self.location_weight
+        self.model = KNeighborsRegressor(n_neighbors=min(self.n_neighbors, len(X)), weights='distance')
+        self.model.fit(self._scaled(X), y)
+
+    def _predict(self, X: np.ndarray) -> np.ndarray:
+        return self.model.predict(self._scaled(X))
+
+
+ESTIMATORS: Dict[str, type] = {
+    GradientBoostingRentEstimator.name: GradientBoostingRentEstimator,
+    KNNRentEstimator.name: KNNRentEstimator,
+}
+
+
+def get_model_dir() -> Path:
+    """Return the model directory (THINKLYTICS_MODEL_DIR or data/models)."""
+    return Path(os.environ.get(MODEL_DIR_ENV, DEFAULT_MODEL_DIR))
+
+
+def dataset_fingerprint(row_hashes: np.ndarray) -> str:
+    """Identify a dataset version by the hashes of its raw rows."""
+    return hashlib.sha1(np.ascontiguousarray(row_hashes).tobytes()).hexdigest()[:16]
+
+
+def load_or_train(data: pd.DataFrame, row_hashes: np.ndarray, name: str,
+                  model_dir: Optional[Path] = None) -> RentEstimator:
+    """
+    Load the saved model of a dataset version, or train and save it.
+
+    Args:
+        data: Cleaned listings
+        row_hashes: Raw row hashes of the dataset version (see DatasetState)
+        name: Estimator name (a key of ESTIMATORS)
+        model_dir: Directory of saved models (get_model_dir when None)
+
+    Returns:
+        RentEstimator: The fitted estimator
+
+    Raises:
+        ValueError: If the estimator name is unknown
+    """
+    if name not in ESTIMATORS:
+        raise ValueError(f"Unknown estimator: {name!r}")
+    model_dir = Path(model_dir) if model_dir is not None else get_model_dir()
+    path = model_dir / f"rent-{name}-v{ESTIMATOR_VERSION}-{dataset_fingerprint(row_hashes)}.joblib"
+
+    if path.exists():
+        try:
+            with stage('estimator.load', estimator=name):
+                estimator = joblib.load(path)
+                # The modification time records the last use, for pruning
+                os.utime(path)
+            logger.info(f"Loaded rent estimator from {path}")
+            return estimator
+        except Exception as e:
+            logger.error(f"Failed to load {path}, retraining: {str(e)}")
+
+    with stage('estimator.train', estimator=name, rows=len(data)):
+        estimator = ESTIMATORS[name]().fit(data)
+    try:
+        model_dir.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+        joblib.dump(estimator, tmp)
+        os.replace(tmp, path)
+        prune_models(model_dir, name)
+        logger.info(f"Trained rent estimator on {estimator.n_train} listings and saved it to {path}")
+    except OSError as e:
+        # A read-only deployment still gets the in-memory model
+        logger.error(f"Could not save the rent estimator: {str(e)}")
+    return estimator
+
+
+def prune_models(model_dir: Path, name: str, keep: int = MAX_SAVED_MODELS) -> None:
+    """Delete all but the keep most recently used saved models of an estimator."""
+    paths = sorted(model_dir.glob(f"rent-{name}-*.joblib"), key=lambda path: path.stat().st_mtime, reverse=True)
+    for old in paths[keep:]:
+        old.unlink(missing_ok=True)
+
+
+_estimators: 'OrderedDict[Tuple[str, str], RentEstimator]' = OrderedDict()
+_estimator_lock = threading.Lock()
+_training_locks: Dict[Tuple[str, str], threading.Lock] = {}
+
+
+def get_rent_estimator(dataset, name: Optional[str] = None) -> RentEstimator:
+    """
+    Return the process-wide rent estimator of a dataset version.
+
+    The model is trained once per dataset version and estimator, saved with joblib, and
+    loaded from disk on later starts. The ESTIMATOR_CACHE_SIZE most recently used versions
+    stay in memory, so sessions on different catalog selections do not evict each other.
+    Loading and training hold a lock of their own version only: a cached estimator is
+    returned while another version trains, and concurrent callers of the same missing
+    version wait for a single training.
+
+    Args:
+        dataset: DatasetState (data and row_hashes)
+        name: Estimator name (THINKLYTICS_ESTIMATOR, default 'hgb', when None)
+
+    Returns:
+        RentEstimator: The fitted estimator
+    """
+    name = name or os.environ.get(ESTIMATOR_ENV, DEFAULT_ESTIMATOR)
+    key = (name, dataset_fingerprint(dataset.row_hashes))
+    estimator = _lookup_estimator(key)
+    if estimator is not None:
+        return estimator
+
+    with _estimator_lock:
+        training_lock = _training_locks.setdefault(key, threading.Lock())
+    with training_lock:
+        estimator = _lookup_estimator(key)
+        if estimator is None:
+            estimator = load_or_train(dataset.data, dataset.row_hashes, name)
+            with _estimator_lock:
+                _estimators[key] = estimator
+                while len(_estimators) > ESTIMATOR_CACHE_SIZE:
+                    _estimators.popitem(last=False)
+    with _estimator_lock:
+        _training_locks.pop(key, None)
+    return estimator
+
+
+def _lookup_estimator(key: Tuple[str, str]) -> Optional[RentEstimator]:
+    with _estimator_lock:
+        estimator = _estimators.get(key)
+        if estimator is not None:
+            _estimators.move_to_end(key)
+        return estimator
+
+
+def warm_rent_estimator(dataset) -> None:
+    """
+    Load or train the rent estimator of a freshly built dataset, before reruns need it.
+
+    Failures are logged, not raised: the data is still served, and the first rerun that
+    asks for the estimator tries again.
+    """
+    try:
+        get_rent_estimator(dataset)
+    except Exception as e:
+        logger.error(f"Failed to prepare the rent estimator: {str(e)}")
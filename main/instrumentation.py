@@ -0,0 +1,125 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Set to 1 to trace Python allocations per stage (adds noticeable overhead)
+TRACE_ALLOCATIONS_ENV = 'THINKLYTICS_TRACE_ALLOC'
+
+_local = threading.local()
+
+
+def _state():
+    """Per-thread rerun state; every Streamlit session reruns its script in its own thread."""
+    if not hasattr(_local, 'records'):
+        _local.rerun_id = None
+        _local.records = []
+        _local.stack = []
+    return _local
+
+
+def start_rerun(context: Optional[Dict] = None) -> str:
+    """
+    Start collecting stage records for a new rerun of the dashboard script.
+
+    Args:
+        context: Extra fields (e.g. the session id) added to every structured log line
+
+    Returns:
+        str: Identifier of the rerun
+    """
+    state = _state()
+    state.rerun_id = uuid.uuid4().hex[:8]
+    state.records = []
+    state.stack = []
+    state.context = context or {}
+    if os.environ.get(TRACE_ALLOCATIONS_ENV) == '1' and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return state.rerun_id
+
+
+def get_rerun_records() -> List[Dict]:
+    """Return the stage records of the current thread's rerun in completion order."""
+    return list(_state().records)
+
+
+@contextmanager
+def stage(name: str, **fields):
+    """
+    Measure wall time, CPU time and allocations of a block of code.
+
+    Nested stages are recorded with their full path (e.g. 'main/tab.statistics/analyze_distributions').
+    Each finished stage is logged as one JSON line at DEBUG level and, inside a rerun
+    started with start_rerun, appended to the rerun records.
+
+    Args:
+        name: Stage name
+        **fields: Extra fields to include in the record (e.g. the column being analysed)
+    """
+    state = _state()
+    state.stack.append(name)
+    path = '/'.join(state.stack)
+    tracing = tracemalloc.is_tracing()
+    alloc_start = tracemalloc.get_traced_memory()[0] if tracing else None
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield
+    finally:
+        record = {
+            'rerun': state.rerun_id,
+            'stage': path,
+            'wall_ms': (time.perf_counter() - wall_start) * 1000,
+            'cpu_ms': (time.thread_time() - cpu_start) * 1000,
+            'alloc_kb': (tracemalloc.get_traced_memory()[0] - alloc_start) / 1024 if tracing else None
+        }
+        record.update(fields)
+        state.stack.pop()
+        # Only reruns collect records; background threads and worker processes just log them
+        if state.rerun_id is not None:
+            state.records.append(record)
+        # Per-stage lines are for debugging; the rerun summary is logged at INFO
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps(dict(getattr(state, 'context', {}), event='stage', **record), default=str))
+
+
+def instrument(name: Optional[str] = None) -> Callable:
+    """Decorator form of stage(); the stage name defaults to the function's qualified name."""
+    def decorator(func: Callable) -> Callable:
+        stage_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def log_rerun_summary() -> Optional[Dict]:
+    """Log one JSON line with the total and slowest stage of the current rerun."""
+    records = get_rerun_records()
+    if not records:
+        return None
+    top_level = [r for r in records if '/' not in r['stage']]
+    parents = {r['stage'].rsplit('/', 1)[0] for r in records if '/' in r['stage']}
+    slowest = max((r for r in records if r['stage'] not in parents), key=lambda r: r['wall_ms'])
+    summary = {
+        'event': 'rerun',
+        'rerun': _state().rerun_id,
+        'wall_ms': sum(r['wall_ms'] for r in top_level),
+        'cpu_ms': sum(r['cpu_ms'] for r in top_level),
+        'stages': len(records),
+        'slowest_stage': slowest['stage'],
+        'slowest_ms': slowest['wall_ms']
+    }
+    logger.info(json.dumps(dict(getattr(_state(), 'context', {}), **summary), default=str))
+    return summary
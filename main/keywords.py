@@ -0,0 +1,61 @@
+import re
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrument
+
+# Boolean listing features and the phrases of Details that set them. Alternatives of one
+# feature must not capture; earlier features win where phrases overlap, so the negated
+# and partial furnishing phrases come before 'furnished'.
+KEYWORD_PATTERNS: Dict[str, str] = {
+    'Unfurnished': r"(?:un|non)[- ]?furnished|without furniture",
+    'SemiFurnished': r"(?:semi|sami)[- ]?furnished",
+    'Furnished': r"furnished",
+    'UpperPortion': r"upp?er (?:portion|floor)|(?:first|1st) floor",
+    'LowerPortion': r"(?:lower|ground) (?:portion|floor)",
+    'Basement': r"basement",
+    'Apartment': r"apartments?|flats?|studio|penthouse",
+    'SeaFacing': r"sea[- ]facing|sea view",
+    'ParkFacing': r"park[- ]facing|facing (?:a |the )?park|park view",
+    'MainRoad': r"main (?:road|boulevard|blvd)|(?:road|boulevard)[- ]facing",
+    'Corner': r"corner",
+    'BrandNew': r"brand[- ]new|newly (?:built|constructed)",
+    'Independent': r"independent|separate (?:entrance|gate|entry)",
+    'ServantQuarter': r"servants?'?s? (?:quarter|room)",
+}
+KEYWORD_FEATURES: List[str] = list(KEYWORD_PATTERNS)
+
+# One alternation of named groups; m.lastgroup names the feature of each match
+KEYWORD_REGEX = re.compile('|'.join(rf"\b(?P<{name}>{pattern})\b" for name, pattern in KEYWORD_PATTERNS.items()))
+
+
+@instrument()
+def extract_keyword_features(details: pd.Series) -> pd.DataFrame:
+    """
+    Derive the boolean KEYWORD_FEATURES columns from listing Details.
+
+    The column is lower-cased, joined into one string and scanned once with the combined
+    KEYWORD_REGEX; match offsets are mapped back to rows with a binary search, so the cost
+    is one regex pass regardless of the number of features.
+
+    Args:
+        details: Details text per listing (missing values have no features)
+
+    Returns:
+        pd.DataFrame: One bool column per feature, indexed like details
+    """
+    texts = details.fillna('').astype(str).str.lower().str.replace('\n', ' ', regex=False)
+    # Row i ends at ends[i]; the newline separators never match a pattern
+    ends = np.cumsum(texts.str.len().to_numpy(dtype=np.int64) + 1)
+    matches = [(m.start(), m.lastgroup) for m in KEYWORD_REGEX.finditer('\n'.join(texts.tolist()))]
+
+    flags = np.zeros((len(texts), len(KEYWORD_FEATURES)), dtype=bool)
+    if matches:
+        starts, names = zip(*matches)
+        rows = np.searchsorted(ends, np.asarray(starts), side='right')
+        positions = {name: i for i, name in enumerate(KEYWORD_FEATURES)}
+        flags[rows, [positions[name] for name in names]] = True
+    return pd.DataFrame(flags, index=details.index, columns=KEYWORD_FEATURES)
+
@@ -0,0 +1,297 @@
+import pandas as pd
+import numpy as np
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+from instrumentation import instrument
+
+# Top-level names that Zameen uses as the city part of a location
+KNOWN_CITIES = frozenset([
+    'Abbottabad', 'Attock', 'Bahawalpur', 'Chakwal', 'Faisalabad', 'Gujranwala', 'Gujrat',
+    'Gwadar', 'Hyderabad', 'Islamabad', 'Jhelum', 'Karachi', 'Kasur', 'Kharian', 'Lahore',
+    'Larkana', 'Mardan', 'Mirpur', 'Multan', 'Murree', 'Muzaffarabad', 'Nowshera', 'Okara',
+    'Peshawar', 'Quetta', 'Rahim Yar Khan', 'Rawalpindi', 'Sahiwal', 'Sargodha',
+    'Sheikhupura', 'Sialkot', 'Sukkur', 'Taxila', 'Wah'
+])
+
+# Hierarchy columns added to the dataset, from coarsest to finest
+LOCATION_LEVELS = ['City', 'Society', 'Block']
+
+AGGREGATE_QUANTILES = (0.25, 0.75)
+
+
+def _split_location(location: str) -> Tuple[str, Optional[str]]:
+    """Split a 'child, parent' location string into its two parts."""
+    parts = [part.strip() for part in str(location).split(',', 1)]
+    if len(parts) == 1 or not parts[1]:
+        return parts[0], None
+    return parts[0], parts[1]
+
+
+def build_parent_map(locations: pd.Series) -> Dict[str, str]:
+    """
+    Learn the parent of every area name from the 'child, parent' location strings.
+
+    The same child name occasionally appears under several parents (for example
+    'Gulberg, Lahore' and 'Gulberg, Islamabad'). When those parents lead to different
+    cities the area is ambiguous and gets no parent, so its listings keep no city instead
+    of a guessed one; otherwise the most frequent parent wins.
+
+    Args:
+        locations: Location column (one entry per listing)
+
+    Returns:
+        Dict[str, str]: Mapping of area name to parent area name
+    """
+    return parent_map_from_counts(locations.value_counts())
+
+
+def parent_map_from_counts(location_counts: pd.Series) -> Dict[str, str]:
+    """
+    Build the parent map from listing counts per location string.
+
+    Counts can be merged across batches, so incremental loads do not need all rows.
+    Areas whose parents resolve to more than one known city are left out of the map
+    (see build_parent_map); an area below an ambiguous one keeps its parent, and the
+    parent chain then stops at the ambiguous area.
+
+    Args:
+        location_counts: Number of listings per location string
+
+    Returns:
+        Dict[str, str]: Mapping of area name to parent area name
+    """
+    parent_counts = defaultdict(Counter)
+    for location, count in location_counts.items():
+        child, parent = _split_location(location)
+        if parent is not None and parent != child:
+            parent_counts[child][parent] += count
+
+    parents: Dict[str, str] = {}
+    cities: Dict[str, frozenset] = {}
+
+    def resolve(area: str, visiting: set) -> frozenset:
+        """Known cities an area can belong to (empty when no parent chain reaches one)."""
+        if area in KNOWN_CITIES:
+            return frozenset([area])
+        if area in cities:
+            return cities[area]
+        if area in visiting or area not in parent_counts:
+            return frozenset()
+        visiting.add(area)
+        parent_cities = {parent: resolve(parent, visiting) for parent in parent_counts[area]}
+        visiting.discard(area)
+
+        candidates = frozenset().union(*parent_cities.values())
+        if len(parent_cities) == 1 or len(candidates) <= 1:
+            # Parents that lead to a city come first, then the most frequent; ties go to the
+            # alphabetically first parent, so the map does not depend on the row order
+            parents[area] = min(parent_counts[area].items(),
+                                key=lambda item: (not parent_cities[item[0]], -item[1], item[0]))[0]
+        cities[area] = candidates
+        return candidates
+
+    for child in sorted(parent_counts):
+        resolve(child, set())
+    return parents
+
+
+def parse_location(location: str, parents: Dict[str, str]) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """
+    Resolve a location string into its (city, society, block) hierarchy.
+
+    The parent links are followed up to a known city. The area directly below the city
+    is the society and the listing's own area is the block. Locations that never reach a
+    known city keep the topmost area as their society and no city.
+
+    Args:
+        location: Location string (e.g., "F-11 Markaz, F-11")
+        parents: Parent map from build_parent_map
+
+    Returns:
+        Tuple of city, society and block (None where a level does not apply)
+    """
+    child, parent = _split_location(location)
+    chain = [child] if parent is None else [child, parent]
+    seen = set(chain)
+    while chain[-1] in parents and parents[chain[-1]] not in seen:
+        chain.append(parents[chain[-1]])
+        seen.add(chain[-1])
+
+    if chain[-1] in KNOWN_CITIES:
+        city = chain[-1]
+        if len(chain) == 1:
+            return city, None, None
+        society = chain[-2]
+    else:
+        city = None
+        society = chain[-1]
+
+    block = chain[0] if chain[0] != society else None
+    return city, society, block
+
+
+@instrument()
+def add_location_hierarchy(df: pd.DataFrame, parents: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+    """
+    Add City, Society and Block columns parsed from Location.
+
+    Parsing runs once per distinct location; the rows only receive integer codes, so the
+    new columns are categoricals that share one copy of each label.
+
+    Args:
+        df: Preprocessed DataFrame containing rental data
+        parents: Parent map from build_parent_map (learned from df when None)
+
+    Returns:
+        pd.DataFrame: DataFrame with the hierarchy columns added
+    """
+    df = df.copy()
+    location_codes, unique_locations = pd.factorize(df['Location'])
+    if parents is None:
+        parents = build_parent_map(df['Location'])
+    parsed = [parse_location(location, parents) for location in unique_locations]
+
+    for i, level in enumerate(LOCATION_LEVELS):
+        labels = pd.Categorical([entry[i] for entry in parsed])
+        level_codes = np.append(labels.codes, -1)  # index -1 maps missing locations to NaN
+        df[level] = pd.Categorical.from_codes(level_codes[location_codes], labels.categories)
+
+    return df
+
+
+@instrument()
+def update_location_hierarchy(df: pd.DataFrame, old_parents: Dict[str, str],
+                              parents: Dict[str, str]) -> Tuple[pd.DataFrame, np.ndarray]:
+    """
+    Re-derive the hierarchy columns after the parent map changed, for the affected rows only.
+
+    Every distinct location is parsed under both maps; only the rows of locations whose
+    (city, society, block) differs get new labels.
+
+    Args:
+        df: DataFrame with the hierarchy columns derived from old_parents
+        old_parents: Parent map the columns were derived from
+        parents: The new parent map
+
+    Returns:
+        Tuple of the DataFrame with updated hierarchy columns (df itself when no row moved)
+        and a boolean mask of the rows that moved
+    """
+    if isinstance(df['Location'].dtype, pd.CategoricalDtype):
+        location_codes = df['Location'].cat.codes.to_numpy()
+        unique_locations = df['Location'].cat.categories
+    else:
+        location_codes, unique_locations = pd.factorize(df['Location'])
+    parsed = [parse_location(location, parents) for location in unique_locations]
+    changed = np.array([entry != parse_location(location, old_parents)
+                        for location, entry in zip(unique_locations, parsed)], dtype=bool)
+    moved = np.append(changed, False)[location_codes]  # index -1 keeps missing locations
+    if not moved.any():
+        return df, moved
+
+    df = df.copy(deep=False)
+    for i, level in enumerate(LOCATION_LEVELS):
+        column = df[level].astype('category')
+        labels = [entry[i] for entry, change in zip(parsed, changed) if change]
+        new_labels = pd.Index([label for label in set(labels) if label is not None])
+        categories = column.cat.categories.append(new_labels.difference(column.cat.categories))
+        # Code of the new label of every changed location
+        level_codes = np.full(len(unique_locations), -1, dtype=np.int64)
+        level_codes[changed] = categories.get_indexer(pd.Index(labels, dtype=object))
+        codes = column.cat.set_categories(categories).cat.codes.to_numpy().astype(np.int64)
+        codes[moved] = level_codes[location_codes[moved]]
+        df[level] = pd.Categorical.from_codes(codes, categories)
+        df[level] = df[level].cat.remove_unused_categories()
+    return df, moved
+
+
+def _level_table(df: pd.DataFrame, levels: List[str], i: int, value_column: str) -> pd.DataFrame:
+    """Aggregate one hierarchy level (levels[i]); see compute_level_aggregates."""
+    level = levels[i]
+    grouped = df.groupby(level, observed=True)[value_column]
+    table = grouped.agg(['count', 'mean', 'median'])
+    quantiles = grouped.quantile(list(AGGREGATE_QUANTILES)).unstack()
+    for q in AGGREGATE_QUANTILES:
+        table[f'q{int(q * 100)}'] = quantiles[q]
+
+    if i > 0:
+        # The hierarchy is functional, so the first parent seen per area is the parent.
+        # Areas without an intermediate level fall back to the next coarser one.
+        parent = None
+        for parent_level in reversed(levels[:i]):
+            candidate = df.groupby(level, observed=True)[parent_level].first().astype(object)
+            parent = candidate if parent is None else parent.combine_first(candidate)
+        table['Parent'] = parent
+
+    table.index = table.index.astype(str)
+    return table
+
+
+@instrument()
+def compute_level_aggregates(df: pd.DataFrame, value_column: str = 'Price') -> Dict[str, pd.DataFrame]:
+    """
+    Precompute count, mean, median and quantiles of a value for every hierarchy level.
+
+    Args:
+        df: DataFrame with the hierarchy columns from add_location_hierarchy
+        value_column: Column to aggregate
+
+    Returns:
+        Dict[str, pd.DataFrame]: One table per level (City, Society, Block, Location), indexed
+        by area name and sorted by count. Finer levels carry a 'Parent' column for drill-down.
+    """
+    levels = LOCATION_LEVELS + ['Location']
+    return {level: _level_table(df, levels, i, value_column).sort_values('count', ascending=False)
+            for i, level in enumerate(levels)}
+
+
+class LocationAggregates:
+    """Lookup interface over the precomputed per-level aggregates."""
+
+    def __init__(self, df: pd.DataFrame, value_column: str = 'Price'):
+        if 'City' not in df.columns:
+            df = add_location_hierarchy(df)
+        self.value_column = value_column
+        self.tables = compute_level_aggregates(df, value_column)
+
+    @instrument('LocationAggregates.update')
+    def update(self, df: pd.DataFrame, delta: pd.DataFrame) -> None:
+        """
+        Refresh the areas touched by added or removed rows.
+
+        Only the rows of areas that appear in the delta are re-aggregated, and areas left
+        without rows are dropped; the tables are replaced, not modified, so a shallow copy can
+        be updated while the original is in use.
+
+        Args:
+            df: Full dataset after the change (with hierarchy columns)
+            delta: The added or removed rows
+        """
+        levels = LOCATION_LEVELS + ['Location']
+        tables = dict(self.tables)
+        for i, level in enumerate(levels):
+            touched = delta[level].dropna().unique()
+            if len(touched) == 0:
+                continue
+            table = _level_table(df[df[level].isin(touched)], levels, i, self.value_column)
+            untouched = tables[level].drop(index=[str(area) for area in touched], errors='ignore')
+            tables[level] = pd.concat([untouched, table]).sort_values('count', ascending=False)
+        self.tables = tables
+
+    def top(self, level: str, n: int = 10, by: str = 'count', parent: Optional[str] = None) -> pd.DataFrame:
+        """Return the top-n areas of a level, optionally restricted to one parent area."""
+        table = self.children(level, parent) if parent is not None else self.tables[level]
+        if by == 'count':
+            return table.head(n)
+        return table.nlargest(n, by)
+
+    def children(self, level: str, parent: str) -> pd.DataFrame:
+        """Return the areas of a level that sit directly under a parent area."""
+        table = self.tables[level]
+        if 'Parent' not in table.columns:
+            return table
+        return table[table['Parent'] == parent]
+
+    def areas(self, level: str) -> List[str]:
+        """Return the area names of a level ordered by listing count."""
+        return list(self.tables[level].index)
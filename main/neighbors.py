@@ -0,0 +1,259 @@
+import logging
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrument
+
+logger = logging.getLogger(__name__)
+
+# Numeric dimensions of a listing; Marla is compared on a log scale
+NEIGHBOR_FEATURES = ['Marla', 'Bedrooms', 'Washrooms']
+DEFAULT_NEIGHBORS = 10
+# Weight of the text distance (1 - cosine similarity) against the scaled numeric distance
+DEFAULT_TEXT_WEIGHT = 1.0
+
+
+class ListingIndex:
+    """
+    Nearest-neighbour search over listings with filters applied inside the search.
+
+    Rows are stored grouped by location, like the inverted lists of an IVF index with the
+    locations as the coarse partitions: a query opens only the lists of its locations (or
+    of the locations of its cities), evaluates the other filters on those rows, and ranks
+    the remaining rows by distance with one vectorized pass. Numeric features are log2 Marla,
+    Bedrooms and Washrooms, each divided by its standard deviation; optional text
+    embeddings add a cosine distance for searches around an existing listing. update()
+    follows removed and appended rows by merging them into the lists, so a refreshed
+    dataset does not sort all rows again.
+
+    Attributes:
+        locations: Location labels; location i owns rows order[offsets[i]:offsets[i + 1]]
+        order: Row positions in partition order
+        offsets: Start of every location's list in order
+        values: Features of the rows in partition order (divided by scale when compared)
+    """
+
+    @instrument('ListingIndex.build')
+    def __init__(self, df: pd.DataFrame, embeddings: Optional[np.ndarray] = None):
+        self.df = df
+        codes, self.locations = self._location_codes(df)
+        self.order = np.argsort(codes, kind='stable')
+        self.offsets = np.searchsorted(codes[self.order], np.arange(len(self.locations) + 2))
+        self.values = self._features(df)[self.order]
+        self.scale = self._scale(self.values)
+        self.location_cities = self._location_cities()
+
+        self.embeddings = None
+        if embeddings is not None:
+            vectors = np.asarray(embeddings, dtype=np.float32)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                vectors = np.where(norms > 0, vectors / norms, 0)
+            self.embeddings = vectors[self.order].astype(np.float16)
+        self._columns = {}
+
+    @staticmethod
+    def _location_codes(df: pd.DataFrame) -> Tuple[np.ndarray, pd.Index]:
+        """List number of every row and the location labels; missing locations get a list of their own."""
+        if isinstance(df['Location'].dtype, pd.CategoricalDtype):
+            codes = df['Location'].cat.codes.to_numpy().astype(np.int64)
+            locations = pd.Index(df['Location'].cat.categories.astype(object))
+        else:
+            codes, locations = pd.factorize(df['Location'])
+            locations = pd.Index(locations.astype(object))
+        return np.where(codes < 0, len(locations), codes), locations
+
+    @staticmethod
+    def _features(df: pd.DataFrame) -> np.ndarray:
+        values = df[NEIGHBOR_FEATURES].to_numpy(dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values[:, 0] = np.log2(values[:, 0])
+        values[~np.isfinite(values)] = np.nan
+        return values
+
+    @staticmethod
+    def _scale(values: np.ndarray) -> np.ndarray:
+        with np.errstate(invalid='ignore'):
+            scale = np.nanstd(values, axis=0) if len(values) else np.ones(values.shape[1])
+        scale[~(scale > 0)] = 1.0
+        return scale
+
+    def _location_cities(self) -> Optional[pd.Series]:
+        if 'City' not in self.df.columns:
+            return None
+        # Every location belongs to one city, so city filters select whole lists
+        n = len(self.locations)
+        first_rows = np.append(self.order, -1)[self.offsets[:n]]  # -1 for empty lists at the end
+        present = self.offsets[1:n + 1] > self.offsets[:n]
+        cities = np.full(n, None, dtype=object)
+        cities[present] = np.asarray(self.df['City'], dtype=object)[first_rows[present]]
+        return pd.Series(cities, index=self.locations)
+
+    @instrument('ListingIndex.update')
+    def update(self, df: pd.DataFrame, removed: np.ndarray) -> None:
+        """
+        Drop removed rows and add appended ones without sorting the indexed rows again.
+
+        The remaining rows keep their order and the new rows are inserted at the end of
+        their location lists, which gives the same index as building one over df. Arrays
+        are replaced, not modified, so a shallow copy of an index that other sessions are
+        reading can be updated safely.
+
+        Args:
+            df: The indexed frame without the removed rows and with the new rows at the end
+            removed: Boolean mask over the rows of the indexed frame
+
+        Raises:
+            ValueError: If the index holds text embeddings, which the new rows do not have
+        """
+        if self.embeddings is not None:
+            raise ValueError("An index with text embeddings cannot be updated; build a new one")
+        kept = ~removed[self.order]
+        # Positions of the remaining rows once the removed ones are gone
+        positions = (np.cumsum(~removed) - 1)[self.order[kept]]
+        codes, locations = self._location_codes(df)
+        kept_codes = codes[positions]
+        if np.any(kept_codes[1:] < kept_codes[:-1]):
+            # The labels were reordered, so the lists have to be sorted again
+            self.__init__(df)
+            return
+
+        start = len(positions)
+        added = np.argsort(codes[start:], kind='stable')
+        slots = np.searchsorted(kept_codes, codes[start:][added], side='right')
+        self.df = df
+        self.locations = locations
+        self.order = np.insert(positions, slots, start + added)
+        self.offsets = np.searchsorted(np.insert(kept_codes, slots, codes[start:][added]),
+                                       np.arange(len(locations) + 2))
+        self.values = np.insert(self.values[kept], slots, self._features(df.iloc[start:])[added], axis=0)
+        self.scale = self._scale(self.values)
+        self.location_cities = self._location_cities()
+        self._columns = {}
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def _column(self, name: str) -> np.ndarray:
+        """A column of the indexed frame in partition order (cached)."""
+        if name not in self._columns:
+            self._columns[name] = self.df[name].to_numpy()[self.order]
+        return self._columns[name]
+
+    def _candidates(self, locations: Optional[Iterable[str]], cities: Optional[Iterable[str]]) -> np.ndarray:
+        """Partition-order positions of the lists of the allowed locations and cities."""
+        if locations is None and cities is None:
+            return np.arange(len(self.order))
+        allowed = np.ones(len(self.locations), dtype=bool)
+        if locations is not None:
+            allowed &= self.locations.isin(list(locations))
+        if cities is not None:
+            if self.location_cities is None:
+                raise ValueError("City filters need the location hierarchy columns")
+            allowed &= self.location_cities.isin(list(cities)).to_numpy()
+        lists = np.flatnonzero(allowed)
+        starts, ends = self.offsets[lists], self.offsets[lists + 1]
+        if not len(lists):
+            return np.empty(0, dtype=np.int64)
+        # Concatenated ranges [start, end) of the selected lists
+        lengths = ends - starts
+        return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+    def _search(self, query: np.ndarray, text: Optional[np.ndarray], k: int, text_weight: float,
+                locations, cities, price_range, bedrooms, exclude_outliers, features, where,
+                exclude: Optional[int] = None) -> pd.DataFrame:
+        candidates = self._candidates(locations, cities)
+        keep = np.ones(len(candidates), dtype=bool)
+        if price_range is not None:
+            prices = self._column('Price')[candidates]
+            keep &= (prices >= price_range[0]) & (prices <= price_range[1])
+        if bedrooms is not None:
+            keep &= np.isin(self._column('Bedrooms')[candidates], list(bedrooms))
+        if exclude_outliers and 'Outlier' in self.df.columns:
+            keep &= ~self._column('Outlier')[candidates]
+        for feature in features or []:
+            keep &= self._column(feature)[candidates]
+        if where is not None:
+            keep &= np.asarray(where, dtype=bool)[self.order[candidates]]
+        if exclude is not None:
+            keep &= candidates != exclude
+        candidates = candidates[keep]
+
+        dims = ~np.isnan(query)
+        differences = self.values[candidates][:, dims] / self.scale[dims] - query[dims]
+        distances = np.nansum(differences ** 2, axis=1)
+        if text is not None and self.embeddings is not None:
+            similarity = self.embeddings[candidates].astype(np.float32) @ text
+            distances = distances + text_weight * (1 - similarity)
+
+        k = min(k, len(candidates))
+        nearest = np.argpartition(distances, k - 1)[:k] if k else np.empty(0, dtype=np.int64)
+        nearest = nearest[np.argsort(distances[nearest], kind='stable')]
+        result = self.df.iloc[self.order[candidates[nearest]]].copy()
+        result['Distance'] = np.sqrt(np.maximum(distances[nearest], 0))
+        return result
+
+    def _scaled(self, marla: Optional[float], bedrooms: Optional[float], washrooms: Optional[float]) -> np.ndarray:
+        values = np.array([np.nan if v is None else v for v in (marla, bedrooms, washrooms)], dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values[0] = np.log2(values[0])
+        return values / self.scale
+
+    @instrument('ListingIndex.query')
+    def query(
+        self,
+        marla: Optional[float] = None,
+        bedrooms: Optional[float] = None,
+        washrooms: Optional[float] = None,
+        k: int = DEFAULT_NEIGHBORS,
+        locations: Optional[Iterable[str]] = None,
+        cities: Optional[Iterable[str]] = None,
+        price_range: Optional[Tuple[float, float]] = None,
+        bedroom_counts: Optional[Iterable] = None,
+        exclude_outliers: bool = False,
+        features: Optional[Iterable[str]] = None,
+        where: Optional[np.ndarray] = None
+    ) -> pd.DataFrame:
+        """
+        Find the listings closest to a property spec among those matching the filters.
+
+        Args:
+            marla, bedrooms, washrooms: The spec; dimensions left as None are not compared
+            k: Number of listings to return
+            locations: Allowed locations (all when None)
+            cities: Allowed cities (all when None)
+            price_range: Inclusive (min, max) price
+            bedroom_counts: Allowed bedroom counts
+            exclude_outliers: Whether to skip rows flagged as price outliers
+            features: Keyword feature columns that must all be set
+            where: Extra boolean mask over the rows of the indexed frame
+
+        Returns:
+            pd.DataFrame: Up to k rows of the indexed frame, nearest first, with a Distance column
+        """
+        return self._search(self._scaled(marla, bedrooms, washrooms), None, k, 0.0, locations, cities,
+                            price_range, bedroom_counts, exclude_outliers, features, where)
+
+    @instrument('ListingIndex.query_like')
+    def query_like(self, position: int, k: int = DEFAULT_NEIGHBORS, text_weight: float = DEFAULT_TEXT_WEIGHT,
+                   **filters) -> pd.DataFrame:
+        """
+        Find the listings most similar to an indexed listing, including its text when embeddings are set.
+
+        Args:
+            position: Row position of the listing in the indexed frame (it is not returned)
+            k: Number of listings to return
+            text_weight: Weight of the text distance
+            **filters: Filters of query (locations, cities, price_range, ...)
+
+        Returns:
+            pd.DataFrame: Up to k rows, nearest first, with a Distance column
+        """
+        slot = int(np.flatnonzero(self.order == position)[0])
+        text = self.embeddings[slot].astype(np.float32) if self.embeddings is not None else None
+        return self._search(self.values[slot] / self.scale, text, k, text_weight, filters.get('locations'),
+                            filters.get('cities'), filters.get('price_range'), filters.get('bedroom_counts'),
+                            filters.get('exclude_outliers', False), filters.get('features'),
+                            filters.get('where'), exclude=slot)
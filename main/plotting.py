@@ -0,0 +1,143 @@
+import seaborn as sns
+from matplotlib.axes import Axes
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from typing import NamedTuple, Optional, Tuple
+from utils import price_tick_formatter
+from instrumentation import instrument
+
+
+class Theme(NamedTuple):
+    """Colours of one dashboard theme."""
+    text: str         # Titles, labels, ticks, spines, grid and bar edges
+    accent: str       # Primary data colour
+    legend_face: str  # Legend background
+
+
+# Resolved once; figures are styled from these values instead of the global rcParams,
+# so figures for different sessions and themes can be built at the same time
+THEMES = {
+    'Dark': Theme(text='white', accent='#4CAF50', legend_face='black'),
+    'Light': Theme(text='black', accent='#1f77b4', legend_face='white')
+}
+GRID_ALPHA = 0.2
+
+
+def get_theme(theme: str) -> Theme:
+    """Return the palette of a theme name; anything but 'Dark' uses the light theme."""
+    return THEMES['Dark'] if theme == "Dark" else THEMES['Light']
+
+
+def new_figure(figsize: Tuple[float, float]) -> Tuple[Figure, Axes]:
+    """Create a transparent figure with one axes, detached from pyplot."""
+    fig = Figure(figsize=figsize, facecolor='none')
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    ax.set_facecolor('none')
+    return fig, ax
+
+
+def style_axes(
+    ax: Axes,
+    theme: str,
+    title: str,
+    xlabel: Optional[str] = None,
+    ylabel: Optional[str] = None,
+    title_size: int = 14,
+    label_size: int = 11,
+    tick_size: Optional[int] = None,
+    grid: bool = True
+) -> None:
+    """
+    Apply the theme colours, title, axis labels and grid to an axes.
+
+    Args:
+        ax: Axes to style
+        theme: 'Dark' or 'Light'
+        title: Axes title
+        xlabel: X axis label (left unchanged when None)
+        ylabel: Y axis label (left unchanged when None)
+        title_size: Title font size
+        label_size: Axis label font size
+        tick_size: Tick label font size (matplotlib default when None)
+        grid: Whether to draw the grid
+    """
+    palette = get_theme(theme)
+    ax.set_title(title, pad=15, fontsize=title_size, fontweight='bold', color=palette.text)
+    if xlabel is not None:
+        ax.set_xlabel(xlabel, fontsize=label_size)
+    if ylabel is not None:
+        ax.set_ylabel(ylabel, fontsize=label_size)
+    ax.xaxis.label.set_color(palette.text)
+    ax.yaxis.label.set_color(palette.text)
+
+    if tick_size is None:
+        ax.tick_params(colors=palette.text)
+    else:
+        ax.tick_params(colors=palette.text, labelsize=tick_size)
+    for spine in ax.spines.values():
+        spine.set_color(palette.text)
+    if grid:
+        ax.grid(True, alpha=GRID_ALPHA, color=palette.text)
+
+
+def style_legend(ax: Axes, theme: str, fontsize: int = 10) -> None:
+    """Add a legend in the theme colours."""
+    palette = get_theme(theme)
+    ax.legend(fontsize=fontsize, labelcolor=palette.text, facecolor=palette.legend_face, edgecolor=palette.text)
+
+
+def finish_figure(fig: Figure, ax: Axes) -> Figure:
+    """Lay out the figure and make its backgrounds transparent."""
+    fig.tight_layout(pad=1.5)
+    fig.patch.set_alpha(0.0)
+    ax.patch.set_alpha(0.0)
+    return fig
+
+
+@instrument()
+def create_heatmap(correlation_matrix, theme, method='pearson'):
+    """Create a correlation heatmap from a precomputed correlation matrix."""
+    palette = get_theme(theme)
+    fig, ax = new_figure((4.5, 2.7))
+
+    label = 'Rank Correlation' if method == 'spearman' else 'Correlation'
+    sns.heatmap(correlation_matrix, annot=True, cmap='coolwarm', fmt='.2f',
+                linewidths=0.5, cbar_kws={'label': label}, ax=ax,
+                annot_kws={'color': palette.text, 'size': 8})  # Reduced annotation size
+    colorbar = ax.collections[0].colorbar
+    colorbar.ax.yaxis.label.set_color(palette.text)
+    colorbar.ax.tick_params(colors=palette.text)
+
+    style_axes(ax, theme, 'Correlation Heatmap of Numeric Features', title_size=12, tick_size=8, grid=False)
+    return finish_figure(fig, ax)
+
+
+@instrument()
+def create_price_distribution(df, theme):
+    """Create price distribution plot."""
+    palette = get_theme(theme)
+    fig, ax = new_figure((7, 3.5))
+
+    ax.hist(df['Price'], bins=30, color=palette.accent, edgecolor=palette.text, alpha=0.8)
+    style_axes(ax, theme, 'Price Distribution', xlabel='Price', ylabel='Frequency')
+
+    # Format x-axis ticks in Pakistani numbering system (formatted when drawn)
+    ax.xaxis.set_major_formatter(price_tick_formatter())
+    ax.tick_params(axis='x', labelrotation=45)  # Rotate labels for better readability
+
+    return finish_figure(fig, ax)
+
+
+@instrument()
+def create_regression_analysis(df, theme):
+    """Create regression analysis plots."""
+    palette = get_theme(theme)
+    fig, ax = new_figure((3.5, 2.3))
+
+    sns.regplot(x='Marla', y='Price', data=df, color=palette.accent,
+                scatter_kws={'alpha': 0.5, 's': 20}, ax=ax)  # Reduced scatter point size
+    style_axes(ax, theme, 'Price vs Property Size (Marla)', xlabel='Property Size (Marla)',
+               ylabel='Price (Rs.)', title_size=12, label_size=9, tick_size=8)
+
+    return finish_figure(fig, ax)
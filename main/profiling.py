@@ -0,0 +1,123 @@
+import cProfile
+import hashlib
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+# Profile reruns slower than this many milliseconds (unset: profiling disabled)
+PROFILE_THRESHOLD_ENV = 'THINKLYTICS_PROFILE_MS'
+# Directory for the .prof and .json dumps
+PROFILE_DIR_ENV = 'THINKLYTICS_PROFILE_DIR'
+DEFAULT_PROFILE_DIR = 'profiles'
+# Set to 1 on development machines to allow ?profile_ms=<n>; public deployments ignore it
+PROFILE_QUERY_ENV = 'THINKLYTICS_DEV'
+
+_local = threading.local()
+
+
+def profile_threshold_ms(query_params: Optional[Mapping[str, Any]] = None) -> Optional[float]:
+    """
+    Return the latency threshold for profiling, or None when profiling is off.
+
+    The ?profile_ms=<n> query parameter takes precedence over THINKLYTICS_PROFILE_MS, but
+    only when THINKLYTICS_DEV=1, so visitors of a public deployment cannot turn on
+    profiling or make it write dumps.
+    """
+    value = None
+    if query_params is not None and os.environ.get(PROFILE_QUERY_ENV) == '1':
+        value = query_params.get('profile_ms')
+    if value is None:
+        value = os.environ.get(PROFILE_THRESHOLD_ENV)
+    try:
+        return float(value) if value not in (None, '') else None
+    except ValueError:
+        logger.warning(f"Ignoring invalid profiling threshold: {value!r}")
+        return None
+
+
+def tag_rerun(**tags) -> None:
+    """Attach tags (e.g. the filter state) to the profile dump of the current rerun."""
+    if not hasattr(_local, 'tags'):
+        _local.tags = {}
+    _local.tags.update(tags)
+
+
+def run_profiled(func: Callable[[], Any], threshold_ms: Optional[float], output_dir: Optional[str] = None) -> Any:
+    """
+    Run func, profiling it with cProfile when a threshold is set.
+
+    Reruns slower than threshold_ms are dumped as a pstats file plus a JSON sidecar with the
+    rerun tags, elapsed time and the top functions by cumulative time.
+
+    Args:
+        func: Callable to run (the dashboard's main)
+        threshold_ms: Dump profiles of runs at least this slow; None disables profiling
+        output_dir: Dump directory (THINKLYTICS_PROFILE_DIR or 'profiles' when None)
+
+    Returns:
+        The return value of func
+    """
+    _local.tags = {}
+    if threshold_ms is None:
+        return func()
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Only one profiler can be active at a time; another session is being profiled
+        logger.warning("Profiler busy, running rerun without profiling")
+        return func()
+
+    start = time.perf_counter()
+    try:
+        return func()
+    finally:
+        profiler.disable()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if elapsed_ms >= threshold_ms:
+            _dump_profile(profiler, elapsed_ms, threshold_ms,
+                          Path(output_dir or os.environ.get(PROFILE_DIR_ENV, DEFAULT_PROFILE_DIR)))
+
+
+def _dump_profile(profiler: cProfile.Profile, elapsed_ms: float, threshold_ms: float, output_dir: Path) -> None:
+    """Write the pstats file and its JSON sidecar for a slow rerun."""
+    tags = getattr(_local, 'tags', {})
+    tag_hash = hashlib.sha1(json.dumps(tags, sort_keys=True, default=str).encode()).hexdigest()[:8]
+    stem = f"rerun-{datetime.now():%Y%m%d-%H%M%S}-{elapsed_ms:.0f}ms-{tag_hash}"
+
+    try:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(output_dir / f"{stem}.prof")
+
+        stats = pstats.Stats(profiler, stream=io.StringIO())
+        stats.sort_stats('cumulative')
+        top_functions = []
+        for (filename, line, name), (_, calls, total, cumulative, _) in sorted(
+                stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:25]:
+            top_functions.append({
+                'function': f"{Path(filename).name}:{line}({name})",
+                'calls': calls,
+                'total_ms': total * 1000,
+                'cumulative_ms': cumulative * 1000
+            })
+
+        sidecar = {
+            'elapsed_ms': elapsed_ms,
+            'threshold_ms': threshold_ms,
+            'tags': tags,
+            'top_functions': top_functions
+        }
+        (output_dir / f"{stem}.json").write_text(json.dumps(sidecar, indent=2, default=str))
+        logger.info(f"Slow rerun ({elapsed_ms:.0f} ms) profiled to {output_dir / stem}.prof")
+    except OSError as e:
+        logger.error(f"Failed to write profile: {str(e)}")
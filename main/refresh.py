@@ -0,0 +1,336 @@
+import copy
+import functools
+import logging
+import time
+import pandas as pd
+import numpy as np
+from typing import Dict, Sequence, Tuple
+from analysis import (NUMERIC_COLUMNS, OUTLIER_COLUMN, ImputationTables, OutlierFences, parse_listing_columns,
+                      imputation_tables, impute_missing, compact_schema, outlier_fences, flag_outliers)
+from locations import (LOCATION_LEVELS, LocationAggregates, add_location_hierarchy, parent_map_from_counts,
+                       update_location_hierarchy)
+from cube import AggregateCube
+from duplicates import NearDuplicateIndex
+from keywords import KEYWORD_FEATURES, extract_keyword_features
+from neighbors import ListingIndex
+from correlation import CorrelationEngine
+from sketches import QuantileSketch
+from instrumentation import instrument, stage
+
+logger = logging.getLogger(__name__)
+
+
+def hash_rows(raw: pd.DataFrame) -> np.ndarray:
+    """Fingerprint every raw listing by its contents (the index is ignored)."""
+    return pd.util.hash_pandas_object(raw, index=False).to_numpy()
+
+
+class DatasetState:
+    """
+    A cleaned dataset together with everything needed to extend it incrementally.
+
+    Attributes:
+        data: Cleaned dataset (compact schema with the location hierarchy)
+        row_hashes: Sorted hashes of the raw rows seen (kept in data or dropped as duplicates)
+        data_hashes: Raw row hash of every row of data, in row order
+        observed: Per row of data and numeric column, whether the value was parsed (not imputed)
+        sketches: Quantile sketch per numeric column over the observed (non-imputed) values
+        location_counts: Listings per location string, for the location parent map
+        parents: Location parent map the hierarchy columns were derived from
+        outlier_fences: Per-location price fences the Outlier column was flagged with
+        imputation: Location and city median tables missing values were filled from
+        duplicates: MinHash index of the kept listings, to drop re-posts among new rows
+        cube: AggregateCube over data
+        correlation: CorrelationEngine over data
+        location_aggregates: LocationAggregates over data
+        neighbors: ListingIndex over data, for comparable listings
+        version: Incremented by every refresh that changes the data
+    """
+
+    def __init__(self, data: pd.DataFrame, row_hashes: np.ndarray, data_hashes: np.ndarray,
+                 observed: np.ndarray, sketches: Dict[str, QuantileSketch],
+                 location_counts: pd.Series, parents: Dict[str, str], outlier_fences: OutlierFences,
+                 imputation: ImputationTables, duplicates: NearDuplicateIndex, version: int = 1):
+        self.data = data
+        self.row_hashes = row_hashes
+        self.data_hashes = data_hashes
+        self.observed = observed
+        self.sketches = sketches
+        self.location_counts = location_counts
+        self.parents = parents
+        self.outlier_fences = outlier_fences
+        self.imputation = imputation
+        self.duplicates = duplicates
+        self.version = version
+        self.cube = AggregateCube(data)
+        self.correlation = CorrelationEngine(data)
+        self.location_aggregates = LocationAggregates(data)
+        self.neighbors = ListingIndex(data)
+
+
+def _append_rows(data: pd.DataFrame, delta: pd.DataFrame) -> pd.DataFrame:
+    """Concatenate two cleaned frames, keeping categorical columns categorical."""
+    data, delta = data.copy(deep=False), delta.copy(deep=False)
+    for col in data.columns:
+        if isinstance(data[col].dtype, pd.CategoricalDtype):
+            old = data[col].cat.categories
+            categories = old.append(delta[col].cat.categories.difference(old, sort=False))
+            # New labels go at the end, so the existing codes stay valid
+            data[col] = data[col].cat.set_categories(categories)
+            delta[col] = delta[col].cat.set_categories(categories)
+    return pd.concat([data, delta])
+
+
+def _drop_rows(data: pd.DataFrame, rows: np.ndarray) -> pd.DataFrame:
+    """Drop rows of a cleaned frame, with the labels no row uses any more."""
+    data = data[~rows].copy(deep=False)
+    for col in data.columns:
+        if isinstance(data[col].dtype, pd.CategoricalDtype):
+            data[col] = data[col].cat.remove_unused_categories()
+    return data
+
+
+def _observed_mask(parsed: pd.DataFrame) -> np.ndarray:
+    """Which numeric values of parsed rows are present, i.e. will not be imputed."""
+    return parsed[NUMERIC_COLUMNS].notna().to_numpy()
+
+
+def _observed_sketches(data: pd.DataFrame, observed: np.ndarray) -> Dict[str, QuantileSketch]:
+    """Quantile sketches over the parsed, not imputed, values of cleaned rows."""
+    # compact_schema only changes dtypes losslessly, so these are the parsed values
+    return {col: QuantileSketch.from_values(data[col].to_numpy(dtype=np.float64)[observed[:, i]])
+            for i, col in enumerate(NUMERIC_COLUMNS)}
+
+
+@instrument()
+def build_dataset_state(raw: pd.DataFrame, version: int = 1) -> DatasetState:
+    """
+    Clean a raw scrape from scratch.
+
+    The data is identical to preprocess_rental_data(raw, compact=True, location_hierarchy=True,
+    outliers='iqr', imputation='hierarchical', near_duplicates=True, keyword_features=True).
+
+    Args:
+        raw: Raw listings as read from the CSV
+        version: Version number of the new state
+
+    Returns:
+        DatasetState: Cleaned data with its sketches, cube, correlation engine and aggregates
+    """
+    with stage('refresh.hash'):
+        hashes = hash_rows(raw)
+        first = ~pd.Index(hashes).duplicated()
+
+    with stage('refresh.clean', rows=int(first.sum())):
+        parsed = parse_listing_columns(raw[first].copy())
+        duplicates = NearDuplicateIndex()
+        kept = ~duplicates.add(parsed, ids=hashes[first])
+        parsed = parsed[kept]
+        data_hashes = hashes[first][kept]
+        observed = _observed_mask(parsed)
+        sketches = {col: QuantileSketch.from_values(parsed[col]) for col in NUMERIC_COLUMNS}
+        location_counts = parsed['Location'].value_counts()
+        parents = parent_map_from_counts(location_counts)
+        data = add_location_hierarchy(parsed, parents)
+        tables = imputation_tables(data)
+        data = compact_schema(impute_missing(data, tables=tables))
+
+    with stage('refresh.outliers'):
+        fences = outlier_fences(data)
+        data[OUTLIER_COLUMN] = flag_outliers(data, fences)
+
+    with stage('refresh.keywords'):
+        data[KEYWORD_FEATURES] = extract_keyword_features(data['Details'])
+
+    return DatasetState(data, np.unique(hashes[first]), data_hashes, observed, sketches, location_counts, parents,
+                        fences, tables, duplicates, version)
+
+
+@instrument()
+def refresh_dataset_state(state: DatasetState, raw: pd.DataFrame) -> Tuple[DatasetState, Dict]:
+    """
+    Bring a dataset state up to date with a new scrape, processing only the changed rows.
+
+    Rows are matched by content hash, so a listing that changed counts as removed and added.
+    Known rows missing from the scrape are subtracted from the cube, correlation engine,
+    location counts and near-duplicate index, and the location aggregates of their areas
+    are recomputed. Rows whose hash is new are parsed, dropped when they nearly duplicate a
+    kept listing or an earlier new row, imputed from the location and city tables of the last
+    full build (and overall medians from the merged sketches), and merged into the same
+    structures. Previously imputed rows keep the median that was current when they arrived,
+    and new rows are flagged as outliers against the fences of the last full build. When the
+    changes alter the location parent map, the hierarchy columns are re-derived for the rows
+    of the locations that now resolve differently, and only their areas are re-aggregated.
+    The listing index and near-duplicate index take the new rows without re-sorting or
+    re-hashing the existing ones.
+
+    The near-duplicate index records which kept listing every dropped re-post matched, so
+    after removals only the re-posts of the removed listings are parsed and checked again.
+    The observed (not imputed) values of removed rows are
+    subtracted from the quantile sketches, so the raw scrape is only read for the new rows and
+    the whole refresh takes time in proportion to the changes. Only a scrape that shares
+    no listing with the current data is rebuilt from scratch. The first listing of a group
+    of near duplicates is kept, so the kept rows depend on arrival order: after removals a
+    refresh can keep a listing that a full build of the same scrape drops, or the reverse.
+
+    Args:
+        state: Current state (left unchanged, sessions may still be reading it)
+        raw: The complete new scrape
+
+    Returns:
+        Tuple of the new state (the same object when nothing changed) and refresh stats
+        ('mode': 'unchanged', 'delta' or 'full', 'delta_rows', 'removed_rows', 'rows', 'seconds')
+    """
+    start = time.perf_counter()
+    with stage('refresh.hash'):
+        hashes = hash_rows(raw)
+        known = np.isin(hashes, state.row_hashes)
+        removed = ~np.isin(state.data_hashes, hashes[known])
+        duplicates = copy.copy(state.duplicates)
+        if removed.any():
+            # Re-posts dropped for a removed listing have lost it; check only those again
+            known &= ~np.isin(hashes, duplicates.remove(removed))
+        seen = np.isin(state.row_hashes, hashes[known])
+        if not seen.all():
+            duplicates.forget(state.row_hashes[~seen])
+        new_rows = ~known & ~pd.Index(hashes).duplicated()
+
+    if len(state.data) and removed.all():
+        logger.info("No listing of the current data is in the new scrape; rebuilding the dataset")
+        new_state = build_dataset_state(raw, state.version + 1)
+        return new_state, {'mode': 'full', 'delta_rows': len(new_state.data), 'removed_rows': len(state.data),
+                           'rows': len(new_state.data), 'seconds': time.perf_counter() - start}
+    if not new_rows.any() and seen.all():
+        return state, {'mode': 'unchanged', 'delta_rows': 0, 'removed_rows': 0, 'rows': len(state.data),
+                       'seconds': time.perf_counter() - start}
+
+    new_state = copy.copy(state)
+    new_state.row_hashes = np.union1d(state.row_hashes[seen], hashes[new_rows])
+    data, data_hashes, observed = state.data, state.data_hashes, state.observed
+    location_counts = state.location_counts
+    sketches = state.sketches
+    gone = data.iloc[:0]
+    if removed.any():
+        with stage('refresh.remove', rows=int(removed.sum())):
+            gone = data[removed]
+            data = _drop_rows(data, removed)
+            data_hashes = data_hashes[~removed]
+            sketches = {col: sketches[col].subtract(removed_sketch)
+                        for col, removed_sketch in _observed_sketches(gone, observed[removed]).items()}
+            observed = observed[~removed]
+            location_counts = location_counts.sub(gone['Location'].astype(object).value_counts(), fill_value=0)
+            location_counts = location_counts[location_counts > 0].astype(np.int64)
+            new_state.cube = copy.copy(state.cube)
+            new_state.cube.remove(gone, data)
+            new_state.correlation = copy.copy(state.correlation)
+            new_state.correlation.remove(removed)
+
+    parsed = None
+    if new_rows.any():
+        with stage('refresh.clean', rows=int(new_rows.sum())):
+            parsed = parse_listing_columns(raw[new_rows].copy())
+            kept = ~duplicates.add(parsed, ids=hashes[new_rows])
+            parsed = parsed[kept]
+            data_hashes = np.concatenate([data_hashes, hashes[new_rows][kept]])
+            observed = np.concatenate([observed, _observed_mask(parsed)])
+    if not removed.any() and (parsed is None or not len(parsed)):
+        # Only re-posts of known listings; remember their hashes so they are not checked again
+        new_state.duplicates = duplicates
+        return new_state, {'mode': 'unchanged', 'delta_rows': 0, 'removed_rows': 0, 'rows': len(state.data),
+                           'seconds': time.perf_counter() - start}
+
+    if parsed is not None and len(parsed):
+        with stage('refresh.sketches'):
+            sketches = {col: sketches[col].merge(QuantileSketch.from_values(parsed[col])) for col in NUMERIC_COLUMNS}
+
+    delta = data.iloc[:0]
+    if parsed is not None and len(parsed):
+        with stage('refresh.clean', rows=len(parsed)):
+            location_counts = location_counts.add(parsed['Location'].value_counts(), fill_value=0).astype(np.int64)
+            parents = parent_map_from_counts(location_counts)
+            delta = add_location_hierarchy(parsed, parents)
+            delta = impute_missing(delta, {col: sketches[col].median() for col in NUMERIC_COLUMNS},
+                                   state.imputation)
+            delta = compact_schema(delta)
+            delta[OUTLIER_COLUMN] = flag_outliers(delta, state.outlier_fences)
+            delta[KEYWORD_FEATURES] = extract_keyword_features(delta['Details'])
+            offset = int(state.data.index.max()) + 1 if len(state.data) else 0
+            delta.index = pd.RangeIndex(offset, offset + len(delta))
+    else:
+        parents = parent_map_from_counts(location_counts)
+
+    columns = LOCATION_LEVELS + ['Location']
+    with stage('refresh.merge', rows=len(delta)):
+        moved = data.iloc[:0]
+        if parents != state.parents:
+            # The changes altered the parent of an area (or made it ambiguous), which can move
+            # existing rows to another city or society
+            previous = data
+            data, rows = update_location_hierarchy(data, state.parents, parents)
+            moved = pd.concat([previous.loc[rows, columns].astype(object), data.loc[rows, columns].astype(object)])
+        if len(delta):
+            data = _append_rows(data, delta)
+        new_state.data = data
+        new_state.data_hashes = data_hashes
+        new_state.observed = observed
+        new_state.sketches = sketches
+        new_state.location_counts = location_counts
+        new_state.parents = parents
+        new_state.duplicates = duplicates
+        new_state.version = state.version + 1
+
+        if len(delta):
+            new_state.cube = copy.copy(new_state.cube)
+            new_state.cube.update(delta)
+            new_state.correlation = copy.copy(new_state.correlation)
+            new_state.correlation.update(delta)
+        new_state.location_aggregates = copy.copy(state.location_aggregates)
+        new_state.location_aggregates.update(data, pd.concat([gone[columns].astype(object), moved,
+                                                              delta[columns].astype(object)]))
+        new_state.neighbors = copy.copy(state.neighbors)
+        new_state.neighbors.update(data, removed)
+
+    stats = {'mode': 'delta', 'delta_rows': len(delta), 'removed_rows': int(removed.sum()),
+             'rows': len(new_state.data), 'seconds': time.perf_counter() - start}
+    logger.info(f"Merged {len(delta)} new listings and removed {stats['removed_rows']} in {stats['seconds']:.2f}s")
+    return new_state, stats
+
+
+@instrument()
+def merge_dataset_states(states: Sequence[DatasetState]) -> DatasetState:
+    """
+    Combine the states of separately cleaned source files into one.
+
+    Rows keep the imputed values of their own file; the location hierarchy is re-derived
+    when the combined parent map differs from a file's own, and outliers are flagged again
+    against fences over all files. The combined imputation tables are recomputed from the
+    merged rows, so they include the values the files imputed. Listings that appear in several
+    files, exactly or as near duplicates, are kept once per file.
+
+    Args:
+        states: States of the source files
+
+    Returns:
+        DatasetState: State over the rows of all files
+    """
+    if len(states) == 1:
+        return states[0]
+
+    location_counts = functools.reduce(
+        lambda left, right: left.add(right, fill_value=0), [s.location_counts for s in states]).astype(np.int64)
+    parents = parent_map_from_counts(location_counts)
+    data = functools.reduce(_append_rows, [s.data for s in states]).reset_index(drop=True)
+    if any(s.parents != parents for s in states):
+        data = compact_schema(add_location_hierarchy(data.drop(columns=LOCATION_LEVELS), parents))
+    fences = outlier_fences(data)
+    data[OUTLIER_COLUMN] = flag_outliers(data, fences)
+    tables = imputation_tables(data)
+
+    sketches = {col: functools.reduce(QuantileSketch.merge, [s.sketches[col] for s in states])
+                for col in NUMERIC_COLUMNS}
+    row_hashes = np.unique(np.concatenate([s.row_hashes for s in states]))
+    data_hashes = np.concatenate([s.data_hashes for s in states])
+    observed = np.concatenate([s.observed for s in states])
+    duplicates = functools.reduce(NearDuplicateIndex.merge, [s.duplicates for s in states])
+    return DatasetState(data, row_hashes, data_hashes, observed, sketches, location_counts, parents, fences,
+                        tables, duplicates)
@@ -0,0 +1,197 @@
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import BrokenExecutor, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, NamedTuple, Optional
+
+import matplotlib
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from plotting import create_heatmap, create_price_distribution, create_regression_analysis
+from statistical_analysis import create_qq_plot, create_distribution_plots, create_prediction_plot
+
+logger = logging.getLogger(__name__)
+
+# Number of render workers (0 renders inline on the calling thread)
+RENDER_WORKERS_ENV = 'THINKLYTICS_RENDER_WORKERS'
+# 'process' (default) or 'thread'
+RENDER_MODE_ENV = 'THINKLYTICS_RENDER_MODE'
+RENDER_MODES = ('process', 'thread')
+DEFAULT_DPI = 200
+
+# Figure builders by name; only the name crosses the process boundary
+FIGURE_BUILDERS: Dict[str, Callable[..., Figure]] = {
+    'heatmap': create_heatmap,
+    'price_distribution': create_price_distribution,
+    'regression_analysis': create_regression_analysis,
+    'qq': create_qq_plot,
+    'distribution': create_distribution_plots,
+    'prediction': create_prediction_plot
+}
+
+
+class FigureJob(NamedTuple):
+    """One figure to render: builder name, the columns it plots and its extra arguments."""
+    builder: str
+    data: pd.DataFrame
+    args: tuple = ()
+
+
+def figure_to_png(fig: Figure, dpi: int = DEFAULT_DPI) -> bytes:
+    """Rasterize a figure with its own Agg canvas; no pyplot state is involved."""
+    buffer = io.BytesIO()
+    FigureCanvasAgg(fig).print_figure(buffer, format='png', bbox_inches='tight', dpi=dpi)
+    return buffer.getvalue()
+
+
+def render_job(job: FigureJob, dpi: int = DEFAULT_DPI) -> bytes:
+    """Build and rasterize one figure; runs on a render worker."""
+    fig = FIGURE_BUILDERS[job.builder](job.data, *job.args)
+    return figure_to_png(fig, dpi)
+
+
+def _store_in_cache(cache, namespace: str, key: Hashable) -> Callable[[Future], None]:
+    """Build a done-callback that caches the PNG bytes of a successful render."""
+    def store(future: Future) -> None:
+        if not future.cancelled() and future.exception() is None:
+            cache.put(namespace, key, future.result())
+    return store
+
+
+def _init_worker() -> None:
+    matplotlib.use('Agg')
+
+
+class RenderExecutor:
+    """
+    Renders independent figures concurrently and returns them as PNG bytes.
+
+    The figure builders only use the object-oriented Figure API, so they can run on any
+    thread. Process workers (the default) render in parallel beyond the GIL and scale with
+    the cores; they are started with 'spawn' so they never inherit the server's threads and
+    locks. Thread workers avoid the process start-up and data transfer for small figures.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, mode: str = 'process'):
+        if mode not in RENDER_MODES:
+            raise ValueError(f"Unknown render mode: {mode!r}")
+        self.max_workers = os.cpu_count() if max_workers is None else max_workers
+        self.mode = mode
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> Executor:
+        with self._lock:
+            if self._pool is None:
+                if self.mode == 'thread':
+                    self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='render')
+                else:
+                    self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'),
+                                                     initializer=_init_worker)
+            return self._pool
+
+    def _reset_pool(self, pool: Executor) -> None:
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, job: FigureJob, dpi: int = DEFAULT_DPI) -> Future:
+        """
+        Start rendering one figure.
+
+        Args:
+            job: Figure to render
+            dpi: Output resolution
+
+        Returns:
+            Future: Resolves to the PNG bytes
+        """
+        if self.max_workers == 0:
+            future = Future()
+            try:
+                future.set_result(render_job(job, dpi))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        pool = self._get_pool()
+        try:
+            return pool.submit(render_job, job, dpi)
+        except BrokenExecutor:
+            # A render worker died (e.g. out of memory); start a fresh pool once
+            logger.warning("Render pool broken, restarting it")
+            self._reset_pool(pool)
+            return self._get_pool().submit(render_job, job, dpi)
+
+    def warm_up(self) -> None:
+        """Start all render processes now so the first rerun does not pay their import time."""
+        if self.max_workers and self.mode == 'process':
+            pool = self._get_pool()
+            for _ in range(self.max_workers):
+                pool.submit(_init_worker)
+
+    def render_all(
+        self,
+        jobs: Dict[Hashable, FigureJob],
+        cache=None,
+        namespace: str = 'figures',
+        dpi: int = DEFAULT_DPI
+    ) -> Dict[Hashable, Future]:
+        """
+        Start rendering every job that is not cached yet.
+
+        Args:
+            jobs: Figures to render, keyed by their cache key
+            cache: Optional ResultCache; hits are returned directly and new renders are stored
+            namespace: Cache namespace for the PNG bytes
+            dpi: Output resolution
+
+        Returns:
+            Dict mapping each key to a Future resolving to the PNG bytes
+        """
+        futures = {}
+        for key, job in jobs.items():
+            png = cache.get(namespace, key) if cache is not None else None
+            if png is not None:
+                futures[key] = Future()
+                futures[key].set_result(png)
+                continue
+
+            futures[key] = self.submit(job, dpi)
+            if cache is not None:
+                futures[key].add_done_callback(_store_in_cache(cache, namespace, key))
+        return futures
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_render_executor() -> RenderExecutor:
+    """
+    Return the process-wide render executor.
+
+    It uses THINKLYTICS_RENDER_WORKERS workers (default: all cores) of the
+    THINKLYTICS_RENDER_MODE kind (default: processes), started on the first call.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = os.environ.get(RENDER_WORKERS_ENV)
+            _executor = RenderExecutor(int(workers) if workers else None,
+                                       os.environ.get(RENDER_MODE_ENV, 'process'))
+            _executor.warm_up()
+            logger.info(f"Render executor using {_executor.max_workers or 'no'} {_executor.mode} workers")
+        return _executor
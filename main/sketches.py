@@ -0,0 +1,247 @@
+import math
+import numpy as np
+import pandas as pd
+from typing import Iterable, Optional, Tuple
+
+# Relative accuracy of QuantileSketch once it leaves exact mode
+DEFAULT_RELATIVE_ACCURACY = 0.01
+# Distinct values kept exactly before a sketch switches to its approximate summary
+DEFAULT_MAX_EXACT = 4096
+# Counters kept by TopKSketch once it leaves exact mode
+DEFAULT_TOPK_CAPACITY = 256
+
+
+def _merge_counts(keys: np.ndarray, counts: np.ndarray, other_keys: np.ndarray,
+                  other_counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Add two sorted (key, count) histograms."""
+    merged, inverse = np.unique(np.concatenate([keys, other_keys]), return_inverse=True)
+    return merged, np.bincount(inverse, weights=np.concatenate([counts, other_counts]),
+                               minlength=len(merged)).astype(np.int64)
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch for imputation medians and other order statistics.
+
+    While a column has at most max_exact distinct values the sketch is an exact
+    value -> count histogram and quantiles match pandas (linear interpolation). Beyond that
+    it switches to logarithmic buckets (as in DDSketch): every quantile is then within
+    relative_accuracy of the true value, and size grows with the value range, not the row
+    count. Merging two sketches gives the sketch of the combined data in either mode, and
+    subtracting the sketch of values that were added removes them again.
+    """
+
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY, max_exact: int = DEFAULT_MAX_EXACT):
+        self.relative_accuracy = relative_accuracy
+        self.max_exact = max_exact
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.exact = True
+        # Exact mode: sorted distinct values. Bucket mode: sorted signed bucket keys
+        # (negative values get negative keys, zero gets key 0).
+        self.keys = np.empty(0, dtype=np.float64)
+        self.counts = np.empty(0, dtype=np.int64)
+
+    @classmethod
+    def from_values(cls, values: Iterable[float], **kwargs) -> 'QuantileSketch':
+        """Build a sketch of the non-missing values."""
+        sketch = cls(**kwargs)
+        values = np.asarray(values, dtype=np.float64)
+        sketch.keys, counts = np.unique(values[~np.isnan(values)], return_counts=True)
+        sketch.counts = counts.astype(np.int64)
+        if len(sketch.keys) > sketch.max_exact:
+            sketch._to_buckets()
+        return sketch
+
+    @property
+    def count(self) -> int:
+        return int(self.counts.sum())
+
+    def _bucket_keys(self, values: np.ndarray) -> np.ndarray:
+        """Map values to signed logarithmic bucket keys (offset by one so zero stays 0)."""
+        magnitude = np.abs(values)
+        keys = np.zeros(len(values), dtype=np.float64)
+        nonzero = magnitude > 0
+        # Bucket i holds magnitudes in (gamma^(i-1), gamma^i]; shift so key 0 is reserved for zero
+        keys[nonzero] = np.ceil(np.log(magnitude[nonzero]) / math.log(self.gamma)) + self._offset()
+        return np.sign(values) * keys
+
+    def _offset(self) -> float:
+        # Keeps every key of a magnitude above 1e-300 strictly positive
+        return math.ceil(-math.log(1e-300) / math.log(self.gamma)) + 1
+
+    def _bucket_value(self, keys: np.ndarray) -> np.ndarray:
+        """Representative value of each bucket (relative error at most relative_accuracy)."""
+        exponent = np.abs(keys) - self._offset()
+        values = 2 * self.gamma ** exponent / (self.gamma + 1)
+        return np.where(keys == 0, 0.0, np.sign(keys) * values)
+
+    def _to_buckets(self) -> None:
+        keys, inverse = np.unique(self._bucket_keys(self.keys), return_inverse=True)
+        self.counts = np.bincount(inverse, weights=self.counts, minlength=len(keys)).astype(np.int64)
+        self.keys = keys
+        self.exact = False
+
+    def merge(self, other: 'QuantileSketch') -> 'QuantileSketch':
+        """
+        Return the sketch of both inputs; neither sketch is modified.
+
+        Args:
+            other: Sketch with the same relative accuracy
+
+        Returns:
+            QuantileSketch: Combined sketch
+        """
+        merged = QuantileSketch(self.relative_accuracy, self.max_exact)
+        left, right = self, other
+        if left.exact != right.exact:
+            # Bring the exact side into bucket mode first
+            left, right = [s if not s.exact else s._copy_as_buckets() for s in (left, right)]
+        merged.keys, merged.counts = _merge_counts(left.keys, left.counts, right.keys, right.counts)
+        merged.exact = left.exact and right.exact
+        if merged.exact and len(merged.keys) > merged.max_exact:
+            merged._to_buckets()
+        return merged
+
+    def subtract(self, other: 'QuantileSketch') -> 'QuantileSketch':
+        """
+        Return the sketch without the values of other; neither sketch is modified.
+
+        Bucket counts are exact, so removing values keeps the accuracy guarantee of the
+        remaining ones in either mode. A sketch that left exact mode stays in bucket mode.
+
+        Args:
+            other: Sketch of values that were added to this one (e.g. removed rows)
+
+        Returns:
+            QuantileSketch: Sketch of the remaining values
+        """
+        result = QuantileSketch(self.relative_accuracy, self.max_exact)
+        left, right = self, other
+        if left.exact != right.exact:
+            left, right = [s if not s.exact else s._copy_as_buckets() for s in (left, right)]
+        keys, counts = _merge_counts(left.keys, left.counts, right.keys, -right.counts)
+        remaining = counts > 0
+        result.keys, result.counts = keys[remaining], counts[remaining]
+        result.exact = left.exact and right.exact
+        return result
+
+    def _copy_as_buckets(self) -> 'QuantileSketch':
+        copy = QuantileSketch(self.relative_accuracy, self.max_exact)
+        copy.keys, copy.counts = self.keys, self.counts
+        copy._to_buckets()
+        return copy
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimate the q-quantile (0 <= q <= 1).
+
+        Returns:
+            The quantile (exact in exact mode), or None for an empty sketch
+        """
+        n = self.count
+        if n == 0:
+            return None
+        cumulative = np.cumsum(self.counts)
+        position = q * (n - 1)
+        lower = int(math.floor(position))
+        upper = min(lower + 1, n - 1)
+        lower_idx = np.searchsorted(cumulative, lower, side='right')
+        upper_idx = np.searchsorted(cumulative, upper, side='right')
+        if not self.exact:
+            return float(self._bucket_value(self.keys[[lower_idx]])[0])
+        low, high = self.keys[lower_idx], self.keys[upper_idx]
+        return float(low + (high - low) * (position - lower))
+
+    def median(self) -> Optional[float]:
+        return self.quantile(0.5)
+
+
+def _label_counts(values: Iterable) -> pd.Series:
+    """Count labels; categoricals are counted by their integer codes without hashing strings."""
+    if isinstance(getattr(values, 'dtype', None), pd.CategoricalDtype):
+        codes = np.asarray(values.cat.codes)
+        counts = np.bincount(codes[codes >= 0], minlength=len(values.cat.categories))
+        present = counts > 0
+        return pd.Series(counts[present].astype(np.int64), index=values.cat.categories[present])
+    return pd.Series(values).value_counts(sort=False).astype(np.int64)
+
+
+class TopKSketch:
+    """
+    Mergeable heavy-hitter sketch for the most frequent labels (e.g. top locations).
+
+    Up to max_exact distinct labels the counts are exact. Beyond that the sketch keeps the
+    capacity largest counters as a Misra-Gries summary: when counters are merged past the
+    capacity, the (capacity+1)-th largest count is subtracted from all of them and the
+    non-positive ones are dropped. Every kept count then underestimates the true count by at
+    most `error` (which is at most count / (capacity + 1)), and every label more frequent than
+    that is kept, whatever the order in which batches or partitions are merged.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_TOPK_CAPACITY, max_exact: int = DEFAULT_MAX_EXACT):
+        self.capacity = capacity
+        self.max_exact = max_exact
+        self.counts = pd.Series(dtype=np.int64)
+        self.total = 0
+        self.error = 0
+        self.exact = True
+
+    @classmethod
+    def from_counts(cls, counts: pd.Series, **kwargs) -> 'TopKSketch':
+        """Build a sketch from label -> count totals (e.g. merged location counts)."""
+        sketch = cls(**kwargs)
+        sketch.counts = counts[counts > 0].astype(np.int64)
+        sketch.total = int(sketch.counts.sum())
+        if len(sketch.counts) > sketch.max_exact:
+            sketch._reduce()
+        return sketch
+
+    @classmethod
+    def from_values(cls, values: Iterable, **kwargs) -> 'TopKSketch':
+        """Build a sketch of the non-missing labels."""
+        return cls.from_counts(_label_counts(values), **kwargs)
+
+    def _reduce(self) -> None:
+        """Shrink to capacity counters (Misra-Gries reduction)."""
+        if len(self.counts) > self.capacity:
+            threshold = int(np.partition(self.counts.to_numpy(), len(self.counts) - self.capacity - 1)
+                            [len(self.counts) - self.capacity - 1])
+            reduced = self.counts - threshold
+            self.counts = reduced[reduced > 0]
+            self.error += threshold
+        self.exact = False
+
+    def merge(self, other: 'TopKSketch') -> 'TopKSketch':
+        """
+        Return the sketch of both inputs; neither sketch is modified.
+
+        Args:
+            other: Sketch to combine with
+
+        Returns:
+            TopKSketch: Combined sketch (exact while both are exact and small)
+        """
+        merged = TopKSketch(self.capacity, self.max_exact)
+        merged.counts = self.counts.add(other.counts, fill_value=0).astype(np.int64)
+        merged.total = self.total + other.total
+        merged.error = self.error + other.error
+        merged.exact = self.exact and other.exact
+        if not merged.exact or len(merged.counts) > merged.max_exact:
+            merged._reduce()
+        return merged
+
+    def top(self, n: int = 10) -> pd.Series:
+        """
+        The n most frequent labels, most frequent first.
+
+        Returns:
+            pd.Series: Counts indexed by label (lower bounds within error when not exact)
+        """
+        # Stable sort keeps ties in label order, so the result does not depend on merge order
+        counts = self.counts.sort_index(kind='stable').sort_values(ascending=False, kind='stable')
+        return counts.head(n).rename('count')
+
+    def mode(self) -> Optional[str]:
+        """The most frequent label, or None for an empty sketch."""
+        top = self.top(1)
+        return top.index[0] if len(top) else None
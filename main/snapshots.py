@@ -0,0 +1,258 @@
+"""
+Dated snapshots of the rentals data and the price/volume time series derived from them.
+
+Every ingested scrape is cleaned and stored as one month partition of Parquet files
+(SNAPSHOT_DIR/month=YYYY-MM/listings.parquet). Per-location listing counts and mean and
+median prices for every month are kept in a small series table next to the partitions,
+so growth and trend figures are lookups in that table rather than groupbys over all rows.
+
+Usage:
+    python main/snapshots.py data/zameen_rentals_data.csv --month 2024-05
+"""
+import argparse
+import logging
+import os
+import re
+import sys
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from datasets import file_signature
+from instrumentation import instrument
+from locations import LOCATION_LEVELS
+from refresh import build_dataset_state
+
+logger = logging.getLogger(__name__)
+
+# Root directory of the snapshot store
+SNAPSHOT_DIR_ENV = 'THINKLYTICS_SNAPSHOT_DIR'
+DEFAULT_SNAPSHOT_DIR = Path(__file__).resolve().parent.parent / 'data' / 'snapshots'
+SERIES_FILE = 'series.parquet'
+MONTH_PATTERN = re.compile(r'^\d{4}-\d{2}$')
+# Locations need this many listings in both months to be ranked by growth
+MIN_GROWTH_LISTINGS = 10
+
+
+def get_snapshot_dir() -> Path:
+    """Return the snapshot directory (THINKLYTICS_SNAPSHOT_DIR or data/snapshots)."""
+    return Path(os.environ.get(SNAPSHOT_DIR_ENV, DEFAULT_SNAPSHOT_DIR))
+
+
+def location_series(df: pd.DataFrame, month: str) -> pd.DataFrame:
+    """
+    Aggregate one month of listings into series rows.
+
+    Args:
+        df: Cleaned listings of the month
+        month: Month as YYYY-MM
+
+    Returns:
+        pd.DataFrame: One row per location with Month, listings, mean_price and median_price
+    """
+    series = df.groupby('Location', observed=True)['Price'].agg(['count', 'mean', 'median'])
+    series.columns = ['listings', 'mean_price', 'median_price']
+    series = series.reset_index()
+    series['Location'] = series['Location'].astype(str)
+    series.insert(1, 'Month', month)
+    return series
+
+
+class SnapshotStore:
+    """Month-partitioned Parquet store of cleaned snapshots plus their per-location series."""
+
+    def __init__(self, root: Optional[Path] = None):
+        self.root = Path(root) if root is not None else get_snapshot_dir()
+
+    def _partition(self, month: str) -> Path:
+        return self.root / f'month={month}'
+
+    @property
+    def series_path(self) -> Path:
+        return self.root / SERIES_FILE
+
+    def months(self) -> List[str]:
+        """Return the stored months in ascending order."""
+        months = [path.name.split('=', 1)[1] for path in self.root.glob('month=*') if path.is_dir()]
+        return sorted(month for month in months if MONTH_PATTERN.match(month))
+
+    @instrument('SnapshotStore.ingest')
+    def ingest(self, raw: pd.DataFrame, month: str) -> pd.DataFrame:
+        """
+        Clean a raw scrape and store it as the snapshot of a month, replacing any earlier one.
+
+        Args:
+            raw: Raw listings as read from the CSV
+            month: Month of the scrape as YYYY-MM
+
+        Returns:
+            pd.DataFrame: The cleaned listings that were stored
+        """
+        if not MONTH_PATTERN.match(month):
+            raise ValueError(f"Month must look like 2024-05, got {month!r}")
+        data = build_dataset_state(raw).data
+
+        partition = self._partition(month)
+        partition.mkdir(parents=True, exist_ok=True)
+        data.to_parquet(partition / 'listings.parquet', index=False)
+
+        # Only this month's series rows change
+        series = self.read_series()
+        if series is not None:
+            series = series[series['Month'] != month]
+        series = pd.concat([series, location_series(data, month)], ignore_index=True)
+        series.sort_values(['Month', 'Location']).to_parquet(self.series_path, index=False)
+        logger.info(f"Stored {len(data)} listings as the {month} snapshot")
+        return data
+
+    def load(self, months: Optional[Iterable[str]] = None, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Read the listings of some months, with a Month column.
+
+        Args:
+            months: Months to read (all when None); other partitions are not opened
+            columns: Columns to read (all when None)
+
+        Returns:
+            pd.DataFrame: Listings of the selected months
+        """
+        months = self.months() if months is None else sorted(months)
+        frames = []
+        for month in months:
+            frame = pd.read_parquet(self._partition(month) / 'listings.parquet', columns=columns)
+            frame['Month'] = month
+            frames.append(frame)
+        if not frames:
+            return pd.DataFrame(columns=(columns or []) + ['Month'])
+        data = pd.concat(frames, ignore_index=True)
+        # Label columns are categorical in memory, as in the live dataset
+        for col in ['Location', 'Currency', 'Month'] + LOCATION_LEVELS:
+            if col in data.columns:
+                data[col] = data[col].astype('category')
+        return data
+
+    def read_series(self) -> Optional[pd.DataFrame]:
+        """Return the per-location series table, or None before the first ingest."""
+        if not self.series_path.exists():
+            return None
+        return pd.read_parquet(self.series_path)
+
+    def trends(self) -> Optional['MarketTrends']:
+        """Return the market trends over all stored months, or None before the first ingest."""
+        series = self.read_series()
+        if series is None or series.empty:
+            return None
+        signature = file_signature(self.series_path)
+        return MarketTrends(series, version=tuple(signature) if signature is not None else None)
+
+
+class MarketTrends:
+    """
+    Month-by-location matrices of listing counts and prices for growth and trend lookups.
+
+    Mean prices of any group of locations are exact (from counts and price sums); medians are
+    only available per location.
+    """
+
+    def __init__(self, series: pd.DataFrame, version=None):
+        self.version = version
+        self.months = sorted(series['Month'].unique())
+        self.listings = series.pivot(index='Location', columns='Month', values='listings').fillna(0)
+        self.listings = self.listings.reindex(columns=self.months, fill_value=0)
+        price_sum = series.assign(price_sum=series['listings'] * series['mean_price'])
+        self.price_sum = price_sum.pivot(index='Location', columns='Month', values='price_sum')
+        self.price_sum = self.price_sum.reindex(columns=self.months).fillna(0)
+        self.median_price = series.pivot(index='Location', columns='Month', values='median_price')
+        self.median_price = self.median_price.reindex(columns=self.months)
+
+    def __len__(self) -> int:
+        return len(self.months)
+
+    def selection(self, locations: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """
+        Monthly listings and mean price of a group of locations.
+
+        Args:
+            locations: Locations to combine (all when None)
+
+        Returns:
+            pd.DataFrame: Indexed by month with listings and mean_price
+        """
+        listings, price_sum = self.listings, self.price_sum
+        if locations is not None:
+            locations = pd.Index([str(location) for location in locations])
+            listings = listings.reindex(locations, fill_value=0)
+            price_sum = price_sum.reindex(locations, fill_value=0)
+        total = listings.sum()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_price = price_sum.sum() / total
+        return pd.DataFrame({'listings': total, 'mean_price': mean_price.where(total > 0)})
+
+    def growth(self, locations: Optional[Iterable[str]] = None) -> Optional[pd.Series]:
+        """
+        Month-over-month growth of the latest month for a group of locations.
+
+        Returns:
+            pd.Series with listings and mean_price growth (fractions), or None with fewer
+            than two months
+        """
+        if len(self.months) < 2:
+            return None
+        selection = self.selection(locations)
+        previous, latest = selection.iloc[-2], selection.iloc[-1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return latest / previous - 1
+
+    def location_growth(self, locations: Optional[Iterable[str]] = None,
+                        min_listings: int = MIN_GROWTH_LISTINGS) -> Optional[pd.Series]:
+        """
+        Month-over-month median price growth per location for the latest month.
+
+        Args:
+            locations: Locations to rank (all when None)
+            min_listings: Listings a location needs in both months to be included
+
+        Returns:
+            pd.Series: Growth per location, sorted descending, or None with fewer than two months
+        """
+        if len(self.months) < 2:
+            return None
+        previous, latest = self.months[-2], self.months[-1]
+        listings, median = self.listings, self.median_price
+        if locations is not None:
+            index = pd.Index([str(location) for location in locations])
+            listings, median = listings.reindex(index, fill_value=0), median.reindex(index)
+        enough = (listings[previous] >= min_listings) & (listings[latest] >= min_listings)
+        growth = median.loc[enough, latest] / median.loc[enough, previous] - 1
+        return growth.dropna().sort_values(ascending=False)
+
+    def projected_mean_price(self, locations: Optional[Iterable[str]] = None) -> Optional[float]:
+        """Next month's mean price from a linear trend over the stored months (None with fewer than three)."""
+        prices = self.selection(locations)['mean_price'].dropna()
+        if len(prices) < 3:
+            return None
+        positions = np.array([self.months.index(month) for month in prices.index], dtype=float)
+        slope, intercept = np.polyfit(positions, prices.to_numpy(dtype=float), 1)
+        return float(slope * len(self.months) + intercept)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('data', type=Path, help="Raw rentals CSV of one scrape")
+    parser.add_argument('--month', help="Month of the scrape as YYYY-MM (default: the file's modification month)")
+    parser.add_argument('--root', type=Path, default=None, help="Snapshot directory")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    month = args.month or pd.Timestamp(args.data.stat().st_mtime, unit='s').strftime('%Y-%m')
+    store = SnapshotStore(args.root)
+    store.ingest(pd.read_csv(args.data), month)
+    logger.info(f"Snapshot months: {', '.join(store.months())}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
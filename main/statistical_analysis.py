@@ -4,10 +4,13 @@ import scipy.stats as stats
 import statsmodels.api as sm
 from sklearn.linear_model import LinearRegression
 from sklearn.metrics import r2_score, mean_squared_error
-import matplotlib.pyplot as plt
 import seaborn as sns
+from matplotlib.figure import Figure
 from typing import Dict, Tuple, List
+from instrumentation import instrument
+from plotting import new_figure, style_axes, style_legend, finish_figure, get_theme
 
+@instrument()
 def calculate_descriptive_stats(df: pd.DataFrame) -> pd.DataFrame:
     """Calculate comprehensive descriptive statistics."""
     numeric_cols = df.select_dtypes(include=[np.number]).columns
@@ -24,6 +27,7 @@ def calculate_descriptive_stats(df: pd.DataFrame) -> pd.DataFrame:
     }
     return pd.DataFrame(stats_dict)
 
+@instrument()
 def calculate_confidence_intervals(df: pd.DataFrame, confidence_level: float = 0.95) -> Dict[str, Tuple[float, float]]:
     """Calculate confidence intervals for numeric columns."""
     numeric_cols = df.select_dtypes(include=[np.number]).columns
@@ -42,6 +46,7 @@ def calculate_confidence_intervals(df: pd.DataFrame, confidence_level: float = 0
     
     return intervals
 
+@instrument()
 def analyze_distributions(df: pd.DataFrame, column: str) -> Dict:
     """Analyze distribution of a numeric column."""
     data = df[column].dropna()
@@ -66,47 +71,134 @@ def analyze_distributions(df: pd.DataFrame, column: str) -> Dict:
         }
     }
 
-def create_qq_plot(df: pd.DataFrame, column: str, theme: str) -> plt.Figure:
+@instrument()
+def create_qq_plot(df: pd.DataFrame, column: str, theme: str) -> Figure:
     """Create QQ plot for normality testing."""
     # Reduce figure size by 10%
-    fig = plt.figure(figsize=(9, 5.4), facecolor='none')  # Set transparent background
-    ax = fig.add_subplot(111)
-    
-    if theme == "Dark":
-        plt.style.use('dark_background')
-        ax.set_facecolor('none')  # Transparent axis background
-        # Set text colors for dark theme
-        ax.xaxis.label.set_color('white')
-        ax.yaxis.label.set_color('white')
-        ax.title.set_color('white')
-        ax.tick_params(colors='white')
-        for spine in ax.spines.values():
-            spine.set_color('white')
+    fig, ax = new_figure((9, 5.4))
+    
+    stats.probplot(df[column].dropna(), dist="norm", plot=ax)
+    style_axes(ax, theme, f'Q-Q Plot for {column}')
+    
+    return finish_figure(fig, ax)
+
+def _fit_ols(X: np.ndarray, y: np.ndarray, alpha: float = 0.05) -> Dict:
+    """
+    Fit OLS with NumPy and return parameters, inference and fitted intervals as arrays.
+
+    Degrees of freedom use the rank of X, like statsmodels, so collinear or constant columns
+    are not counted twice. Without residual degrees of freedom (n <= rank) or variance in y,
+    the statistics that need them are NaN.
+    """
+    n = X.shape[0]
+    rank = int(np.linalg.matrix_rank(X)) if n else 0
+    df_resid = n - rank
+    df_model = rank - 1
+    
+    XtX_inv = np.linalg.pinv(X.T @ X)
+    params = XtX_inv @ (X.T @ y)
+    fitted = X @ params
+    resid = y - fitted
+    
+    ssr = float(resid @ resid)
+    tss = float(((y - y.mean()) ** 2).sum()) if n else 0.0
+    scale = ssr / df_resid if df_resid > 0 else np.nan
+    cov = scale * XtX_inv
+    bse = np.sqrt(np.diag(cov))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tvalues = params / bse
+    q = stats.t.ppf(1 - alpha / 2, df_resid) if df_resid > 0 else np.nan
+    
+    r_squared = 1 - ssr / tss if tss > 0 else np.nan
+    adj_r_squared = 1 - (n - 1) / df_resid * (1 - r_squared) if df_resid > 0 else np.nan
+    if df_model > 0 and df_resid > 0 and scale > 0 and tss > 0:
+        f_statistic = ((tss - ssr) / df_model) / scale
+        f_p_value = stats.f.sf(f_statistic, df_model, df_resid)
     else:
-        ax.set_facecolor('none')  # Transparent axis background
-        # Set text colors for light theme
-        ax.xaxis.label.set_color('black')
-        ax.yaxis.label.set_color('black')
-        ax.title.set_color('black')
-        ax.tick_params(colors='black')
-        for spine in ax.spines.values():
-            spine.set_color('black')
-    
-    stats.probplot(df[column].dropna(), dist="norm", plot=plt)
-    plt.title(f'Q-Q Plot for {column}', pad=15, fontsize=14, fontweight='bold')
-    plt.grid(True, alpha=0.2, color='white' if theme == "Dark" else 'black')
-    
-    # Adjust layout to prevent cutoff
-    plt.tight_layout(pad=1.5)
-    
-    # Set figure background to transparent
-    fig.patch.set_alpha(0.0)
-    ax.patch.set_alpha(0.0)
-    
-    return fig
+        f_statistic, f_p_value = np.nan, np.nan
+    
+    # Standard error of the mean prediction for every row: sqrt(x_i' Cov x_i)
+    se_mean = np.sqrt(((X @ cov) * X).sum(axis=1))
+    
+    return {
+        'params': params,
+        'bse': bse,
+        'tvalues': tvalues,
+        'pvalues': 2 * stats.t.sf(np.abs(tvalues), df_resid) if df_resid > 0 else np.full(len(params), np.nan),
+        'conf_int': np.column_stack([params - q * bse, params + q * bse]),
+        'r_squared': r_squared,
+        'adj_r_squared': adj_r_squared,
+        'f_statistic': f_statistic,
+        'f_p_value': f_p_value,
+        'fitted_values': fitted,
+        'prediction_intervals': np.column_stack([fitted - q * se_mean, fitted + q * se_mean]),
+        'resid': resid,
+        'nobs': n,
+        'df_resid': df_resid,
+        'df_model': df_model
+    }
+
+@instrument()
+def calculate_regression_diagnostics(resid: np.ndarray, X: np.ndarray) -> Dict[str, float]:
+    """Compute the residual diagnostics of the full statsmodels summary."""
+    from statsmodels.stats.stattools import durbin_watson, jarque_bera, omni_normtest
+    
+    omnibus, omnibus_p = omni_normtest(resid)
+    jb, jb_p, skew, kurtosis = jarque_bera(resid)
+    return {
+        'omnibus': float(omnibus),
+        'omnibus_p_value': float(omnibus_p),
+        'jarque_bera': float(jb),
+        'jarque_bera_p_value': float(jb_p),
+        'skew': float(skew),
+        'kurtosis': float(kurtosis),
+        'durbin_watson': float(durbin_watson(resid)),
+        'condition_number': float(np.linalg.cond(X))
+    }
 
-def perform_regression_analysis(df: pd.DataFrame, target: str, features: List[str]) -> Dict:
-    """Perform multiple regression analysis."""
+def format_regression_summary(results: Dict, target: str) -> str:
+    """Render a compact OLS summary table from a lean regression result."""
+    lines = [
+        f"Dep. Variable: {target}    No. Observations: {results['nobs']}",
+        f"R-squared: {results['r_squared']:.3f}    Adj. R-squared: {results['adj_r_squared']:.3f}",
+        f"F-statistic: {results['f_statistic']:.4g}    Prob (F-statistic): {results['f_p_value']:.3g}",
+        f"Df Residuals: {results['df_resid']}    Df Model: {results['df_model']}",
+        "",
+        f"{'':<12}{'coef':>14}{'std err':>14}{'t':>10}{'P>|t|':>10}{'[0.025':>14}{'0.975]':>14}"
+    ]
+    lower = results['confidence_intervals'][0]
+    upper = results['confidence_intervals'][1]
+    for name, coef in results['coefficients'].items():
+        lines.append(
+            f"{name:<12}{coef:>14.4f}{results['std_errors'][name]:>14.4f}{results['t_values'][name]:>10.3f}"
+            f"{results['p_values'][name]:>10.3f}{lower[name]:>14.4f}{upper[name]:>14.4f}"
+        )
+    
+    diagnostics = results.get('diagnostics')
+    if diagnostics:
+        lines += [
+            "",
+            f"Omnibus: {diagnostics['omnibus']:.3f}    Prob(Omnibus): {diagnostics['omnibus_p_value']:.3f}",
+            f"Jarque-Bera (JB): {diagnostics['jarque_bera']:.3f}    Prob(JB): {diagnostics['jarque_bera_p_value']:.3g}",
+            f"Skew: {diagnostics['skew']:.3f}    Kurtosis: {diagnostics['kurtosis']:.3f}",
+            f"Durbin-Watson: {diagnostics['durbin_watson']:.3f}    Cond. No.: {diagnostics['condition_number']:.3g}"
+        ]
+    return '\n'.join(lines)
+
+@instrument()
+def perform_regression_analysis(df: pd.DataFrame, target: str, features: List[str],
+                                lean: bool = False, diagnostics: bool = False) -> Dict:
+    """
+    Perform multiple regression analysis.
+    
+    With ``lean=True`` the model is fitted directly with NumPy and only the statistics shown
+    on the dashboard are computed. Fitted values and intervals stay NumPy arrays, and the
+    residual diagnostics (Omnibus, Jarque-Bera, Durbin-Watson, condition number) are only
+    computed when ``diagnostics=True``.
+    """
+    if lean:
+        return _perform_lean_regression_analysis(df, target, features, diagnostics)
+    
     # Prepare data
     X = df[features]
     y = df[target]
@@ -136,108 +228,82 @@ def perform_regression_analysis(df: pd.DataFrame, target: str, features: List[st
         }
     }
 
-def create_distribution_plots(df: pd.DataFrame, column: str, theme: str) -> plt.Figure:
+def _perform_lean_regression_analysis(df: pd.DataFrame, target: str, features: List[str],
+                                      diagnostics: bool) -> Dict:
+    """Lean variant of perform_regression_analysis backed by _fit_ols."""
+    names = ['const'] + list(features)
+    X = np.column_stack([np.ones(len(df)), df[features].to_numpy(dtype=np.float64)])
+    y = df[target].to_numpy(dtype=np.float64)
+    fit = _fit_ols(X, y)
+    
+    results = {
+        'r_squared': fit['r_squared'],
+        'adj_r_squared': fit['adj_r_squared'],
+        'f_statistic': fit['f_statistic'],
+        'f_p_value': fit['f_p_value'],
+        'coefficients': dict(zip(names, fit['params'])),
+        'std_errors': dict(zip(names, fit['bse'])),
+        't_values': dict(zip(names, fit['tvalues'])),
+        'p_values': dict(zip(names, fit['pvalues'])),
+        'confidence_intervals': {
+            0: dict(zip(names, fit['conf_int'][:, 0])),
+            1: dict(zip(names, fit['conf_int'][:, 1]))
+        },
+        'nobs': fit['nobs'],
+        'df_resid': fit['df_resid'],
+        'df_model': fit['df_model'],
+        'predictions': {
+            'fitted_values': fit['fitted_values'],
+            'prediction_intervals': fit['prediction_intervals']
+        }
+    }
+    if diagnostics:
+        results['diagnostics'] = calculate_regression_diagnostics(fit['resid'], X)
+    results['model_summary'] = format_regression_summary(results, target)
+    return results
+
+@instrument()
+def create_distribution_plots(df: pd.DataFrame, column: str, theme: str) -> Figure:
     """Create distribution plots with fitted normal curve."""
+    palette = get_theme(theme)
     # Reduce figure size by 10%
-    fig = plt.figure(figsize=(10.8, 5.4), facecolor='none')  # Set transparent background
-    ax = fig.add_subplot(111)
-    
-    if theme == "Dark":
-        plt.style.use('dark_background')
-        ax.set_facecolor('none')  # Transparent axis background
-        # Set text colors for dark theme
-        ax.xaxis.label.set_color('white')
-        ax.yaxis.label.set_color('white')
-        ax.title.set_color('white')
-        ax.tick_params(colors='white')
-        for spine in ax.spines.values():
-            spine.set_color('white')
-    else:
-        ax.set_facecolor('none')  # Transparent axis background
-        # Set text colors for light theme
-        ax.xaxis.label.set_color('black')
-        ax.yaxis.label.set_color('black')
-        ax.title.set_color('black')
-        ax.tick_params(colors='black')
-        for spine in ax.spines.values():
-            spine.set_color('black')
+    fig, ax = new_figure((10.8, 5.4))
     
     # Histogram
-    sns.histplot(data=df, x=column, kde=True, color='#4CAF50' if theme == "Dark" else '#1f77b4', 
-                alpha=0.8, ax=ax)
+    sns.histplot(data=df, x=column, kde=True, color=palette.accent, alpha=0.8, ax=ax)
     
     # Fit normal distribution
     mu, std = stats.norm.fit(df[column].dropna())
-    xmin, xmax = plt.xlim()
+    xmin, xmax = ax.get_xlim()
     x = np.linspace(xmin, xmax, 100)
     p = stats.norm.pdf(x, mu, std)
-    plt.plot(x, p * len(df) * (xmax - xmin) / 30, 'r', linewidth=2)
-    
-    plt.title(f'Distribution of {column} with Normal Fit', pad=15, fontsize=14, fontweight='bold')
-    plt.xlabel(column, fontsize=11)
-    plt.ylabel('Frequency', fontsize=11)
-    plt.grid(True, alpha=0.2, color='white' if theme == "Dark" else 'black')
-    
-    # Adjust layout to prevent cutoff
-    plt.tight_layout(pad=1.5)
+    ax.plot(x, p * len(df) * (xmax - xmin) / 30, 'r', linewidth=2)
     
-    # Set figure background to transparent
-    fig.patch.set_alpha(0.0)
-    ax.patch.set_alpha(0.0)
+    style_axes(ax, theme, f'Distribution of {column} with Normal Fit', xlabel=column, ylabel='Frequency')
     
-    return fig
+    return finish_figure(fig, ax)
 
-def create_prediction_plot(df: pd.DataFrame, target: str, feature: str, theme: str) -> plt.Figure:
+@instrument()
+def create_prediction_plot(df: pd.DataFrame, target: str, feature: str, theme: str) -> Figure:
     """Create regression plot with prediction intervals."""
+    palette = get_theme(theme)
     # Reduce figure size by 10%
-    fig = plt.figure(figsize=(10.8, 5.4), facecolor='none')  # Set transparent background
-    ax = fig.add_subplot(111)
-    
-    if theme == "Dark":
-        plt.style.use('dark_background')
-        ax.set_facecolor('none')  # Transparent axis background
-        # Set text colors for dark theme
-        ax.xaxis.label.set_color('white')
-        ax.yaxis.label.set_color('white')
-        ax.title.set_color('white')
-        ax.tick_params(colors='white')
-        for spine in ax.spines.values():
-            spine.set_color('white')
-    else:
-        ax.set_facecolor('none')  # Transparent axis background
-        # Set text colors for light theme
-        ax.xaxis.label.set_color('black')
-        ax.yaxis.label.set_color('black')
-        ax.title.set_color('black')
-        ax.tick_params(colors='black')
-        for spine in ax.spines.values():
-            spine.set_color('black')
+    fig, ax = new_figure((10.8, 5.4))
     
     # Fit regression
-    X = sm.add_constant(df[feature])
-    model = sm.OLS(df[target], X).fit()
+    X = np.column_stack([np.ones(len(df)), df[feature].to_numpy(dtype=np.float64)])
+    fit = _fit_ols(X, df[target].to_numpy(dtype=np.float64))
     
     # Create prediction intervals
-    pred = model.get_prediction(X)
-    pred_intervals = pred.conf_int(alpha=0.05)
+    pred_intervals = fit['prediction_intervals']
     
     # Plot
-    plt.scatter(df[feature], df[target], alpha=0.5, color='#4CAF50' if theme == "Dark" else '#1f77b4')
-    plt.plot(df[feature], model.fittedvalues, 'r-', label='Regression Line')
-    plt.fill_between(df[feature], pred_intervals[:, 0], pred_intervals[:, 1], 
-                    color='gray', alpha=0.2, label='95% Prediction Interval')
-    
-    plt.title(f'{target} vs {feature} with Prediction Intervals', pad=15, fontsize=14, fontweight='bold')
-    plt.xlabel(feature, fontsize=11)
-    plt.ylabel(target, fontsize=11)
-    plt.legend(fontsize=10)
-    plt.grid(True, alpha=0.2, color='white' if theme == "Dark" else 'black')
-    
-    # Adjust layout to prevent cutoff
-    plt.tight_layout(pad=1.5)
+    ax.scatter(df[feature], df[target], alpha=0.5, color=palette.accent)
+    ax.plot(df[feature], fit['fitted_values'], 'r-', label='Regression Line')
+    ax.fill_between(df[feature], pred_intervals[:, 0], pred_intervals[:, 1], 
+                   color='gray', alpha=0.2, label='95% Prediction Interval')
     
-    # Set figure background to transparent
-    fig.patch.set_alpha(0.0)
-    ax.patch.set_alpha(0.0)
+    style_axes(ax, theme, f'{target} vs {feature} with Prediction Intervals', xlabel=feature, ylabel=target)
+    style_legend(ax, theme)
     
-    return fig 
\ No newline at end of file
+    return finish_figure(fig, ax) 
\ No newline at end of file
@@ -4,22 +4,38 @@ from transformers import BertTokenizer, BertModel
 import torch
 from sklearn.metrics.pairwise import cosine_similarity
 import logging
+import threading
+from instrumentation import instrument, stage
+from sketches import TopKSketch
 
 logger = logging.getLogger(__name__)
 
+def top_location_counts(df, market_stats=None, n=3):
+    """
+    Return the listing counts of the n most common locations.
+    
+    Taken from the cube's ``market_stats`` when given; otherwise counted with an exact
+    ``TopKSketch``, which counts categorical codes instead of hashing every location string.
+    """
+    if market_stats and 'top_locations' in market_stats:
+        return market_stats['top_locations'].head(n)
+    return TopKSketch.from_values(df['Location']).top(n)
+
 class PropertyAnalyzer:
     def __init__(self):
         try:
             # Initialize BERT model and tokenizer
-            self.tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
-            self.model = BertModel.from_pretrained('bert-base-uncased')
-            self.model.eval()  # Set to evaluation mode
+            with stage('PropertyAnalyzer.load_bert'):
+                self.tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
+                self.model = BertModel.from_pretrained('bert-base-uncased')
+                self.model.eval()  # Set to evaluation mode
             logger.info("Successfully loaded BERT model")
         except Exception as e:
             logger.error(f"Failed to load BERT model: {str(e)}")
             self.model = None
             self.tokenizer = None
         
+    @instrument()
     def get_bert_embeddings(self, texts):
         """Get BERT embeddings for a list of texts."""
         if self.model is None or self.tokenizer is None:
@@ -40,14 +56,15 @@ class PropertyAnalyzer:
             logger.error(f"Error getting BERT embeddings: {str(e)}")
             return None
     
-    def generate_summary(self, df):
+    @instrument()
+    def generate_summary(self, df, market_stats=None):
         """Generate a summary of the property market analysis."""
         try:
             # Calculate key statistics
             avg_price = df['Price'].mean()
             median_price = df['Price'].median()
             price_range = (df['Price'].min(), df['Price'].max())
-            top_locations = df['Location'].value_counts().head(3)
+            top_locations = top_location_counts(df, market_stats, 3)
             avg_marla = df['Marla'].mean()
             avg_bedrooms = df['Bedrooms'].mean()
             
@@ -85,21 +102,24 @@ class PropertyAnalyzer:
             logger.error(f"Error generating summary: {str(e)}")
             return "Error generating market summary. Please try again later."
     
-    def generate_predictions(self, df):
-        """Generate market predictions based on the data."""
+    @instrument()
+    def generate_predictions(self, df, trends=None):
+        """
+        Generate market predictions based on the data.
+        
+        ``trends`` is an optional ``snapshots.MarketTrends``; growth and trend points are only
+        made from its monthly series, since a single snapshot has no time dimension.
+        """
         try:
             # Calculate trends
-            price_trend = df.groupby('Location')['Price'].mean().sort_values(ascending=False)
-            location_growth = df['Location'].value_counts().pct_change().mean()
+            price_trend = df.groupby('Location', observed=True)['Price'].mean().sort_values(ascending=False)
             
             # Create prediction points
             prediction_points = [
                 f"Top locations by price are {', '.join(price_trend.head(3).index)}",
-                f"Market size is {len(df):,} properties",
-                f"Average location growth rate is {location_growth:.2%}",
-                f"Premium locations show strong price performance",
-                f"Consider investing in high-growth areas"
+                f"Market size is {len(df):,} properties"
             ]
+            prediction_points += self.trend_points(price_trend.index, trends)
             
             # Get BERT embeddings
             embeddings = self.get_bert_embeddings(prediction_points)
@@ -125,19 +145,66 @@ class PropertyAnalyzer:
             logger.error(f"Error generating predictions: {str(e)}")
             return "Error generating market predictions. Please try again later."
 
-def get_market_insights(df):
-    """Get market insights including summary and predictions."""
+    def trend_points(self, locations, trends=None):
+        """Describe month-over-month growth and the price trend of the given locations."""
+        growth = trends.growth(locations) if trends is not None else None
+        if growth is None:
+            return ["Growth rates need snapshots from at least two months",
+                    "Premium locations show strong price performance"]
+        
+        previous, latest = trends.months[-2], trends.months[-1]
+        points = [
+            f"Average rent changed by {growth['mean_price']:+.2%} from {previous} to {latest}",
+            f"Listing volume changed by {growth['listings']:+.2%} from {previous} to {latest}"
+        ]
+        location_growth = trends.location_growth(locations)
+        if location_growth is not None and len(location_growth) > 0:
+            points.append(f"Fastest growing location is {location_growth.index[0]} "
+                          f"({location_growth.iloc[0]:+.2%} median rent)")
+        projection = trends.projected_mean_price(locations)
+        if projection is not None:
+            points.append(f"Average rent is projected at Rs. {projection:,.0f} next month")
+        return points
+
+_analyzer = None
+_analyzer_lock = threading.Lock()
+
+def get_property_analyzer():
+    """Return the process-wide PropertyAnalyzer, loading BERT on first use only."""
+    global _analyzer
+    with _analyzer_lock:
+        if _analyzer is None:
+            _analyzer = PropertyAnalyzer()
+        return _analyzer
+
+@instrument()
+def get_market_insights(df, market_stats=None, analyzer=None, trends=None):
+    """
+    Get market insights including summary and predictions.
+    
+    ``market_stats`` may hold the headline metrics of ``df`` precomputed by
+    ``AggregateCube.summarize``; they are then used instead of rescanning the frame.
+    ``analyzer`` defaults to the shared instance from ``get_property_analyzer``.
+    ``trends`` holds the monthly series of ``snapshots.MarketTrends`` for growth figures.
+    """
     try:
-        analyzer = PropertyAnalyzer()
-        summary = analyzer.generate_summary(df)
-        predictions = analyzer.generate_predictions(df)
+        analyzer = analyzer or get_property_analyzer()
+        summary = analyzer.generate_summary(df, market_stats)
+        predictions = analyzer.generate_predictions(df, trends)
         
         # Generate overall summary by analyzing all results
-        price_range = (df['Price'].min(), df['Price'].max())
-        price_std = df['Price'].std()
-        price_mean = df['Price'].mean()
-        top_locations = df['Location'].value_counts().head(3)
-        price_location_corr = df.groupby('Location')['Price'].mean().std() / price_mean
+        if market_stats:
+            price_range = (market_stats['price_min'], market_stats['price_max'])
+            price_std = market_stats['price_std']
+            price_mean = market_stats['price_mean']
+            top_locations = market_stats['top_locations'].head(3)
+            price_location_corr = market_stats['location_price_cv']
+        else:
+            price_range = (df['Price'].min(), df['Price'].max())
+            price_std = df['Price'].std()
+            price_mean = df['Price'].mean()
+            top_locations = top_location_counts(df, n=3)
+            price_location_corr = df.groupby('Location', observed=True)['Price'].mean().std() / price_mean
         
         # Determine market characteristics
         market_state = "stable" if price_std/price_mean < 0.5 else "volatile"
@@ -164,7 +231,7 @@ indicating {concentration} market concentration. Price variations across locatio
         logger.error(f"Error in get_market_insights: {str(e)}")
         # Fallback to basic statistical summary if model fails
         avg_price = df['Price'].mean()
-        top_locations = df['Location'].value_counts().head(3)
+        top_locations = top_location_counts(df, market_stats, 3)
         
         return {
             "summary": f"Market Summary:\n- Average property price: Rs. {avg_price:,.0f}\n- Top locations: {', '.join(top_locations.index)}",
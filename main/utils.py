@@ -1,18 +1,88 @@
 import pandas as pd
 import numpy as np
 import re
-from typing import Union, Optional
+from matplotlib.ticker import FuncFormatter, MaxNLocator
+from typing import Dict, Union, Optional
+
+# Pakistani price units, largest first: (threshold, divisor, decimals, suffix)
+PRICE_UNITS = [
+    (10000000, 10000000, 2, 'Cr'),  # 1 crore
+    (100000, 100000, 2, 'L'),       # 1 lakh
+    (1000, 1000, 0, 'K')
+]
 
 def format_price_pakistani(value):
     """Format price in Pakistani numbering system (lakhs, crores)."""
-    if value >= 10000000:  # 1 crore
-        return f"{value/10000000:.2f}Cr"
-    elif value >= 100000:  # 1 lakh
-        return f"{value/100000:.2f}L"
-    elif value >= 1000:
-        return f"{value/1000:.0f}K"
+    for threshold, divisor, decimals, suffix in PRICE_UNITS:
+        if value >= threshold:
+            return f"{value / divisor:.{decimals}f}{suffix}"
     return f"{value:.0f}"
 
+def format_prices_pakistani(values) -> np.ndarray:
+    """
+    Format an array of prices in the Pakistani numbering system.
+    
+    Gives the same strings as format_price_pakistani. Each distinct price is formatted once
+    (price columns repeat a few hundred round values), the unit of all of them is selected at
+    once and each unit group is formatted in one call; the strings are then gathered back to
+    the rows.
+    
+    Args:
+        values: Prices (array-like of numbers)
+    
+    Returns:
+        np.ndarray: Object array of formatted strings with the shape of values
+    """
+    values = np.asarray(values, dtype=np.float64)
+    unique, inverse = np.unique(values.ravel(), return_inverse=True)
+    formatted = np.empty(len(unique), dtype=object)
+    remaining = np.ones(len(unique), dtype=bool)
+    for threshold, divisor, decimals, suffix in PRICE_UNITS:
+        in_unit = remaining & (unique >= threshold)
+        if in_unit.any():
+            formatted[in_unit] = np.char.add(np.char.mod(f'%.{decimals}f', unique[in_unit] / divisor), suffix)
+        remaining &= ~in_unit
+    if remaining.any():
+        formatted[remaining] = np.char.mod('%.0f', unique[remaining])
+    return formatted[inverse].reshape(values.shape)
+
+def price_tick_formatter() -> FuncFormatter:
+    """
+    Matplotlib tick formatter for price axes.
+    
+    The renderer formats only the ticks it draws, after the limits are final, so labels never
+    go stale like fixed set_xticklabels lists. Use one formatter per axis.
+    """
+    return FuncFormatter(lambda value, position: format_price_pakistani(value))
+
+def plotly_price_ticks(low: float, high: float, n: int = 6) -> Dict[str, list]:
+    """
+    Tick positions and Pakistani-format labels for a plotly price axis.
+    
+    Plotly's d3 tick formats cannot express lakhs and crores, so the ticks are chosen once
+    (at round values, like matplotlib's) and passed as tickvals/ticktext.
+    
+    Args:
+        low: Lowest price on the axis
+        high: Highest price on the axis
+        n: Maximum number of ticks
+    
+    Returns:
+        Dict with tickvals and ticktext, for fig.update_yaxes(**ticks); a single-value axis
+        (low == high) gets one tick at that value
+    
+    Examples:
+        >>> plotly_price_ticks(50000, 50000)
+        {'tickvals': [50000.0], 'ticktext': ['50K']}
+        >>> plotly_price_ticks(0, 100000, n=2)['tickvals']
+        [0.0, 50000.0, 100000.0]
+    """
+    ticks = MaxNLocator(nbins=n).tick_values(low, high)
+    ticks = ticks[(ticks >= low) & (ticks <= high)]
+    if not len(ticks):
+        ticks = np.array([low], dtype=np.float64)
+    return {'tickvals': ticks.tolist(), 'ticktext': format_prices_pakistani(ticks).tolist()}
+
 
 def parse_price(price_str: Union[str, float]) -> float:
     """
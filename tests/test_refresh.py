@@ -0,0 +1,254 @@
+"""
+Equivalence tests for the incremental dataset refresh.
+
+A delta refresh must give the same listings, location hierarchy, quantile sketches, cube
+sums, correlation accumulators and location aggregates as a full build of the same scrape.
+Imputed values and outlier flags are excluded where refresh_dataset_state documents that
+they follow the last full build instead.
+
+Usage:
+    python -m pytest tests
+"""
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'main'))
+
+from analysis import NUMERIC_COLUMNS  # noqa: E402
+from correlation import CorrelationEngine  # noqa: E402
+from cube import AggregateCube  # noqa: E402
+from locations import LOCATION_LEVELS  # noqa: E402
+from refresh import build_dataset_state, refresh_dataset_state  # noqa: E402
+
+LOCATIONS = ['DHA Phase 5, Lahore', 'Gulberg, Lahore', 'Gulberg III - Block A, Gulberg',
+             'F-11, Islamabad', 'Clifton - Block 2, Clifton', 'Clifton, Karachi']
+WORDS = ['furnished', 'upper', 'lower', 'portion', 'corner', 'park', 'facing', 'brand', 'new', 'house',
+         'apartment', 'flat', 'prime', 'separate', 'entrance', 'gas', 'water', 'parking', 'lawn', 'servant']
+
+
+def make_raw(n_rows: int, seed: int, missing: float = 0.0, locations=LOCATIONS) -> pd.DataFrame:
+    """Raw listings in the scrape's string formats, with distinct Details texts."""
+    rng = np.random.default_rng(seed)
+    bedrooms = rng.integers(1, 6, n_rows)
+    marla = rng.choice([3.0, 5.0, 7.5, 10.0, 20.0], n_rows)
+    price = np.round(marla * rng.uniform(5_000, 15_000, n_rows), -3)
+    washrooms = (bedrooms + rng.integers(0, 2, n_rows)).astype(str).astype(object)
+    washrooms[rng.random(n_rows) < missing] = ''
+    details = [f"{' '.join(rng.choice(WORDS, 6))} listing {seed}-{i}" for i in range(n_rows)]
+    return pd.DataFrame({
+        'Price': [f"{p / 1_000:.0f} Thousand" if p < 100_000 else f"{p / 100_000:.2f} Lakh" for p in price],
+        'Currency': 'PKR',
+        'Location': np.asarray(locations, dtype=object)[rng.integers(0, len(locations), n_rows)],
+        'Bedrooms': bedrooms.astype(str).astype(object),
+        'Washrooms': washrooms,
+        'Marla': marla.astype(str).astype(object),
+        'Details': details
+    })
+
+
+def by_hash(state) -> pd.DataFrame:
+    """The rows of a state keyed and sorted by their raw row hash."""
+    return state.data.set_index(pd.Index(state.data_hashes, name='hash')).sort_index()
+
+
+def cube_cells(cube: AggregateCube, outliers: bool = True) -> pd.DataFrame:
+    """Non-empty cube cells keyed by their labels (cell numbering depends on arrival order)."""
+    cells = pd.DataFrame({'Location': cube.locations[cube.cell_location], 'Bedrooms': cube.cell_bedrooms,
+                          'Marla': cube.cell_marla, 'Outlier': cube.cell_outlier if outliers else False,
+                          'count': cube.count, 'sum': cube.sum, 'sum_sq': cube.sum_sq})
+    cells = cells.groupby(['Location', 'Bedrooms', 'Marla', 'Outlier']).sum()
+    return cells[cells['count'] > 0]
+
+
+def correlation_cells(engine: CorrelationEngine, outliers: bool = True) -> pd.DataFrame:
+    """Non-empty correlation accumulators keyed by cell labels, undoing the engine's shift."""
+    s = engine.shift
+    n, sum_x, sum_xx, sum_xy = engine.n, engine.sum_x, engine.sum_xx, engine.sum_xy
+    # sum_x[:, i, j] sums column i (over rows where i and j are both present)
+    raw_sum_x = sum_x + n * s[:, None]
+    raw_sum_xx = sum_xx + 2 * s[:, None] * sum_x + n * s[:, None] ** 2
+    raw_sum_xy = (sum_xy + s[None, :] * sum_x + s[:, None] * np.transpose(sum_x, (0, 2, 1))
+                  + n * s[:, None] * s[None, :])
+    k = len(engine.columns)
+    pairs = [f"{a}|{b}" for a in engine.columns for b in engine.columns]
+    frames = [pd.DataFrame(acc.reshape(-1, k * k), columns=[f"{name}:{pair}" for pair in pairs])
+              for name, acc in [('n', n), ('x', raw_sum_x), ('xx', raw_sum_xx), ('xy', raw_sum_xy)]]
+    cells = pd.concat(frames, axis=1)
+    cells[['Location', 'Bedrooms', 'Marla', 'Outlier']] = pd.DataFrame({
+        'Location': engine.locations[engine.cell_location], 'Bedrooms': engine.cell_bedrooms,
+        'Marla': engine.cell_marla, 'Outlier': engine.cell_outlier if outliers else False})
+    cells = cells.groupby(['Location', 'Bedrooms', 'Marla', 'Outlier']).sum()
+    return cells[cells.filter(like='n:').sum(axis=1) > 0]
+
+
+def assert_matches_full_build(refreshed, full, compare_imputed: bool = True) -> None:
+    """Check a refreshed state against a full build of the same scrape."""
+    np.testing.assert_array_equal(refreshed.row_hashes, full.row_hashes)
+    assert set(refreshed.data_hashes) == set(full.data_hashes)
+    assert refreshed.parents == full.parents
+    pd.testing.assert_series_equal(refreshed.location_counts.sort_index(), full.location_counts.sort_index(),
+                                   check_names=False, check_index_type=False)
+
+    left, right = by_hash(refreshed), by_hash(full)
+    np.testing.assert_array_equal(by_hash_observed(refreshed), by_hash_observed(full))
+    for col in NUMERIC_COLUMNS:
+        observed = pd.Series(refreshed.observed[:, NUMERIC_COLUMNS.index(col)], index=refreshed.data_hashes)
+        observed = observed.sort_index().to_numpy() | compare_imputed
+        np.testing.assert_array_equal(left[col].to_numpy(dtype=np.float64)[observed],
+                                      right[col].to_numpy(dtype=np.float64)[observed])
+    for col in ['Location', 'Details'] + LOCATION_LEVELS:
+        assert left[col].astype(object).tolist() == right[col].astype(object).tolist(), col
+
+    for col in NUMERIC_COLUMNS:
+        np.testing.assert_array_equal(refreshed.sketches[col].keys, full.sketches[col].keys)
+        np.testing.assert_array_equal(refreshed.sketches[col].counts, full.sketches[col].counts)
+
+    # Outlier flags follow the fences of the last full build, so cells are compared across them
+    pd.testing.assert_frame_equal(cube_cells(refreshed.cube, outliers=False),
+                                  cube_cells(full.cube, outliers=False), rtol=1e-9)
+    for level, table in full.location_aggregates.tables.items():
+        pd.testing.assert_frame_equal(refreshed.location_aggregates.tables[level].sort_index(),
+                                      table.sort_index(), check_dtype=False, check_categorical=False)
+    if compare_imputed:
+        pd.testing.assert_frame_equal(correlation_cells(refreshed.correlation, outliers=False),
+                                      correlation_cells(full.correlation, outliers=False), rtol=1e-6, atol=1e-3)
+
+
+def by_hash_observed(state) -> np.ndarray:
+    """The observed mask of a state in row hash order."""
+    return state.observed[np.argsort(state.data_hashes, kind='stable')]
+
+
+def assert_consistent(state) -> None:
+    """Check the incremental structures of a state against ones built from its data."""
+    pd.testing.assert_frame_equal(cube_cells(state.cube), cube_cells(AggregateCube(state.data)), rtol=1e-9)
+    pd.testing.assert_frame_equal(correlation_cells(state.correlation),
+                                  correlation_cells(CorrelationEngine(state.data)), rtol=1e-6, atol=1e-3)
+    rebuilt = CorrelationEngine(state.data)
+    np.testing.assert_array_equal(state.correlation.rank_order, rebuilt.rank_order)
+    np.testing.assert_array_equal(state.correlation.rank_groups, rebuilt.rank_groups)
+    assert len(state.observed) == len(state.data) == len(state.data_hashes)
+
+
+def test_additions_match_full_build():
+    raw = make_raw(600, seed=1)
+    state = build_dataset_state(raw.iloc[:400])
+    refreshed, stats = refresh_dataset_state(state, raw)
+
+    assert stats['mode'] == 'delta'
+    assert stats['delta_rows'] == 200 and stats['removed_rows'] == 0
+    assert_matches_full_build(refreshed, build_dataset_state(raw))
+    assert_consistent(refreshed)
+
+
+def test_removals_and_additions_match_full_build():
+    raw = make_raw(600, seed=2)
+    state = build_dataset_state(raw.iloc[:400])
+    scrape = pd.concat([raw.iloc[50:150], raw.iloc[200:600]])
+    refreshed, stats = refresh_dataset_state(state, scrape)
+
+    assert stats['mode'] == 'delta'
+    assert stats['delta_rows'] == 200 and stats['removed_rows'] == 100
+    assert_matches_full_build(refreshed, build_dataset_state(scrape))
+    assert_consistent(refreshed)
+
+
+def test_removals_update_sketches_of_observed_values():
+    raw = make_raw(600, seed=3, missing=0.2)
+    state = build_dataset_state(raw)
+    scrape = raw.iloc[100:]
+    refreshed, stats = refresh_dataset_state(state, scrape)
+
+    assert stats['removed_rows'] == 100 and stats['delta_rows'] == 0
+    assert_matches_full_build(refreshed, build_dataset_state(scrape), compare_imputed=False)
+    assert_consistent(refreshed)
+
+
+def test_parent_map_changes_move_existing_rows():
+    raw = make_raw(400, seed=4)
+    state = build_dataset_state(raw)
+    assert state.parents['Gulberg'] == 'Lahore'
+
+    # Gulberg now also appears under Islamabad, so its blocks no longer resolve to a city
+    ambiguous = make_raw(30, seed=5, locations=['Gulberg, Islamabad'])
+    scrape = pd.concat([raw, ambiguous], ignore_index=True)
+    refreshed, _ = refresh_dataset_state(state, scrape)
+    assert 'Gulberg' not in refreshed.parents
+    assert refreshed.data.loc[refreshed.data['Location'] == 'Gulberg III - Block A, Gulberg', 'City'].isna().all()
+    assert_matches_full_build(refreshed, build_dataset_state(scrape))
+    assert_consistent(refreshed)
+
+    # Removing those listings restores the parent
+    restored, _ = refresh_dataset_state(refreshed, raw)
+    assert restored.parents['Gulberg'] == 'Lahore'
+    assert_matches_full_build(restored, build_dataset_state(raw))
+    assert_consistent(restored)
+
+
+def test_reposts_are_dropped_and_rechecked_after_removal():
+    raw = make_raw(300, seed=6)
+    state = build_dataset_state(raw)
+
+    # A re-post keeps everything but rewords the title slightly
+    original = raw.iloc[[10]]
+    repost = original.assign(Details=original['Details'] + '!')
+    with_repost = pd.concat([raw, repost], ignore_index=True)
+    refreshed, stats = refresh_dataset_state(state, with_repost)
+    assert stats['mode'] == 'unchanged'
+    assert len(refreshed.data) == len(state.data)
+
+    # Once the original is gone, the re-post is kept in its place
+    without_original = with_repost.drop(index=original.index)
+    replaced, stats = refresh_dataset_state(refreshed, without_original)
+    assert stats['removed_rows'] == 1 and stats['delta_rows'] == 1
+    assert_matches_full_build(replaced, build_dataset_state(without_original))
+    assert_consistent(replaced)
+
+
+@pytest.mark.parametrize('seed', [7, 8])
+def test_refresh_chain_matches_full_build(seed):
+    raw = make_raw(900, seed=seed, missing=0.05)
+    rng = np.random.default_rng(seed)
+    state = build_dataset_state(raw.iloc[:300])
+    for _ in range(3):
+        scrape = raw[rng.random(len(raw)) < 0.6]
+        state, _ = refresh_dataset_state(state, scrape)
+        assert_consistent(state)
+    assert_matches_full_build(state, build_dataset_state(scrape), compare_imputed=False)
+
+
+def test_removals_parse_only_reposts_of_removed_listings(monkeypatch):
+    import refresh
+
+    raw = make_raw(300, seed=9)
+    # Re-posts of three listings, dropped by the full build
+    originals = raw.iloc[[10, 20, 30]]
+    reposts = originals.assign(Details=originals['Details'] + '!')
+    with_reposts = pd.concat([raw, reposts], ignore_index=True)
+    state = build_dataset_state(with_reposts)
+    assert len(state.data) == len(raw)
+
+    parsed_rows = []
+    parse = refresh.parse_listing_columns
+    monkeypatch.setattr(refresh, 'parse_listing_columns', lambda df: parsed_rows.append(len(df)) or parse(df))
+
+    # Removing an unrelated listing parses nothing; removing an original parses only its re-post
+    refreshed, stats = refresh_dataset_state(state, with_reposts.drop(index=[5]))
+    assert parsed_rows == [] and stats['removed_rows'] == 1
+    scrape = with_reposts.drop(index=[5, 20])
+    replaced, stats = refresh_dataset_state(refreshed, scrape)
+    assert parsed_rows == [1]
+    assert stats['removed_rows'] == 1 and stats['delta_rows'] == 1
+    assert_matches_full_build(replaced, build_dataset_state(scrape))
+    assert_consistent(replaced)
+
+    # A re-post that is no longer listed is forgotten
+    assert len(replaced.duplicates.repost_ids) == 2
+    parsed_rows.clear()
+    dropped, _ = refresh_dataset_state(replaced, scrape.iloc[:-1])
+    assert len(dropped.duplicates.repost_ids) == 1 and parsed_rows == []